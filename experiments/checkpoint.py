@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import types
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+"""
+Checkpoints of the (subset, run) units of an experiment, to resume an interrupted sweep.
+
+A unit is identified by a key hashing everything that determines its results: its parameter set, initial state,
+timesteps, simulation, subset and run indices (the random streams are seeded by (subset, run), and the partition
+rows hold both) and recording options, and the git commit of the model code (with any uncommitted changes to the code
+and model data, but not to the run logs and outputs that experiments write to the working tree).
+When a unit's partition has been written to a `PartitionedResultStore`, its key and partition path are appended
+to the `checkpoint.jsonl` file of the checkpoint directory. Only completed units are recorded: the units that ran
+to the end, or that failed with a model exception; a unit lost to the worker, e.g. caught by radCAD's fail-safe
+or out of memory, is run again.
+
+A later experiment with a completed unit links the checkpointed partition into its own store instead of running it,
+so a resumed sweep produces the same store as an uninterrupted one. The (subset, run) random streams
+(see `parts.random_streams`) make each unit's results independent of the other units.
+
+The checkpoint also records how long each unit took, by parameter set and timesteps, for any commit,
+and how far into its timesteps it ran, to predict the cost of the units of later experiments.
+"""
+
+
+# The files whose uncommitted changes determine results: the Python code, and the models with their data,
+# but not the run logs (`experiment_run_log.md`) and outputs that `run_experiment` rewrites after every run
+code_pathspecs = (":(top)*.py", ":(top)models", ":(top,exclude)*.md")
+
+
+def current_git_hash(directory: str = None) -> str:
+    """
+    The git commit of the working tree, with a hash of the uncommitted changes to the code if any;
+    None outside of a git repository
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=directory, stderr=subprocess.DEVNULL).strip().decode("utf-8")
+        diff = subprocess.check_output(["git", "diff", "HEAD", "--", *code_pathspecs], cwd=directory, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}+{hashlib.sha256(diff).hexdigest()[:12]}" if diff else commit
+
+
+def is_completed(exception) -> bool:
+    """
+    Whether a radCAD exception record, as returned by `core.multiprocess_wrapper`, is that of a completed unit:
+    a unit that ran to the end, or failed with a model exception, rather than a failure of its worker
+    """
+    return isinstance(exception, dict) and not isinstance(exception.get("exception"), MemoryError)
+
+
+def progress(result: list, timesteps: int) -> float:
+    """
+    The fraction of its timesteps a unit ran, from its radCAD results: less than 1 if it failed
+    """
+    if not result or not result[-1] or not timesteps:
+        return 0.0
+    return min(result[-1][-1]["timestep"] / timesteps, 1.0)
+
+
+def _update(digest, value) -> None:
+    # Order- and identity-independent serialization of parameter and state values
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+    elif isinstance(value, Enum):
+        digest.update(f"enum:{value!r};".encode())
+    elif isinstance(value, dict):
+        digest.update(f"dict:{len(value)};".encode())
+        for key in sorted(value, key=repr):
+            _update(digest, key)
+            _update(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)};".encode())
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, np.ndarray):
+        digest.update(f"ndarray:{value.dtype.str}:{value.shape};".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        labels = value.columns.tolist() if isinstance(value, pd.DataFrame) else [value.name]
+        digest.update(f"{type(value).__name__}:{labels!r};".encode())
+        digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif isinstance(value, types.FunctionType):
+        # e.g. the `error_term` lambda: hashed by its code and captured values
+        digest.update(f"function:{value.__module__}.{value.__qualname__};".encode())
+        _update(digest, value.__code__)
+        _update(digest, value.__defaults__)
+        _update(digest, [cell.cell_contents for cell in value.__closure__ or ()])
+    elif isinstance(value, types.CodeType):
+        digest.update(value.co_code)
+        _update(digest, value.co_consts)
+        _update(digest, value.co_names)
+    elif isinstance(value, np.generic):
+        _update(digest, value.item())
+    elif hasattr(value, "values") and isinstance(value.values, np.ndarray):
+        # e.g. an `ExogenousDriver`, which is pickled by reference when memory-mapped
+        digest.update(f"{type(value).__qualname__};".encode())
+        _update(digest, value.values)
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        digest.update(f"{type(value).__qualname__};".encode())
+        _update(digest, vars(value))
+    else:
+        digest.update(pickle.dumps(value, protocol=4))
+
+
+def fingerprint(value) -> str:
+    """
+    SHA-256 hash of a parameter set, initial state, or any other value of an experiment
+    """
+    digest = hashlib.sha256()
+    _update(digest, value)
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, directory: str, git_hash: str = None):
+        """
+        `git_hash` defaults to the git commit of the current working directory, see `current_git_hash()`
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "checkpoint.jsonl")
+        self.git_hash = git_hash if git_hash is not None else current_git_hash()
+        self.durations = {}
+        self.progress = []
+        self.timestep_durations = []
+        self.completed = self._read()
+        self._fingerprints = {}
+
+    def _read(self) -> dict:
+        completed = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    completed[entry["key"]] = entry["path"]
+                    self._record_cost(entry)
+        except FileNotFoundError:
+            pass
+        return completed
+
+    def _record_cost(self, entry: dict) -> None:
+        if entry.get("duration") is None:
+            return
+        self.durations.setdefault(entry["cost_key"], []).append(entry["duration"])
+        if entry.get("progress") is not None:
+            self.progress.append(entry["progress"])
+            self.timestep_durations.append(entry["duration"] / max(entry["progress"] * entry["timesteps"], 1))
+
+    def _fingerprint(self, value) -> str:
+        # The parameter values are shared by the units of an experiment, e.g. the exogenous drivers
+        if id(value) not in self._fingerprints:
+            self._fingerprints[id(value)] = (value, fingerprint(value))
+        return self._fingerprints[id(value)][1]
+
+    def unit_key(self, simulation_execution) -> str:
+        """
+        The key of the (subset, run) unit of a radCAD simulation execution
+        """
+        params = {key: self._fingerprint(value) for key, value in simulation_execution.params.items()}
+        return fingerprint({
+            "git_hash": self.git_hash,
+            "params": params,
+            "initial_state": self._fingerprint(simulation_execution.initial_state),
+            "timesteps": simulation_execution.timesteps,
+            "simulation": simulation_execution.simulation_index,
+            "subset": simulation_execution.subset_index,
+            "run": simulation_execution.run_index,
+            "drop_substeps": simulation_execution.drop_substeps,
+            "recording": getattr(simulation_execution, "recording", None),
+        })
+
+    def cost_key(self, simulation_execution) -> str:
+        """
+        The key of the parameter set and timesteps of a unit, shared by its runs, and by any commit
+        """
+        params = {key: self._fingerprint(value) for key, value in simulation_execution.params.items()}
+        return fingerprint({"params": params, "timesteps": simulation_execution.timesteps})
+
+    def predicted_cost(self, simulation_execution, prior=None) -> float:
+        """
+        The predicted duration of a unit in seconds: the median duration of the units with its parameter set.
+
+        For a new parameter set, the prior is its timesteps, or `prior(simulation_execution)` in timesteps
+        (e.g. more for a parameter set that is slower to simulate), times the median fraction of their timesteps
+        the recorded units ran, at the median duration of a recorded timestep, or 1 second without any.
+        The checkpoint is shared by unrelated experiments, so neither depends on the unit's subset index.
+        """
+        durations = self.durations.get(self.cost_key(simulation_execution))
+        if durations:
+            return float(np.median(durations))
+        timesteps = prior(simulation_execution) if prior is not None else simulation_execution.timesteps
+        fraction = float(np.median(self.progress)) if self.progress else 1.0
+        seconds = float(np.median(self.timestep_durations)) if self.timestep_durations else 1.0
+        return timesteps * fraction * seconds
+
+    def restore(self, key: str, store, subset: int, run: int) -> bool:
+        """
+        Link the checkpointed partition of a unit into `store`, returning False if the unit isn't completed
+        """
+        path = self.completed.get(key)
+        if path is None or not os.path.exists(path):
+            return False
+        target = store.partition_path(subset, run)
+        if os.path.exists(target) and os.path.samefile(path, target):
+            return True
+        staging = target + ".restore"
+        try:
+            os.link(path, staging)
+        except OSError:
+            shutil.copyfile(path, staging)
+        os.replace(staging, target)
+        return True
+
+    def record(self, key: str, path: str, cost_key: str = None, duration: float = None,
+               timesteps: int = None, progress: float = None) -> None:
+        """
+        Record a completed unit, once its partition has been written to `path`, with its `cost_key()`, duration,
+        timesteps and `progress()`
+        """
+        path = os.path.abspath(path)
+        entry = {
+            "key": key, "path": path, "cost_key": cost_key, "duration": duration,
+            "timesteps": timesteps, "progress": progress,
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.completed[key] = path
+        self._record_cost(entry)
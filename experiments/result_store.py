@@ -0,0 +1,212 @@
+import os
+import re
+import tempfile
+import time
+import logging
+
+import pandas as pd
+
+from radcad.engine import Engine
+from radcad.backends import Backend
+import radcad.core as core
+import radcad.wrappers as wrappers
+
+from experiments.checkpoint import is_completed, progress
+from experiments.utils import results_to_dataframe
+
+"""
+Partitioned on-disk store of experiment results, written as the experiment runs.
+
+Each (subset, run) of an experiment is a partition: a pickle file holding the results DataFrame of the run
+and its radCAD exception record, written atomically as soon as the run completes. Peak memory is bounded by
+the runs in flight, instead of the whole experiment, and the partitions of completed runs survive a crash.
+
+`StreamingEngine` is a radCAD engine that writes each run to a store instead of collecting the results,
+and, with an `experiments.checkpoint.Checkpoint`, only runs the (subset, run) units that aren't already completed.
+Its workers take one run at a time, so no worker idles while runs are left, and with a `cost` function
+the runs are dispatched longest first, so the long runs don't all end up at the tail of the experiment.
+"""
+
+
+class PartitionedResultStore:
+    partition_pattern = re.compile(r"subset-(\d+)_run-(\d+)\.pkl")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def partition_path(self, subset: int, run: int) -> str:
+        return os.path.join(self.directory, f"subset-{subset}_run-{run}.pkl")
+
+    def partitions(self) -> list:
+        """
+        The (subset, run) of every written partition, in radCAD order: runs, then subsets
+        """
+        matches = (self.partition_pattern.fullmatch(name) for name in os.listdir(self.directory))
+        keys = [(int(match[1]), int(match[2])) for match in matches if match]
+        return sorted(keys, key=lambda key: (key[1], key[0]))
+
+    def write(self, subset: int, run: int, results: list, exception: dict = None) -> None:
+        """
+        Write the flat list of result states, and the exception record, of a (subset, run)
+        """
+        df = results_to_dataframe(results)
+        exceptions = pd.DataFrame([exception] if exception is not None else [])
+        if 'parameters' in exceptions:
+            # As `save_to_HDF5()`: the parameters may hold lambdas, which can't be pickled
+            exceptions['parameters'] = exceptions['parameters'].to_json()
+
+        # Write to a temporary file and rename it, so a crash never leaves a partial partition
+        descriptor, staging = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(descriptor)
+        try:
+            pd.to_pickle({"results": df, "exceptions": exceptions}, staging)
+            os.replace(staging, self.partition_path(subset, run))
+        except BaseException:
+            os.remove(staging)
+            raise
+
+    def write_run(self, subset: int, run: int, result: list, exception) -> dict:
+        """
+        Write the radCAD results and exception record of a (subset, run), as returned by `execute_run()`,
+        returning the exception record
+        """
+        if not isinstance(exception, dict):
+            # radCAD's fail-safe for errors outside of the simulation, without a record
+            logging.error(f"Run {run} / subset {subset} failed: {exception!r}")
+            exception = {'exception': exception, 'run': run, 'subset': subset}
+        self.write(subset, run, [state for substates in result for state in substates], exception)
+        return exception
+
+    def write_experiment(self, results: list, exceptions: list) -> None:
+        """
+        Write the results and exceptions of a completed experiment, partitioned by (subset, run)
+        """
+        partitions = {}
+        for state in results:
+            partitions.setdefault((state['subset'], state['run']), []).append(state)
+        for exception in exceptions:
+            key = (exception['subset'], exception['run'])
+            self.write(*key, partitions.pop(key, []), exception)
+        for key, states in partitions.items():
+            self.write(*key, states)
+
+    def read(self, subset: int, run: int) -> dict:
+        return pd.read_pickle(self.partition_path(subset, run))
+
+    def results(self, columns: list = None) -> pd.DataFrame:
+        """
+        Load the results of every partition into a single DataFrame, in the same order as radCAD
+        """
+        frames = []
+        for key in self.partitions():
+            df = self.read(*key)["results"]
+            frames.append(df[columns] if columns is not None else df)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def exceptions(self) -> pd.DataFrame:
+        frames = [self.read(*key)["exceptions"] for key in self.partitions()]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def to_HDF5(self, store_file_name, store_key, now):
+        """
+        Export the results and exceptions to an HDF5 store, with the same keys and metadata as `save_to_HDF5()`
+        """
+        store = pd.HDFStore(store_file_name)
+        store.put(f'results_{store_key}', self.results())
+        store.put(f'exceptions_{store_key}', self.exceptions())
+        for key in (f'results_{store_key}', f'exceptions_{store_key}'):
+            store.get_storer(key).attrs.metadata = {'date': now.isoformat()}
+        store.close()
+
+
+def execute_run(simulation_execution):
+    """
+    Execute a (subset, run) in a worker, returning its (subset, run), the radCAD results and exception record,
+    and the duration of the run in seconds
+    """
+    start = time.time()
+    result, exception = core.multiprocess_wrapper(simulation_execution)
+    return simulation_execution.subset_index, simulation_execution.run_index, result, exception, time.time() - start
+
+
+class StreamingEngine(Engine):
+    """
+    radCAD engine writing each (subset, run) to a `PartitionedResultStore` as soon as it completes,
+    in the order runs complete.
+
+    The experiment `results` are left empty, and its `exceptions` hold the exception records
+    without the initial state, of the units run by the engine.
+
+    `cost` predicts the cost of a radCAD simulation execution, e.g. `Checkpoint.predicted_cost`,
+    or an experiment's own cost function.
+    """
+
+    def __init__(self, store: PartitionedResultStore, checkpoint=None, cost=None, **kwargs):
+        self.store = store
+        self.checkpoint = checkpoint
+        self.cost = cost
+        self._unit_keys = {}
+        super().__init__(**kwargs)
+
+    def _pending(self, simulation_executions):
+        # Restore the completed units from the checkpoint, and yield the others
+        restored = 0
+        for simulation_execution in simulation_executions:
+            unit = (simulation_execution.subset_index, simulation_execution.run_index)
+            key = self.checkpoint.unit_key(simulation_execution)
+            self._unit_keys[unit] = key, self.checkpoint.cost_key(simulation_execution), simulation_execution.timesteps
+            if self.checkpoint.restore(key, self.store, *unit):
+                restored += 1
+                continue
+            yield simulation_execution
+        logging.info(f"Restored {restored} completed runs from checkpoint {self.checkpoint.path}")
+
+    def _execute(self, simulation_executions):
+        if self.backend == Backend.SINGLE_PROCESS:
+            yield from map(execute_run, simulation_executions)
+            return
+        if self.backend not in (Backend.PATHOS, Backend.DEFAULT):
+            raise Exception(f"StreamingEngine backend must be PATHOS or SINGLE_PROCESS, not {self.backend}")
+        from pathos.multiprocessing import ProcessPool
+        pool = ProcessPool(self.processes)
+        try:
+            # One run per task, handed to the next idle worker
+            yield from pool.uimap(execute_run, simulation_executions, chunksize=1)
+            pool.close()
+            pool.join()
+        finally:
+            pool.clear()
+
+    def _run(self, executable=None, **kwargs):
+        if not executable:
+            raise Exception("Experiment or simulation required as Executable argument")
+        if kwargs:
+            raise Exception(f"Invalid Engine option in {kwargs}")
+        self.executable = executable
+        experiment = executable if isinstance(executable, wrappers.Experiment) else None
+        simulations = executable.simulations if experiment else [executable]
+
+        executable._before_experiment(experiment=experiment)
+        exceptions = []
+        simulation_executions = self._run_stream(simulations)
+        if self.checkpoint is not None:
+            simulation_executions = self._pending(simulation_executions)
+        if self.cost is not None:
+            # Longest first; sorted() is stable, so runs of equal cost keep the radCAD order
+            simulation_executions = sorted(simulation_executions, key=self.cost, reverse=True)
+        for subset, run, result, exception, duration in self._execute(simulation_executions):
+            completed = is_completed(exception)
+            exception = self.store.write_run(subset, run, result, exception)
+            if self.checkpoint is not None and completed:
+                key, cost_key, timesteps = self._unit_keys[(subset, run)]
+                self.checkpoint.record(
+                    key, self.store.partition_path(subset, run), cost_key, duration,
+                    timesteps=timesteps, progress=progress(result, timesteps),
+                )
+            exceptions.append({key: value for key, value in exception.items() if key != 'initial_state'})
+
+        executable.results = []
+        executable.exceptions = exceptions
+        executable._after_experiment(experiment=experiment)
+        return executable.results
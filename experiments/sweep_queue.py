@@ -0,0 +1,324 @@
+import argparse
+import copy
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import statistics
+import threading
+import time
+import traceback
+
+import dill
+
+try:
+    from radcad.core import generate_parameter_sweep
+except ImportError:
+    from radcad.utils import generate_parameter_sweep
+
+from experiments.checkpoint import Checkpoint, is_completed, progress
+from experiments.result_store import PartitionedResultStore, execute_run
+from experiments.worker_pool import pool_size, threads_per_worker
+from models.utils.recording import RecordingSimulationExecution
+
+"""
+Work queue of the (subset, run) tasks of a parameter sweep, shared by any number of worker processes,
+on one host or on several hosts sharing a file system.
+
+A sweep directory holds:
+* sweep.pkl: the model, timesteps, runs and recording spec of the sweep, pickled with dill
+* queue.sqlite: the task queue, one row per (subset, run)
+* results/: the `PartitionedResultStore` the workers write to
+
+Workers claim a task with a lease, and renew the lease while running it. The task of a worker that dies
+is claimed again when its lease expires, and a task that fails (or whose lease expires) `max_attempts` times
+is marked as failed. Model exceptions are results, recorded in the task partition as in radCAD, not task failures;
+failures outside of the model, e.g. out of memory, are task failures (see `checkpoint.is_completed()`).
+
+When there are no tasks left to claim, idle workers run a speculative copy of stragglers, the running tasks
+that take much longer than the completed ones; the first copy to complete wins, and since a task's results
+don't depend on the worker, both copies write the same partition.
+
+e.g. `SweepQueue.create(directory, model, timesteps, runs)` on one host, then `python -m experiments.sweep_queue directory`
+on each host. SQLite locking requires a file system with working POSIX locks, e.g. not every NFS setup.
+"""
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Set according to the host in `run_workers()`, unless already set
+NUMEXPR_MAX_THREADS = os.environ.get('NUMEXPR_MAX_THREADS')
+
+
+class SweepQueue:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.store = PartitionedResultStore(os.path.join(directory, 'results'))
+        self.connection = sqlite3.connect(os.path.join(directory, 'queue.sqlite'), timeout=60, isolation_level=None)
+
+    @classmethod
+    def create(cls, directory, model, timesteps, runs, recording=None, max_attempts=3, checkpoint: Checkpoint = None, cost=None) -> "SweepQueue":
+        """
+        Create the queue of a sweep, with a task for each (subset, run) of the model's parameter sweep,
+        in radCAD order, or longest predicted first with a `checkpoint` or a `cost` function of the task's
+        simulation execution (with a checkpoint, the prior of `Checkpoint.predicted_cost`);
+        the units completed in `checkpoint` are restored instead
+        """
+        os.makedirs(directory, exist_ok=True)
+        spec = {
+            'model': model,
+            'timesteps': timesteps,
+            'runs': runs,
+            'recording': recording,
+            'max_attempts': max_attempts,
+            'checkpoint': None if checkpoint is None else {
+                'directory': os.path.dirname(checkpoint.path), 'git_hash': checkpoint.git_hash,
+            },
+        }
+        with open(os.path.join(directory, 'sweep.pkl'), 'wb') as f:
+            dill.dump(spec, f)
+
+        queue = cls(directory)
+        queue.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                subset INTEGER, run INTEGER, status TEXT, attempts INTEGER DEFAULT 0, copies INTEGER DEFAULT 0,
+                worker TEXT, lease_expires REAL, started REAL, finished REAL, error TEXT,
+                PRIMARY KEY (subset, run)
+            );
+        ''')
+        param_sweep = generate_parameter_sweep(model.params) or [model.params]
+        tasks = []
+        costs = {}
+        for run in range(1, runs + 1):
+            for subset in range(len(param_sweep)):
+                status = PENDING
+                if checkpoint is not None:
+                    simulation_execution = queue._simulation_execution(spec, param_sweep, subset, run)
+                    if checkpoint.restore(checkpoint.unit_key(simulation_execution), queue.store, subset, run):
+                        status = DONE
+                    costs[(subset, run)] = checkpoint.predicted_cost(simulation_execution, prior=cost)
+                elif cost is not None:
+                    costs[(subset, run)] = cost(queue._simulation_execution(spec, param_sweep, subset, run))
+                tasks.append((subset, run, status))
+        # The tasks are claimed in insertion order: longest predicted first
+        tasks.sort(key=lambda task: costs.get(task[:2], 0.0), reverse=True)
+        queue.connection.executemany('INSERT OR IGNORE INTO tasks (subset, run, status) VALUES (?, ?, ?)', tasks)
+        return queue
+
+    @staticmethod
+    def _simulation_execution(spec, param_sweep, subset, run):
+        # As radCAD's engine, for a single simulation
+        simulation_execution = RecordingSimulationExecution(
+            raise_exceptions=False,
+            enable_deepcopy=False,
+            drop_substeps=True,
+            recording=spec['recording'],
+        )
+        simulation_execution.simulation_index = 0
+        simulation_execution.timesteps = spec['timesteps']
+        simulation_execution.run_index = run
+        simulation_execution.subset_index = subset
+        simulation_execution.initial_state = spec['model'].initial_state
+        simulation_execution.state_update_blocks = spec['model'].state_update_blocks
+        simulation_execution.params = param_sweep[subset]
+        return copy.deepcopy(simulation_execution)
+
+    def _transaction(self, function):
+        # Serialize the queue updates of all the workers
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = function()
+            self.connection.execute('COMMIT')
+            return result
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker: str, lease: float, max_attempts: int, straggler_factor: float = None):
+        """
+        Claim a pending task, or a task whose lease expired, for `lease` seconds, returning its (subset, run),
+        or with `straggler_factor`, a straggler to run a speculative copy of, returning (subset, run, True);
+        None if there is no task to claim
+        """
+        def claim():
+            now = time.time()
+            while True:
+                task = self.connection.execute(
+                    'SELECT subset, run, attempts FROM tasks WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY rowid LIMIT 1',
+                    (PENDING, RUNNING, now),
+                ).fetchone()
+                if task is None:
+                    break
+                subset, run, attempts = task
+                if attempts >= max_attempts:
+                    self.connection.execute(
+                        'UPDATE tasks SET status = ?, error = coalesce(error, ?) WHERE subset = ? AND run = ?',
+                        (FAILED, 'Lease expired', subset, run),
+                    )
+                    continue
+                self.connection.execute(
+                    'UPDATE tasks SET status = ?, worker = ?, attempts = attempts + 1, lease_expires = ?, started = ? WHERE subset = ? AND run = ?',
+                    (RUNNING, worker, now + lease, now, subset, run),
+                )
+                return subset, run
+            if straggler_factor is None:
+                return None
+            durations = [row[0] for row in self.connection.execute('SELECT finished - started FROM tasks WHERE status = ? AND started IS NOT NULL', (DONE,))]
+            if not durations:
+                return None
+            straggler = self.connection.execute(
+                'SELECT subset, run FROM tasks WHERE status = ? AND copies = 0 AND worker != ? AND started < ? ORDER BY started LIMIT 1',
+                (RUNNING, worker, now - straggler_factor * statistics.median(durations)),
+            ).fetchone()
+            if straggler is None:
+                return None
+            self.connection.execute('UPDATE tasks SET copies = copies + 1 WHERE subset = ? AND run = ?', straggler)
+            return (*straggler, True)
+
+        return self._transaction(claim)
+
+    def renew(self, subset: int, run: int, worker: str, lease: float) -> None:
+        self.connection.execute(
+            'UPDATE tasks SET lease_expires = ? WHERE subset = ? AND run = ? AND status = ? AND worker = ?',
+            (time.time() + lease, subset, run, RUNNING, worker),
+        )
+
+    def complete(self, subset: int, run: int, worker: str) -> bool:
+        """
+        Mark a task as done, returning False if another copy of the task completed first
+        """
+        cursor = self.connection.execute(
+            'UPDATE tasks SET status = ?, worker = ?, finished = ?, error = NULL WHERE subset = ? AND run = ? AND status != ?',
+            (DONE, worker, time.time(), subset, run, DONE),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, subset: int, run: int, worker: str, error: str, max_attempts: int) -> None:
+        """
+        Release a task that failed in `worker`, to be retried, or mark it as failed after `max_attempts`
+        """
+        self.connection.execute(
+            'UPDATE tasks SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, error = ?, lease_expires = NULL '
+            'WHERE subset = ? AND run = ? AND status = ? AND worker = ?',
+            (max_attempts, PENDING, FAILED, error, subset, run, RUNNING, worker),
+        )
+
+    def status(self) -> dict:
+        """
+        The number of tasks of each status
+        """
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(self.connection.execute('SELECT status, count(*) FROM tasks GROUP BY status'))
+        return counts
+
+    def tasks(self) -> list:
+        cursor = self.connection.execute('SELECT * FROM tasks ORDER BY rowid')
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def run_worker(directory: str, worker: str = None, lease: float = 60.0, poll: float = 1.0, straggler_factor: float = 3.0) -> int:
+    """
+    Run the tasks of a sweep queue until every task is done or failed, returning the number of tasks run.
+
+    The lease of a running task is renewed every `lease / 3` seconds. Set `straggler_factor` to None
+    to disable the speculative copies of stragglers.
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    queue = SweepQueue(directory)
+    with open(os.path.join(directory, 'sweep.pkl'), 'rb') as f:
+        spec = dill.load(f)
+    param_sweep = generate_parameter_sweep(spec['model'].params) or [spec['model'].params]
+    max_attempts = spec['max_attempts']
+    checkpoint = None
+    if spec['checkpoint'] is not None:
+        checkpoint = Checkpoint(spec['checkpoint']['directory'], git_hash=spec['checkpoint']['git_hash'])
+
+    tasks_run = 0
+    while True:
+        task = queue.claim(worker, lease, max_attempts, straggler_factor)
+        if task is None:
+            status = queue.status()
+            if status[PENDING] == 0 and status[RUNNING] == 0:
+                break
+            time.sleep(poll)
+            continue
+        subset, run = task[:2]
+        speculative = len(task) == 3
+        logging.info(f"Worker {worker} running subset {subset} / run {run}{' (speculative)' if speculative else ''}")
+
+        stop = threading.Event()
+        if not speculative:
+            def renew_lease():
+                # A connection per thread
+                renewals = SweepQueue(directory)
+                while not stop.wait(lease / 3):
+                    renewals.renew(subset, run, worker, lease)
+                renewals.close()
+            renewal = threading.Thread(target=renew_lease, daemon=True)
+            renewal.start()
+        try:
+            simulation_execution = SweepQueue._simulation_execution(spec, param_sweep, subset, run)
+            # The key of the unit, before the execution updates its initial state
+            if checkpoint is not None:
+                key, cost_key = checkpoint.unit_key(simulation_execution), checkpoint.cost_key(simulation_execution)
+            _, _, result, exception, duration = execute_run(simulation_execution)
+            if not is_completed(exception):
+                # A failure of the worker rather than the model, e.g. out of memory: retried as a task failure
+                raise RuntimeError(f"Run failed outside of the model: {exception!r}")
+            queue.store.write_run(subset, run, result, exception)
+            if checkpoint is not None:
+                checkpoint.record(
+                    key, queue.store.partition_path(subset, run), cost_key, duration,
+                    timesteps=spec['timesteps'], progress=progress(result, spec['timesteps']),
+                )
+        except Exception:
+            logging.error(f"Worker {worker} failed subset {subset} / run {run}")
+            if not speculative:
+                queue.fail(subset, run, worker, traceback.format_exc(), max_attempts)
+            continue
+        finally:
+            stop.set()
+        queue.complete(subset, run, worker)
+        tasks_run += 1
+
+    queue.close()
+    return tasks_run
+
+
+def run_workers(directory: str, processes: int = None, **kwargs) -> dict:
+    """
+    Run `processes` local workers on a sweep queue, and return the task status counts.
+
+    `processes` defaults to `worker_pool.pool_size()` for the tasks left, from the host's available cores and memory.
+    """
+    if processes is None:
+        queue = SweepQueue(directory)
+        status = queue.status()
+        queue.close()
+        processes = pool_size(status[PENDING] + status[RUNNING])
+    # The workers share the cores, instead of each running a thread per core
+    os.environ['NUMEXPR_MAX_THREADS'] = NUMEXPR_MAX_THREADS or str(threads_per_worker(processes))
+    workers = [multiprocessing.Process(target=run_worker, args=(directory,), kwargs=kwargs) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    queue = SweepQueue(directory)
+    status = queue.status()
+    queue.close()
+    return status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the workers of a sweep queue on this host')
+    parser.add_argument('directory')
+    parser.add_argument('--processes', type=int, default=None)
+    arguments = parser.parse_args()
+    print(run_workers(arguments.directory, arguments.processes))
@@ -4,6 +4,7 @@ import numpy as np
 
 from models.system_model_v3.model.params.init import params
 from models.system_model_v3.model.state_variables.init import state_variables
+from models.system_model_v3.model.parts.exogenous import ExogenousDriver
 
 from experiments.system_model_v3.configure import configure_experiment
 from experiments.system_model_v3.run import run_experiment
@@ -31,6 +32,11 @@ experiment_metrics = f'''
 
 '''
 
+# ETH price shocks, one Monte Carlo run per shock
+timesteps = np.arange(SIMULATION_TIMESTEPS + 1)
+shock = timesteps >= 24 * 14
+impulse = shock & (timesteps < 24 * 14 + 6)
+
 # Override parameters
 params_override = {
     'controller_enabled': [True],
@@ -39,16 +45,16 @@ params_override = {
     'liquidity_demand_enabled': [False],
     'arbitrageur_considers_liquidation_ratio': [True],
     'liquidity_demand_shock': [False],
-    'eth_price': [lambda run, timestep, df=None: [
+    'eth_price': [ExogenousDriver(np.stack([
         # Shocks at 14 days; controller turns on at 7 days
-        300,
-        300 if timestep < 24 * 14 else 300 * 1.3, # 30% step, remains for rest of simulation
-        300 * 1.3 if timestep in list(range(24*14, 24*14 + 6, 1)) else 300, # 30% impulse for 6 hours
-        300 if timestep < 24 * 14 else 300 * 0.7, # negative 30% step, remains for rest of simulation
-        300 * 0.7 if timestep in list(range(24*14, 24*14 + 6, 1)) else 300, # negative 30% impulse for 6 hours
-    ][run - 1]],
-    'liquidity_demand_events': [lambda run, timestep, df=None: 0],
-    'token_swap_events': [lambda run, timestep, df=None: 0],
+        np.full(len(timesteps), 300.0),
+        np.where(shock, 300 * 1.3, 300), # 30% step, remains for rest of simulation
+        np.where(impulse, 300 * 1.3, 300), # 30% impulse for 6 hours
+        np.where(shock, 300 * 0.7, 300), # negative 30% step, remains for rest of simulation
+        np.where(impulse, 300 * 0.7, 300), # negative 30% impulse for 6 hours
+    ]))],
+    'liquidity_demand_events': [ExogenousDriver(np.zeros(len(timesteps)))],
+    'token_swap_events': [ExogenousDriver(np.zeros(len(timesteps)))],
 }
 params.update(params_override)
 
@@ -1,16 +1,24 @@
 from experiments.utils import save_to_HDF5, update_experiment_run_log
+from experiments.result_store import PartitionedResultStore, StreamingEngine
+from experiments.checkpoint import Checkpoint
+from experiments.worker_pool import pool_size, threads_per_worker
 
 from radcad import Model, Simulation, Experiment
 from radcad.engine import Engine, Backend
+try:
+    from radcad.core import generate_parameter_sweep
+except ImportError:
+    from radcad.utils import generate_parameter_sweep
 
 from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
-from models.system_model_v3.model.params.init import params
-from models.system_model_v3.model.state_variables.init import state_variables
-
-from models.system_model_v3.model.params.init import eth_price_df
+import models.system_model_v3.model.params.init as default_params
+import models.system_model_v3.model.state_variables.init as default_state
+from models.system_model_v3.model.lockstep import LockstepExperiment
+from models.utils.recording import RecordingSimulationExecution
 
 import logging
 import datetime
+import functools
 import subprocess
 import time
 import os
@@ -19,8 +27,8 @@ import pandas as pd
 import pprint
 
 
-# Set according to environment
-os.environ['NUMEXPR_MAX_THREADS'] = '8'
+# Set according to environment in `run_experiment()`, unless already set
+NUMEXPR_MAX_THREADS = os.environ.get('NUMEXPR_MAX_THREADS')
 
 # Get experiment details
 hash = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip().decode("utf-8")
@@ -39,7 +47,42 @@ def configure_logging(output_directory, date):
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
-def run_experiment(results_id, output_directory, experiment_metrics, timesteps=SIMULATION_TIMESTEPS, runs=MONTE_CARLO_RUNS, params=params, initial_state=state_variables, state_update_blocks=partial_state_update_blocks):
+def run_experiment(results_id, output_directory, experiment_metrics, timesteps=SIMULATION_TIMESTEPS, runs=MONTE_CARLO_RUNS, params=None, initial_state=None, state_update_blocks=partial_state_update_blocks, lockstep=False, retain_history=True, stream_results=True, recording=None, resume=True, processes=None, cost=None):
+    """
+    Run a system_model_v3 experiment, and save the results.
+
+    With `stream_results`, each (subset, run) is written to the partitioned result store
+    `{output_directory}/experiment_results/{results_id}` as soon as it completes, see `experiments.result_store`,
+    and the returned experiment has no `results`; the store is exported to the experiment HDF5 store
+    `{output_directory}/experiment_results.hdf5` at the end of the experiment. Otherwise the results are kept
+    in memory, and saved to the experiment HDF5 store at the end of the experiment.
+
+    With `stream_results` and `resume`, the completed (subset, run) units are checkpointed in
+    `{output_directory}/experiment_results/checkpoint.jsonl`, and the units completed by an earlier
+    experiment with the same parameters and git commit are copied to the store instead of being run again,
+    see `experiments.checkpoint`. The lockstep engine doesn't resume.
+
+    `processes` defaults to a pool sized from the available cores and memory, see `experiments.worker_pool`.
+    When streaming, the runs are handed to the workers one at a time, longest predicted first from
+    the durations recorded in the checkpoint, see `Checkpoint.predicted_cost`. `cost` is the experiment's
+    prior of the cost of a run in timesteps, a function of its radCAD simulation execution,
+    for the parameter sets without recorded durations, e.g. a first run of the sweep.
+
+    Set `lockstep` to run the (subset, run) pairs together with the lockstep engine, in `processes` shards,
+    instead of one radCAD simulation per pair. The system_model_v3 functions do not read the state history,
+    so the lockstep engine can be run with `retain_history=False` to only pass them the last two timesteps,
+    and spill the older ones to disk. The lockstep lanes run together, so they are only written to the store
+    at the end of the experiment, one lane at a time.
+
+    Set `recording` to a `models.utils.recording.RecordingSpec` to only record some state variables and timesteps,
+    e.g. the KPI columns once a day.
+
+    `params` and `initial_state` default to the shared `params` and `state_variables` of the model.
+    """
+    if params is None:
+        params = default_params.params
+    if initial_state is None:
+        initial_state = default_state.state_variables
     configure_logging(output_directory + '/logs', now)
     
     passed = False
@@ -55,20 +98,43 @@ def run_experiment(results_id, output_directory, experiment_metrics, timesteps=S
 
         # Run cadCAD simulation
         model = Model(
-            initial_state=state_variables,
-            state_update_blocks=partial_state_update_blocks,
+            initial_state=initial_state,
+            state_update_blocks=state_update_blocks,
             params=params
         )
-        simulation = Simulation(model=model, timesteps=timesteps, runs=runs)
-        experiment = Experiment([simulation])
-        experiment.engine = Engine(
-            backend=Backend.PATHOS,
-            raise_exceptions=False,
-            deepcopy=False,
-            processes=8,
-            drop_substeps=True,
-        )
-        experiment.after_experiment = lambda experiment: save_to_HDF5(experiment, output_directory + '/experiment_results.hdf5', results_id, now)
+        store = PartitionedResultStore(f'{output_directory}/experiment_results/{results_id}') if stream_results else None
+        if processes is None:
+            processes = pool_size(runs * len(generate_parameter_sweep(params) or [params]))
+        logging.info(f"Running with {processes} processes")
+        # The workers share the cores, instead of each running a thread per core
+        os.environ['NUMEXPR_MAX_THREADS'] = NUMEXPR_MAX_THREADS or str(threads_per_worker(processes))
+        if lockstep:
+            experiment = LockstepExperiment(model, timesteps=timesteps, runs=runs, retain_history=retain_history, recording=recording, store=store, processes=processes)
+        else:
+            simulation = Simulation(model=model, timesteps=timesteps, runs=runs)
+            experiment = Experiment([simulation])
+            engine_options = dict(
+                backend=Backend.PATHOS,
+                processes=processes,
+                simulation_execution=RecordingSimulationExecution(
+                    raise_exceptions=False,
+                    enable_deepcopy=False,
+                    drop_substeps=True,
+                    recording=recording,
+                ),
+            )
+            if stream_results:
+                checkpoint = Checkpoint(f'{output_directory}/experiment_results') if resume else None
+                if checkpoint is not None:
+                    cost = functools.partial(checkpoint.predicted_cost, prior=cost)
+                experiment.engine = StreamingEngine(store, checkpoint=checkpoint, cost=cost, **engine_options)
+            else:
+                experiment.engine = Engine(**engine_options)
+        if not stream_results:
+            experiment.after_experiment = lambda experiment: save_to_HDF5(experiment, output_directory + '/experiment_results.hdf5', results_id, now)
+        else:
+            # The experiment HDF5 store read by the notebooks
+            experiment.after_experiment = lambda experiment: store.to_HDF5(output_directory + '/experiment_results.hdf5', results_id, now)
         experiment.run()
         
         exceptions = pd.DataFrame(experiment.exceptions)
@@ -18,9 +18,16 @@ def batch(iterable, n=1):
     for ndx in range(0, l, n):
         yield iterable[ndx:min(ndx + n, l)]
 
+def results_to_dataframe(results):
+    df = pd.DataFrame(results)
+    if 'cdps' in df:
+        # Convert columnar CDP books back to the DataFrame format at the export edge
+        df['cdps'] = df['cdps'].map(lambda cdps: cdps.to_dataframe() if hasattr(cdps, 'to_dataframe') else cdps)
+    return df
+
 def save_to_HDF5(experiment, store_file_name, store_key, now):
     store = pd.HDFStore(store_file_name)
-    store.put(f'results_{store_key}', pd.DataFrame(experiment.results))
+    store.put(f'results_{store_key}', results_to_dataframe(experiment.results))
     exceptions = pd.DataFrame(experiment.exceptions)
     exceptions['parameters'] = exceptions['parameters'].to_json()
     store.put(f'exceptions_{store_key}', exceptions)
@@ -0,0 +1,58 @@
+import os
+
+"""
+Sizing of the experiment worker pool from the cores and memory of the host.
+
+Each worker runs one (subset, run) at a time, so the pool is sized to the cores available to the process
+(e.g. restricted by a container or `taskset`), limited by the available memory divided by the memory of a worker,
+and by the number of runs. The cores are shared by the workers, so each worker gets `threads_per_worker()`
+threads for its thread pools, e.g. numexpr's.
+"""
+
+# Peak memory of a system_model_v3 worker running a 6 month simulation, with some headroom
+default_process_memory = 1 << 30
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # e.g. macOS
+        return os.cpu_count() or 1
+
+
+def available_memory() -> int:
+    """
+    Memory available to new processes in bytes, or None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def pool_size(tasks: int = None, process_memory: int = default_process_memory) -> int:
+    """
+    Number of worker processes for `tasks` runs, at least 1
+    """
+    size = available_cores()
+    memory = available_memory()
+    if memory is not None and process_memory:
+        size = min(size, memory // process_memory)
+    if tasks is not None:
+        size = min(size, tasks)
+    return max(size, 1)
+
+
+def threads_per_worker(processes: int) -> int:
+    """
+    Number of threads of each of `processes` workers, at least 1
+    """
+    return max(available_cores() // max(processes, 1), 1)
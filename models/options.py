@@ -13,3 +13,8 @@ class DebtPriceSource(Enum): # Used for v1 model
 class MarketPriceSource(Enum): # Used for v1 model
     DEFAULT = 1 # Calculate the market price based on the historically fitted market model
     EXTERNAL = 2 # Use the parameter "price_move", a function that returns the price move at each timestep
+
+class PriceMeanType(Enum): # Used for v3 model APT expected market price
+    CUMULATIVE = 1 # Mean of the full price history
+    WINDOW = 2 # Mean of the last N prices
+    EWMA = 3 # Exponentially weighted moving average, with a span of N prices
@@ -7,7 +7,7 @@ from models.utils.process_results import drop_dataframe_midsteps
 from models.config_wrapper import ConfigWrapper
 
 
-def run(config: ConfigWrapper, drop_midsteps: bool=True, use_radcad=False) -> pd.DataFrame:
+def run(config: ConfigWrapper, drop_midsteps: bool=True, use_radcad=False, recording: 'RecordingSpec'=None) -> pd.DataFrame:
     config.append() # Append the simulation config to the cadCAD `configs` list
 
     # Configure the Python logging framework, logs saved to `logs/` directory with the current timestamp.
@@ -25,6 +25,7 @@ def run(config: ConfigWrapper, drop_midsteps: bool=True, use_radcad=False) -> pd
     if use_radcad:
         from radcad import Model, Simulation, Experiment
         from radcad.engine import Engine, Backend
+        from models.utils.recording import RecordingSimulationExecution
 
         model = Model(
             initial_state=config.initial_state,
@@ -33,10 +34,14 @@ def run(config: ConfigWrapper, drop_midsteps: bool=True, use_radcad=False) -> pd
         )
         simulation = Simulation(model=model, timesteps=len(list(config.T)), runs=config.N)
         experiment = Experiment([simulation])
+        # If set, the `models.utils.recording` spec selects the state variables and timesteps recorded in the results
         experiment.engine = Engine(
             backend=Backend.PATHOS, # Backend.SINGLE_PROCESS
-            raise_exceptions=False,
-            deepcopy=False,
+            simulation_execution=RecordingSimulationExecution(
+                raise_exceptions=False,
+                enable_deepcopy=False,
+                recording=recording,
+            ),
         )
 
         raw_result = experiment.run()
@@ -63,6 +68,8 @@ def run(config: ConfigWrapper, drop_midsteps: bool=True, use_radcad=False) -> pd
 
         # Execute the simulation, and return the raw results (list of dictionaries containing states)
         raw_result, tensor_field, sessions = run.execute()
+        if recording is not None:
+            raw_result = recording.records(raw_result)
 
         # Convert the raw results to a Pandas dataframe
         df = pd.DataFrame(raw_result)
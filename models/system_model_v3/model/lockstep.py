@@ -0,0 +1,476 @@
+import copy
+import logging
+import pickle
+import tempfile
+import traceback
+from typing import Dict, List
+
+import numpy as np
+
+try:
+    from radcad.core import generate_parameter_sweep
+except ImportError:
+    from radcad.utils import generate_parameter_sweep
+
+from models.system_model_v3.model.parts.batched import batched_functions
+
+"""
+Lockstep multi-run engine.
+
+Runs every (subset, run) pair of a simulation together, one timestep at a time, instead of one radCAD
+simulation per pair. Each pair is a "lane":
+* float state variables are stored as float64 columns with one element per lane,
+  all other state variables (e.g. the CDP book and the Uniswap oracle) as per-lane objects
+* PSUB functions with an array kernel in `parts.batched.batched_functions` are evaluated once
+  for all active lanes; all other functions are evaluated per lane on a lightweight state view
+* lanes that raise (e.g. the `failure_modes` exceptions), or that an array kernel reports as failed,
+  are masked out of later timesteps and recorded as radCAD exceptions
+
+The results and exceptions have the same format and order as radCAD with `drop_substeps=True`
+(runs, then subsets, then timesteps), so they convert to the same per-run DataFrame as `run_experiment`.
+
+With `retain_history=False`, functions only receive the last two recorded timesteps as `state_history`,
+for models whose functions read the current state instead of the history (e.g. system_model_v3),
+and the older timesteps are spilled to a temporary file once `p_free_memory` has cleared them,
+so the memory held by the history doesn't grow with the timesteps. The state values that aren't plain data
+(e.g. the `event_draws` of a run) are kept in memory by reference, as they are in radCAD's history,
+instead of being written with every timestep.
+
+With a `recording` spec (see `models.utils.recording`), the history is recorded with the spec as the lanes run.
+
+`LockstepExperiment` with a `store` (e.g. an `experiments.result_store.PartitionedResultStore`)
+writes the results one lane at a time instead of collecting them, and with `processes`,
+shards the lanes across a pathos pool.
+"""
+
+# Spilled as they are, other values are kept in memory by reference
+_plain_types = (dict, list, tuple, str, bytes, int, float, bool, type(None), np.generic)
+_plain_exact_types = frozenset(_plain_types[:-1])
+
+
+class _SpillPickler(pickle.Pickler):
+    def __init__(self, file, references):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.references = references
+
+    def persistent_id(self, value):
+        if type(value) in _plain_exact_types or isinstance(value, _plain_types):
+            return None
+        self.references[id(value)] = value
+        return id(value)
+
+
+class _SpillUnpickler(pickle.Unpickler):
+    def __init__(self, file, references):
+        super().__init__(file)
+        self.references = references
+
+    def persistent_load(self, key):
+        return self.references[key]
+
+
+class LaneState:
+    """
+    Read-only state dict view of a single lane, passed to per-lane policies and state update functions
+    """
+
+    __slots__ = ("_engine", "_lane")
+
+    def __init__(self, engine, lane):
+        self._engine = engine
+        self._lane = lane
+
+    def __getitem__(self, key):
+        column = self._engine.columns[key]
+        return column.item(self._lane) if isinstance(column, np.ndarray) else column[self._lane]
+
+    def __contains__(self, key):
+        return key in self._engine.columns
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return self._engine.columns.keys()
+
+    def items(self):
+        return ((key, self[key]) for key in self.keys())
+
+    def copy(self):
+        return dict(self.items())
+
+
+class BatchView:
+    """
+    Mapping of state variables, parameters or policy signals to arrays over the active lanes
+    """
+
+    def __init__(self, get, lanes):
+        self._get = get
+        self._lanes = lanes
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            values = self._get(key)
+            if isinstance(values, np.ndarray):
+                self._cache[key] = values[self._lanes]
+            else:
+                self._cache[key] = np.asarray([values[lane] for lane in self._lanes])
+        return self._cache[key]
+
+
+class LockstepEngine:
+    def __init__(self, initial_state, state_update_blocks, params, timesteps, runs, raise_exceptions=False, retain_history=True, recording=None, shard=(0, 1)):
+        """
+        With `shard=(index, count)`, the engine only runs every `count`th lane from `index`, see `LockstepExperiment`
+        """
+        self.state_update_blocks = state_update_blocks
+        self.timesteps = timesteps
+        self.raise_exceptions = raise_exceptions
+        self.retain_history = retain_history
+        self.recording = recording
+
+        param_sweep = generate_parameter_sweep(params) or [params]
+        # radCAD order: runs, then subsets
+        self.lanes = [
+            {"simulation": 0, "subset": subset, "run": run + 1, "params": param_set}
+            for run in range(runs)
+            for subset, param_set in enumerate(param_sweep)
+        ][shard[0]::shard[1]]
+        self.params = [lane["params"] for lane in self.lanes]
+        self._param_columns = {}
+
+        states = []
+        for lane in self.lanes:
+            state = copy.deepcopy(initial_state)
+            state.update(simulation=lane["simulation"], subset=lane["subset"], run=lane["run"], substep=0)
+            state.setdefault("timestep", 0)
+            states.append(state)
+        self.initial_states = states
+        self.columns: Dict[str, object] = {
+            key: self._column([state[key] for state in states]) for key in states[0]
+        }
+
+        self.active = np.ones(len(self.lanes), dtype=bool)
+        # Per-lane state history, with the final substep of each timestep;
+        # without `retain_history`, only the last two timesteps, the older ones are spilled
+        self.histories: List[list] = [[[state]] for state in states]
+        self._spill = None
+        if not retain_history:
+            self._spill = tempfile.TemporaryFile()
+            self._spill_references = {}
+            self._spill_pickler = _SpillPickler(self._spill, self._spill_references)
+            # The file offsets of the spilled timesteps of each lane
+            self._spilled: List[list] = [[] for _ in self.lanes]
+        self.exceptions = [None] * len(self.lanes)
+        self.tracebacks = [None] * len(self.lanes)
+
+    @staticmethod
+    def _column(values):
+        if all(isinstance(value, float) for value in values):
+            return np.array(values, dtype=np.float64)
+        return list(values)
+
+    def _param(self, key):
+        if key not in self._param_columns:
+            self._param_columns[key] = self._column([params[key] for params in self.params])
+        return self._param_columns[key]
+
+    def _fail(self, lane, exception, trace=None):
+        if self.raise_exceptions:
+            raise exception
+        logging.warning(f"Lockstep lane run {self.lanes[lane]['run']} / subset {self.lanes[lane]['subset']} failed: {exception!r}")
+        self.active[lane] = False
+        self.exceptions[lane] = exception
+        self.tracebacks[lane] = trace or "".join(traceback.format_exception(exception))
+
+    def _call(self, function, lane, substep, *args):
+        state_history = self.histories[lane] if self.retain_history else self.histories[lane][-2:]
+        return function(self.params[lane], substep, state_history, *args)
+
+    @staticmethod
+    def _add_signals(acc, signals):
+        # Same aggregation as radCAD for multiple policies in a block
+        for key, value in signals.items():
+            if acc.get(key, None):
+                acc[key] += value
+            else:
+                acc[key] = value
+        return acc
+
+    @staticmethod
+    def _add_batched_signals(acc, signals):
+        for key, value in signals.items():
+            acc[key] = acc[key] + value if key in acc else value
+        return acc
+
+    def _fail_lanes(self, lanes, kernel_failed, kernel, failed):
+        if kernel_failed is None:
+            return
+        exception_type = getattr(kernel, "exception", Exception)
+        for position in np.flatnonzero(kernel_failed & ~failed):
+            failed[position] = True
+            self._fail(lanes[position], exception_type(f"{kernel.__name__} failed"))
+
+    def _execute_policies(self, substep, block, lanes):
+        """
+        Returns the batched signals (arrays over `lanes`), per-lane signals (dicts keyed by lane),
+        and the mask of lanes that failed
+        """
+        batched = {}
+        per_lane = {}
+        failed = np.zeros(len(lanes), dtype=bool)
+        for function in block["policies"].values():
+            kernel = batched_functions.get(function)
+            if kernel is not None:
+                signals, kernel_failed = kernel(
+                    BatchView(self._param, lanes), substep, None, BatchView(self.columns.__getitem__, lanes)
+                )
+                self._add_batched_signals(batched, signals)
+                self._fail_lanes(lanes, kernel_failed, kernel, failed)
+                continue
+            for position, lane in enumerate(lanes):
+                if failed[position]:
+                    continue
+                try:
+                    signals = self._call(function, lane, substep, LaneState(self, lane))
+                except Exception as e:
+                    self._fail(lane, e)
+                    failed[position] = True
+                    continue
+                self._add_signals(per_lane.setdefault(lane, {}), signals)
+        return batched, per_lane, failed
+
+    def _lane_signals(self, batched, per_lane, position, lane):
+        signals = dict(per_lane.get(lane, {}))
+        for key, values in batched.items():
+            value = values[position]
+            self._add_signals(signals, {key: value.item() if isinstance(value, np.generic) else value})
+        return signals
+
+    def _execute_substep(self, substep, block, lanes):
+        batched, per_lane, failed = self._execute_policies(substep, block, lanes)
+        if failed.any():
+            lanes = lanes[~failed]
+            batched = {key: values[~failed] for key, values in batched.items()}
+
+        lane_signals = None
+        if per_lane or any(batched_functions.get(function) is None for function in block["variables"].values()):
+            lane_signals = [self._lane_signals(batched, per_lane, position, lane) for position, lane in enumerate(lanes)]
+
+        def signal_column(key):
+            if lane_signals is None:
+                return batched[key]
+            return self._column([signals[key] for signals in lane_signals])
+
+        # Compute every update from the same pre-substep state, then apply them
+        failed = np.zeros(len(lanes), dtype=bool)
+        updates = {}
+        for variable, function in block["variables"].items():
+            if variable not in self.columns:
+                raise KeyError(f"Invalid state key {variable} in partial state update block")
+            kernel = batched_functions.get(function)
+            if kernel is not None:
+                key, values, kernel_failed = kernel(
+                    BatchView(self._param, lanes),
+                    substep,
+                    None,
+                    BatchView(self.columns.__getitem__, lanes),
+                    BatchView(signal_column, np.arange(len(lanes))),
+                )
+                if key != variable:
+                    raise KeyError(f"PSU state key {variable} doesn't match function state key {key}")
+                self._fail_lanes(lanes, kernel_failed, kernel, failed)
+                updates[variable] = values
+                continue
+            values = [None] * len(lanes)
+            for position, lane in enumerate(lanes):
+                if failed[position]:
+                    continue
+                try:
+                    key, value = self._call(function, lane, substep, LaneState(self, lane), lane_signals[position])
+                except Exception as e:
+                    self._fail(lane, e)
+                    failed[position] = True
+                    continue
+                if key != variable:
+                    raise KeyError(f"PSU state key {variable} doesn't match function state key {key}")
+                values[position] = value
+            updates[variable] = values
+
+        ok = ~failed
+        lanes = lanes[ok]
+        for variable, values in updates.items():
+            self._write(variable, lanes, [value for value, keep in zip(values, ok) if keep])
+        return lanes
+
+    def _write(self, key, lanes, values):
+        column = self.columns[key]
+        if isinstance(column, np.ndarray):
+            values = np.asarray(values)
+            if values.dtype.kind in "fiu":
+                column[lanes] = values
+                return
+            column = self.columns[key] = list(column)
+        for lane, value in zip(lanes, values):
+            column[lane] = value.item() if isinstance(value, np.generic) else value
+
+    def _spill_timestep(self, lane, substates, keep=False):
+        if self.recording is not None:
+            substates = self.recording.record_timestep(substates, keep=keep or not self._spilled[lane])
+        self._spill.seek(0, 2)
+        self._spilled[lane].append(self._spill.tell())
+        self._spill_pickler.dump(substates)
+        # The memo would keep every spilled state alive
+        self._spill_pickler.clear_memo()
+
+    def _record(self, lanes):
+        # Read each column once for all the lanes, instead of each lane state through a `LaneState`
+        keys = list(self.columns)
+        values = [
+            column[lanes].tolist() if isinstance(column, np.ndarray) else [column[lane] for lane in lanes]
+            for column in self.columns.values()
+        ]
+        for lane, state in zip(lanes, zip(*values)):
+            history = self.histories[lane]
+            history.append([dict(zip(keys, state))])
+            if self._spill is not None and len(history) > 2:
+                self._spill_timestep(lane, history.pop(0))
+            elif self.recording is not None and len(history) >= 3:
+                # As radCAD with a recording spec, the last two timesteps are kept as they are
+                self.recording.record_history(history, len(history) - 3, len(history) - 2)
+
+    def lane_results(self, lane):
+        """
+        The flat list of result states of a lane
+        """
+        if self._spill is None:
+            return [state for substates in self.histories[lane] for state in substates]
+        results = []
+        for offset in self._spilled[lane]:
+            self._spill.seek(offset)
+            results.extend(_SpillUnpickler(self._spill, self._spill_references).load())
+        return results
+
+    def execute(self):
+        """
+        Run the lanes, without collecting the results, see `lane_results()`
+        """
+        for timestep in range(self.timesteps):
+            lanes = np.flatnonzero(self.active)
+            if len(lanes) == 0:
+                break
+            for substep, block in enumerate(self.state_update_blocks):
+                lanes = self._execute_substep(substep, block, lanes)
+                # As in radCAD, the first substep observes the previous timestep, and later substeps the current one
+                self._write("timestep", lanes, [timestep + 1] * len(lanes))
+                self._write("substep", lanes, [substep + 1] * len(lanes))
+            self._record(lanes)
+        if self._spill is not None:
+            for lane, history in enumerate(self.histories):
+                while history:
+                    self._spill_timestep(lane, history.pop(0), keep=len(history) == 0)
+        elif self.recording is not None:
+            for history in self.histories:
+                self.recording.record_history(history, max(len(history) - 2, 0), len(history), last=True)
+
+    def run(self):
+        self.execute()
+        return self.results, self.exception_records
+
+    @property
+    def results(self) -> list:
+        return [state for lane in range(len(self.lanes)) for state in self.lane_results(lane)]
+
+    @property
+    def exception_records(self) -> list:
+        return [
+            {
+                "exception": self.exceptions[lane],
+                "traceback": self.tracebacks[lane],
+                "simulation": self.lanes[lane]["simulation"],
+                "run": self.lanes[lane]["run"],
+                "subset": self.lanes[lane]["subset"],
+                "timesteps": self.timesteps,
+                "parameters": self.params[lane],
+                "initial_state": self.initial_states[lane],
+            }
+            for lane in range(len(self.lanes))
+        ]
+
+
+def _run_shard(experiment, shard):
+    # Run a shard of the lanes, in a pool worker
+    engine = experiment._engine(shard)
+    engine.execute()
+    exceptions = engine.exception_records
+    if experiment.store is not None:
+        for lane, exception in enumerate(exceptions):
+            experiment.store.write(exception["subset"], exception["run"], engine.lane_results(lane), exception)
+        return None, exceptions
+    return [engine.lane_results(lane) for lane in range(len(exceptions))], exceptions
+
+
+class LockstepExperiment:
+    """
+    Drop-in replacement for a single-simulation radCAD `Experiment`, run with the lockstep engine.
+
+    With `processes`, the lanes are split into as many shards, each run by a lockstep engine in a pathos worker:
+    the per-lane functions (e.g. the CDP book policies) run in parallel, and the array kernels over each shard.
+    """
+
+    def __init__(self, model, timesteps, runs, raise_exceptions=False, retain_history=True, recording=None, store=None, processes=1):
+        self.model = model
+        self.timesteps = timesteps
+        self.runs = runs
+        self.raise_exceptions = raise_exceptions
+        self.retain_history = retain_history
+        self.recording = recording
+        self.store = store
+        self.processes = processes
+        self.results = []
+        self.exceptions = []
+        self.after_experiment = None
+
+    def _engine(self, shard):
+        return LockstepEngine(
+            self.model.initial_state,
+            self.model.state_update_blocks,
+            self.model.params,
+            self.timesteps,
+            self.runs,
+            raise_exceptions=self.raise_exceptions,
+            retain_history=self.retain_history,
+            recording=self.recording,
+            shard=shard,
+        )
+
+    def run(self):
+        lanes = self.runs * len(generate_parameter_sweep(self.model.params) or [self.model.params])
+        shards = max(min(self.processes or 1, lanes), 1)
+        if shards == 1:
+            outputs = [_run_shard(self, (0, 1))]
+        else:
+            from pathos.multiprocessing import ProcessPool
+            pool = ProcessPool(shards)
+            try:
+                outputs = pool.map(_run_shard, [self] * shards, [(index, shards) for index in range(shards)])
+                pool.close()
+                pool.join()
+            finally:
+                pool.clear()
+
+        # Interleave the shards back into radCAD order: lane `i` of shard `index` is lane `index + i * shards`
+        order = sorted(
+            (index + position * shards, index, position)
+            for index, (_, exceptions) in enumerate(outputs)
+            for position in range(len(exceptions))
+        )
+        self.exceptions = [outputs[index][1][position] for _, index, position in order]
+        self.results = [] if self.store is not None else [
+            state for _, index, position in order for state in outputs[index][0][position]
+        ]
+        if self.after_experiment:
+            self.after_experiment(experiment=self)
+        return self.results
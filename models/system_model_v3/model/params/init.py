@@ -1,8 +1,6 @@
-from typing import Callable
-import numpy as np
-import pandas as pd
-from pandas.core.frame import DataFrame
+from __future__ import annotations
 
+from typing import TYPE_CHECKING, Callable, Optional
 
 from models.system_model_v3.model.types import *
 
@@ -10,19 +8,39 @@ import models.options as options
 from models.constants import SPY, RAY
 
 from models.system_model_v3.model.state_variables.system import stability_fee
-from models.system_model_v3.model.state_variables.historical_state import eth_price_df, liquidity_demand_df, token_swap_df
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+def mc_data_driver(csv_path):
+    from models.system_model_v3.model.parts.exogenous import ExogenousDriver
+    from models.system_model_v3.model.state_variables.historical_state import cache_mc_data, load_mc_data
+
+    # Memory-map the cached data, so the driver is pickled by reference
+    try:
+        return ExogenousDriver.load(cache_mc_data(csv_path))
+    except OSError:
+        return ExogenousDriver.from_dataframe(load_mc_data(csv_path))
 
 
 '''
 See https://medium.com/reflexer-labs/introducing-proto-rai-c4cf1f013ef for current/launch values
+
+Importing this module has no side effects: the parameters are created by `load_params()`,
+and the module attribute `params` (and the Monte Carlo data DataFrames) on first access.
 '''
 
 
 class ReflexerModelParameters(TypedDict):
     debug: bool
     raise_on_assert: bool
+    random_seed: int
     free_memory_states: List[str]
+    ledger_reconciliation_period: Timestep
+    cdp_metrics_period: Optional[Timestep]
     IntegralType: object
+    PriceMeanType: object
+    eth_price_mean_window: Timestep
     # IntegralType
     eth_price: Callable[[Run, Timestep], List[USD_per_ETH]]
     liquidity_demand_events: Callable[[Run, Timestep, DataFrame], exaRAI]
@@ -51,73 +69,98 @@ class ReflexerModelParameters(TypedDict):
     debt_ceiling: RAI
     stability_fee: Callable[[Timestep, DataFrame],  Percentage_Per_Second]
     uniswap_fee: Percentage
+    shadow_oracle_configs: List[dict]
     gas_price: ETH
     swap_gas_used: Gwei
     cdp_gas_used: Gwei
 
 
 
-params = {
-    # Admin parameters
-    'debug': [False], # Print debug messages (see APT model)
-    'raise_on_assert': [True], # See assert_log() in utils.py
-    'free_memory_states': [['events', 'cdps', 'uniswap_oracle']],
-
-    # Configuration options
-    options.IntegralType.__name__: [options.IntegralType.LEAKY.value],
-
-    # Exogenous states, loaded as parameter at every timestep - these are lambda functions, and have to be called
-    'eth_price': [lambda run, timestep, df=eth_price_df: df[str(run-1)].iloc[timestep]],
-    'liquidity_demand_events': [lambda run, timestep, df=liquidity_demand_df: df[str(run-1)].iloc[timestep]],
-    'token_swap_events': [lambda run, timestep, df=token_swap_df: df[str(run-1)].iloc[timestep]],
-    'seconds_passed': [lambda timestep, df=None: 3600],
+def load_params() -> dict:
+    """
+    Create the default parameters, with the exogenous drivers loaded from the Monte Carlo data
+    """
+    from models.system_model_v3.model.state_variables.historical_state import eth_price_file, liquidity_demand_file, token_swap_file
+
+    params = {
+        # Admin parameters
+        'debug': [False], # Print debug messages (see APT model)
+        'raise_on_assert': [True], # See assert_log() in utils.py
+        'random_seed': [0], # Master seed of the random stream of each (subset, run), see random_streams.py
+        'free_memory_states': [['events', 'cdps', 'uniswap_oracle']],
+        'ledger_reconciliation_period': [24], # Check the aggregate CDP ledger against the CDP book every N timesteps; 0 to disable
+        'cdp_metrics_period': [1], # Compute the CDP metrics every N timesteps, or at control period boundaries if None; the last value is carried forward in between
+
+        # Configuration options
+        options.IntegralType.__name__: [options.IntegralType.LEAKY.value],
+        options.PriceMeanType.__name__: [options.PriceMeanType.CUMULATIVE.value], # ETH price mean of the APT expected market price model
+        'eth_price_mean_window': [24 * 30], # timesteps; window or EWMA span of the ETH price mean, unused for the cumulative mean
+
+        # Exogenous states, loaded as parameter at every timestep - these are called as `driver(run, timestep)`,
+        # with an ExogenousDriver array of shape (runs, timesteps) or a function, see exogenous.py
+        'eth_price': [mc_data_driver(eth_price_file)],
+        'liquidity_demand_events': [mc_data_driver(liquidity_demand_file)],
+        'token_swap_events': [mc_data_driver(token_swap_file)],
+        'seconds_passed': [lambda timestep, df=None: 3600],
     
-    'liquidity_demand_enabled': [True], # turn on or off all shocks
-    'liquidity_demand_shock': [False], # introduce shocks (up to 50% of secondary market pool)
-    'liquidity_demand_max_percentage': [0.1], # max percentage of secondary market pool when no shocks introduced using liquidity_demand_shock
-    'liquidity_demand_shock_percentage': [0.5], # max percentage of secondary market pool when shocks introduced using liquidity_demand_shock
-
-    # Time parameters
-    'expected_blocktime': [15], # seconds
-    'control_period': [3600 * 4], # seconds; must be multiple of cumulative time
+        'liquidity_demand_enabled': [True], # turn on or off all shocks
+        'liquidity_demand_shock': [False], # introduce shocks (up to 50% of secondary market pool)
+        'liquidity_demand_max_percentage': [0.1], # max percentage of secondary market pool when no shocks introduced using liquidity_demand_shock
+        'liquidity_demand_shock_percentage': [0.5], # max percentage of secondary market pool when shocks introduced using liquidity_demand_shock
+
+        # Time parameters
+        'expected_blocktime': [15], # seconds
+        'control_period': [3600 * 4], # seconds; must be multiple of cumulative time
     
-    # Controller parameters
-    'controller_enabled': [True],
-    'enable_controller_time': [7 * 24 * 3600], # delay in enabling controller (7 days)
-    'kp': [2e-7], # proportional term for the stability controller: units 1/USD
-    'ki': [-5e-9], # integral term for the stability controller scaled by control period: units 1/(USD*seconds)
-    'alpha': [.999 * RAY], # in 1/RAY
-    'error_term': [lambda target, measured: target - measured],
-    'rescale_target_price': [True], # scale the target price by the liquidation ratio
+        # Controller parameters
+        'controller_enabled': [True],
+        'enable_controller_time': [7 * 24 * 3600], # delay in enabling controller (7 days)
+        'kp': [2e-7], # proportional term for the stability controller: units 1/USD
+        'ki': [-5e-9], # integral term for the stability controller scaled by control period: units 1/(USD*seconds)
+        'alpha': [.999 * RAY], # in 1/RAY
+        'error_term': [lambda target, measured: target - measured],
+        'rescale_target_price': [True], # scale the target price by the liquidation ratio
     
-    # APT model
-    'arbitrageur_considers_liquidation_ratio': [True],
-    'interest_rate': [1.03], # Real-world expected interest rate, for determining profitable arbitrage opportunities
-
-    # APT OLS model
-    # OLS values (Feb. 6, 2021) for beta_1 and beta_2
-    'beta_1': [9.084809e-05],
-    'beta_2': [-4.194794e-08],
-
-    # CDP parameters
-    'liquidation_ratio': [1.45], # Configure the liquidation ratio parameter e.g. 150%
-    'liquidation_buffer': [2.0], # Configure the liquidation buffer parameter: the multiplier for the liquidation ratio, that users apply as a buffer
-    'liquidation_penalty': [0], # Percentage added on top of collateral needed to liquidate CDP. This is needed in order to avoid auction grinding attacks.
-    'debt_ceiling': [1e9],
-
-    # System parameters
-    'stability_fee': [lambda timestep, df=None: stability_fee], # per second interest rate (x% per month)
-
-    # Uniswap parameters
-    'uniswap_fee': [0.003], # 0.3%
-    'gas_price': [100e-9], # 100 gwei, current "fast" transaction
-    'swap_gas_used': [103834],
-    'cdp_gas_used': [(369e3 + 244e3) / 2], # Deposit + borrow; repay + withdraw
-}
-
-
-
-# Assert that the dict is consistent
-typed_dict_keys = set(ReflexerModelParameters.__annotations__.keys())
-state_var_keys = set(params.keys())
-assert typed_dict_keys == state_var_keys, (state_var_keys - typed_dict_keys, typed_dict_keys - state_var_keys)
\ No newline at end of file
+        # APT model
+        'arbitrageur_considers_liquidation_ratio': [True],
+        'interest_rate': [1.03], # Real-world expected interest rate, for determining profitable arbitrage opportunities
+
+        # APT OLS model
+        # OLS values (Feb. 6, 2021) for beta_1 and beta_2
+        'beta_1': [9.084809e-05],
+        'beta_2': [-4.194794e-08],
+
+        # CDP parameters
+        'liquidation_ratio': [1.45], # Configure the liquidation ratio parameter e.g. 150%
+        'liquidation_buffer': [2.0], # Configure the liquidation buffer parameter: the multiplier for the liquidation ratio, that users apply as a buffer
+        'liquidation_penalty': [0], # Percentage added on top of collateral needed to liquidate CDP. This is needed in order to avoid auction grinding attacks.
+        'debt_ceiling': [1e9],
+
+        # System parameters
+        'stability_fee': [lambda timestep, df=None: stability_fee], # per second interest rate (x% per month)
+
+        # Uniswap parameters
+        'uniswap_fee': [0.003], # 0.3%
+        'shadow_oracle_configs': [[]], # UniswapOracle keyword arguments of each shadow oracle, see shadow_oracles.py
+        'gas_price': [100e-9], # 100 gwei, current "fast" transaction
+        'swap_gas_used': [103834],
+        'cdp_gas_used': [(369e3 + 244e3) / 2], # Deposit + borrow; repay + withdraw
+    }
+
+    # Assert that the dict is consistent
+    typed_dict_keys = set(ReflexerModelParameters.__annotations__.keys())
+    state_var_keys = set(params.keys())
+    assert typed_dict_keys == state_var_keys, (state_var_keys - typed_dict_keys, typed_dict_keys - state_var_keys)
+
+    return params
+
+
+def __getattr__(name):
+    if name == 'params':
+        # Created once, so that updates to `params` are seen by every module that imports it
+        globals()['params'] = params = load_params()
+        return params
+    if name in ('eth_price_df', 'liquidity_demand_df', 'token_swap_df'):
+        import models.system_model_v3.model.state_variables.historical_state as historical_state
+        return getattr(historical_state, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,6 +4,7 @@ import models.system_model_v3.model.parts.init as init
 
 from .parts.utils import s_update_sim_metrics, p_free_memory, s_collect_events
 from .parts.governance import p_enable_controller
+from .parts.ledger import ledger_variables, s_ledger_w_3, s_ledger_interest_bitten, p_reconcile_ledger
 
 from .parts.controllers import *
 from .parts.debt_market import *
@@ -20,6 +21,7 @@ partial_state_update_blocks_unprocessed = [
         },
         'variables': {
             'target_price': init.initialize_target_price,
+            'event_draws': init.s_event_draws,
         }
     },
     {
@@ -55,12 +57,16 @@ partial_state_update_blocks_unprocessed = [
     {
         'label': 'Market Price',
         'policies': {
-            'market_price': markets.p_market_price
+            'market_price': markets.p_market_price,
+            'shadow_oracles': markets.p_shadow_oracles
         },
         'variables': {
             'market_price': markets.s_market_price,
             'market_price_twap': markets.s_market_price_twap,
-            'uniswap_oracle': markets.s_uniswap_oracle
+            'uniswap_oracle': markets.s_uniswap_oracle,
+            'shadow_oracles': markets.s_shadow_oracles,
+            'shadow_market_price_twap': markets.s_shadow_market_price_twap,
+            'shadow_market_price_twap_error': markets.s_shadow_market_price_twap_error
         }
     },
     {
@@ -89,24 +95,10 @@ partial_state_update_blocks_unprocessed = [
             'RAI_balance': uniswap.update_RAI_balance,
             'ETH_balance': uniswap.update_ETH_balance,
             'UNI_supply': uniswap.update_UNI_supply,
+            **ledger_variables,
         }
     },
     #################################################################
-    {
-        'label': 'Aggregate states 1',
-        'details': '''
-            Aggregate states
-        ''',
-        'policies': {},
-        'variables': {
-            'eth_locked': s_update_eth_locked,
-            'eth_freed': s_update_eth_freed,
-            'eth_bitten': s_update_eth_bitten,
-            'rai_drawn': s_update_rai_drawn,
-            'rai_wiped': s_update_rai_wiped,
-            'rai_bitten': s_update_rai_bitten,
-        }
-    },
     {
         'label': 'Debt Market 1',
         'details': '''
@@ -130,6 +122,9 @@ partial_state_update_blocks_unprocessed = [
         },
         'variables': {
             'cdps': s_store_cdps,
+            'w_3': s_ledger_w_3,
+            'interest_bitten': s_ledger_interest_bitten,
+            **ledger_variables,
         }
     },
     {
@@ -145,6 +140,7 @@ partial_state_update_blocks_unprocessed = [
             'RAI_balance': uniswap.update_RAI_balance,
             'ETH_balance': uniswap.update_ETH_balance,
             'UNI_supply': uniswap.update_UNI_supply,
+            **ledger_variables,
         }
     },
     #################################################################
@@ -153,10 +149,13 @@ partial_state_update_blocks_unprocessed = [
         'details': '''
             Endogenous w activity
         ''',
-        'policies': {},
+        'policies': {
+            'accrue_interest': p_accrue_interest
+        },
         'variables': {
             'accrued_interest': s_update_accrued_interest,
-            'cdps': s_update_cdp_interest
+            'w_1': s_store_w_1,
+            'cdps': s_store_cdps
         }
     },
     #################################################################
@@ -197,28 +196,15 @@ partial_state_update_blocks_unprocessed = [
         }
     },
     #################################################################
-    {
-        'label': 'Aggregate W',
-        'policies': {},
-        'variables': {
-            'w_1': s_aggregate_w_1,
-            'w_2': s_aggregate_w_2,
-            'w_3': s_aggregate_w_3,
-        }
-    },
     {
         'label': 'Aggregate states 2',
         'details': '''
-            Aggregate states
+            Aggregate states: the CDP aggregates are updated by the ledger in each CDP-mutating block
         ''',
-        'policies': {},
+        'policies': {
+            'reconcile_ledger': p_reconcile_ledger,
+        },
         'variables': {
-            'eth_locked': s_update_eth_locked,
-            'eth_freed': s_update_eth_freed,
-            'eth_bitten': s_update_eth_bitten,
-            'rai_drawn': s_update_rai_drawn,
-            'rai_wiped': s_update_rai_wiped,
-            'rai_bitten': s_update_rai_bitten,
             'accrued_interest': s_update_interest_bitten,
             'system_revenue': s_update_system_revenue,
         }
@@ -250,6 +236,19 @@ partial_state_update_blocks_unprocessed = [
             'eth_gross_return': s_update_eth_gross_return
         }
     },
+    {
+        'label': 'ETH price mean',
+        'details': '''
+            Running ETH price mean for the expected market price model
+        ''',
+        'policies': {
+            'eth_price_mean': p_update_eth_price_mean,
+        },
+        'variables': {
+            'eth_price_mean': s_store_eth_price_mean,
+            'eth_price_running_mean': s_store_eth_price_running_mean,
+        }
+    },
     #################################################################
     {
         'label': 'CDP metrics',
@@ -2,12 +2,13 @@ import math
 import numpy as np
 import time
 import logging
-import pandas as pd
-import statistics
 
+import models.options as options
+from .running_mean import RunningMean
 from .utils import approx_greater_equal_zero, assert_log, approx_eq
 from .debt_market import open_cdp_draw, open_cdp_lock, draw_to_liquidation_ratio, is_cdp_above_liquidation_ratio
 from .uniswap import get_output_price, get_input_price
+from .ledger import ledger_deltas
 import models.system_model_v3.model.parts.failure_modes as failure
 
 
@@ -26,18 +27,12 @@ def p_resolve_expected_market_price(params, substep, state_history, state):
     # interest rate / opportunity cost / time value of money
     interest_rate = params['interest_rate']
 
-    try:
-        eth_price = state_history[-1][-1]['eth_price']
-    except IndexError as e:
-        logging.exception(e)
-        eth_price = state['eth_price']
+    # The ETH price is updated at the end of the timestep, so this is the previous timestep's price
+    eth_price = state['eth_price']
 
     # Mean and Rate Parameters
-    # @danlessa note:
-    # List comprehensions can be slow. Maybe creating a numpy array for it?
-    eth_price_data = [state[-1]['eth_price'] for state in state_history]
-    # mean value from stochastic process of ETH price
-    eth_price_mean = statistics.mean(eth_price_data)
+    # mean value from stochastic process of ETH price, see `p_update_eth_price_mean`
+    eth_price_mean = state['eth_price_mean']
 
     # @danlessa note:
     # List comprehensions can be slow. Maybe creating a numpy array for it?
@@ -75,6 +70,30 @@ def s_store_expected_market_price(params, substep, state_history, state, policy_
     return 'expected_market_price', policy_input['expected_market_price']
 
 
+def p_update_eth_price_mean(params, substep, state_history, state):
+    '''
+    Update the running ETH price mean used by the expected market price model with the latest ETH price,
+    in O(1) per timestep; the mean is cumulative, windowed or exponentially weighted according to the
+    `PriceMeanType` and `eth_price_mean_window` parameters.
+    '''
+    eth_price_running_mean = state['eth_price_running_mean']
+    if eth_price_running_mean is None:
+        # Created on the first update, and seeded with the initial mean, i.e. the initial ETH price
+        eth_price_running_mean = RunningMean(params[options.PriceMeanType.__name__], params['eth_price_mean_window'])
+        eth_price_running_mean.update(state['eth_price_mean'])
+    eth_price_mean = eth_price_running_mean.update(state['eth_price'])
+
+    return {'eth_price_mean': eth_price_mean, 'eth_price_running_mean': eth_price_running_mean}
+
+
+def s_store_eth_price_mean(params, substep, state_history, state, policy_input):
+    return 'eth_price_mean', policy_input['eth_price_mean']
+
+
+def s_store_eth_price_running_mean(params, substep, state_history, state, policy_input):
+    return 'eth_price_running_mean', policy_input['eth_price_running_mean']
+
+
 def p_arbitrageur_model(params, substep, state_history, state):
     debug = params['debug']
 
@@ -86,6 +105,8 @@ def p_arbitrageur_model(params, substep, state_history, state):
     ETH_delta = 0
     UNI_delta = 0
 
+    cdp_delta = ledger_deltas()
+
     redemption_price = state['target_price']
     expected_market_price = state['expected_market_price']
     market_price = state['market_price']
@@ -106,9 +127,10 @@ def p_arbitrageur_model(params, substep, state_history, state):
         return (RAI_balance * ETH_balance * (1 - uniswap_fee) * liquidation_ratio * (redemption_price / eth_price)) ** 0.5
 
     cdps = state['cdps']
-    cdps_copy = cdps.copy()
-    aggregate_arbitrageur_cdp_index = cdps.query("arbitrage == 1").index[0]
-    aggregate_arbitrageur_cdp = cdps.loc[aggregate_arbitrageur_cdp_index]
+    # The book before the arbitrageur's update, only to validate it in debug mode
+    cdps_copy = cdps.copy() if debug else None
+    aggregate_arbitrageur_cdp_index = cdps.arbitrage_index()
+    aggregate_arbitrageur_cdp = cdps.row(aggregate_arbitrageur_cdp_index)
 
     total_borrowed = aggregate_arbitrageur_cdp['drawn'] - \
         aggregate_arbitrageur_cdp['wiped'] - \
@@ -185,18 +207,17 @@ def p_arbitrageur_model(params, substep, state_history, state):
                 logging.debug(
                     f"{state['timestamp']} Performing arb. CDP -> UNI for profit {profit}")
 
-                borrowed = cdps.at[aggregate_arbitrageur_cdp_index, "drawn"]
-                deposited = cdps.at[aggregate_arbitrageur_cdp_index, "locked"]
+                deposited = cdps.at(aggregate_arbitrageur_cdp_index, "locked")
 
                 if not d_borrow >= 0:
                     raise failure.ArbitrageConditionException(f'{d_borrow=}')
                 if not q_deposit >= 0:
                     raise failure.ArbitrageConditionException(f'{q_deposit=}')
 
-                cdps.at[aggregate_arbitrageur_cdp_index,
-                        "drawn"] = borrowed + d_borrow
-                cdps.at[aggregate_arbitrageur_cdp_index,
-                        "locked"] = deposited + q_deposit
+                cdps.draw(d_borrow, aggregate_arbitrageur_cdp_index)
+                cdps.set(aggregate_arbitrageur_cdp_index,
+                         "locked", deposited + q_deposit)
+                cdp_delta = ledger_deltas(u_1=d_borrow, v_1=q_deposit)
 
                 RAI_delta = d_borrow
                 if not RAI_delta >= 0:
@@ -238,8 +259,7 @@ def p_arbitrageur_model(params, substep, state_history, state):
             logging.debug(
                 f"{state['timestamp']} Performing arb. UNI -> CDP for profit {profit}")
 
-            repayed = cdps.at[aggregate_arbitrageur_cdp_index, "wiped"]
-            withdrawn = cdps.at[aggregate_arbitrageur_cdp_index, "freed"]
+            withdrawn = cdps.at(aggregate_arbitrageur_cdp_index, "freed")
 
             if not q_withdraw <= total_deposited:
                 raise failure.ArbitrageConditionException(
@@ -255,10 +275,10 @@ def p_arbitrageur_model(params, substep, state_history, state):
             if not q_withdraw >= 0:
                 raise failure.ArbitrageConditionException(f'{q_withdraw=}')
 
-            cdps.at[aggregate_arbitrageur_cdp_index,
-                    "wiped"] = repayed + d_repay
-            cdps.at[aggregate_arbitrageur_cdp_index,
-                    "freed"] = withdrawn + q_withdraw
+            cdps.wipe(d_repay, aggregate_arbitrageur_cdp_index)
+            cdps.set(aggregate_arbitrageur_cdp_index,
+                     "freed", withdrawn + q_withdraw)
+            cdp_delta = ledger_deltas(u_2=d_repay, v_2=q_withdraw)
 
             # Deposit ETH, get RAI
             ETH_delta, _ = get_output_price(
@@ -285,14 +305,14 @@ def p_arbitrageur_model(params, substep, state_history, state):
     else:
         cdp_update = {"cdps": cdps, "optimal_values": {}}
 
-    return {**cdp_update, **uniswap_state_delta}
+    return {**cdp_update, **uniswap_state_delta, **cdp_delta}
 
 
 def validate_updated_cdp_state(cdps, previous_cdps, raise_on_assert=True):
-    u_1 = cdps["drawn"].sum() - previous_cdps["drawn"].sum()
-    u_2 = cdps["wiped"].sum() - previous_cdps["wiped"].sum()
-    v_1 = cdps["locked"].sum() - previous_cdps["locked"].sum()
-    v_2 = cdps["freed"].sum() - previous_cdps["freed"].sum()
+    u_1 = cdps.sum("drawn") - previous_cdps.sum("drawn")
+    u_2 = cdps.sum("wiped") - previous_cdps.sum("wiped")
+    v_1 = cdps.sum("locked") - previous_cdps.sum("locked")
+    v_2 = cdps.sum("freed") - previous_cdps.sum("freed")
 
     if not u_1 >= 0:
         raise failure.InvalidCDPStateException(f'{u_1}')
@@ -304,18 +324,18 @@ def validate_updated_cdp_state(cdps, previous_cdps, raise_on_assert=True):
         raise failure.InvalidCDPStateException(f'{v_2}')
 
     if not approx_greater_equal_zero(
-        cdps["drawn"].sum() - cdps["wiped"].sum() - cdps["u_bitten"].sum(),
+        cdps.sum("drawn") - cdps.sum("wiped") - cdps.sum("u_bitten"),
         abs_tol=1e-2,
     ):
         raise failure.InvalidCDPStateException(
-            f'{cdps["drawn"].sum()=} {cdps["wiped"].sum()=} {cdps["u_bitten"].sum()=}')
+            f'{cdps.sum("drawn")=} {cdps.sum("wiped")=} {cdps.sum("u_bitten")=}')
 
     if not approx_greater_equal_zero(
-        cdps["locked"].sum() - cdps["freed"].sum() - cdps["v_bitten"].sum(),
+        cdps.sum("locked") - cdps.sum("freed") - cdps.sum("v_bitten"),
         abs_tol=1e-2,
     ):
         raise failure.InvalidCDPStateException(
-            f'{cdps["locked"].sum()=} {cdps["freed"].sum()=} {cdps["v_bitten"].sum()=}')
+            f'{cdps.sum("locked")=} {cdps.sum("freed")=} {cdps.sum("v_bitten")=}')
 
     return {
         "cdps": cdps,
@@ -0,0 +1,236 @@
+import numpy as np
+
+import models.options as options
+import models.system_model_v3.model.parts.failure_modes as failure
+import models.system_model_v3.model.parts.markets as markets
+import models.system_model_v3.model.parts.uniswap as uniswap
+from . import apt_model, controllers, debt_market, governance, init, ledger, pi_controller, time
+from .exogenous import ExogenousDriver
+
+"""
+Array kernels of the system_model_v3 PSUB functions, for the lockstep engine.
+
+A kernel has the same signature as its scalar function, but `params`, `state` and `policy_input`
+map each key to an array with one element per active lane, and `state_history` is None.
+Policy kernels return `(signals, failed)` and state update kernels return `(key, values, failed)`,
+where `failed` is a boolean mask over the lanes, or None; failed lanes are reported with the kernel's
+`exception` type, matching the exception the scalar function would raise.
+
+`batched_functions` maps each scalar function to its kernel; functions without a kernel are
+evaluated per lane by the engine.
+"""
+
+batched_functions = {}
+
+
+def batched(function, exception=failure.CustomException):
+    """
+    Register the decorated kernel as the array version of `function`
+    """
+    def register(kernel):
+        kernel.exception = exception
+        batched_functions[function] = kernel
+        return kernel
+    return register
+
+
+def store(function, key, signal=None):
+    """
+    Register a kernel for a state update function that stores a policy signal
+    """
+    def kernel(params, substep, state_history, state, policy_input):
+        return key, policy_input[signal or key], None
+    kernel.__name__ = function.__name__
+    batched(function)(kernel)
+
+
+def accumulate(function, key, signal):
+    """
+    Register a kernel for a state update function that adds a policy signal to its state
+    """
+    def kernel(params, substep, state_history, state, policy_input):
+        return key, state[key] + policy_input[signal], None
+    kernel.__name__ = function.__name__
+    batched(function)(kernel)
+
+
+def _call_per_timestep(functions, timestep):
+    # A timestep driver, e.g. `seconds_passed`: the lanes are at the same timestep, so each driver is called once
+    values = {}
+    for function, step in zip(functions, timestep.tolist()):
+        if (id(function), step) not in values:
+            values[id(function), step] = function(step)
+    return np.asarray([values[id(function), step] for function, step in zip(functions, timestep.tolist())])
+
+
+def _call_per_run(functions, run, timestep):
+    # A Monte Carlo driver, e.g. the ETH price: the lanes sharing an `ExogenousDriver` are indexed at once
+    driver = functions[0]
+    if isinstance(driver, ExogenousDriver) and all(function is driver for function in functions):
+        return driver.values[timestep] if driver.values.ndim == 1 else driver.values[run - 1, timestep]
+    return np.asarray([function(lane_run, step) for function, lane_run, step in zip(functions, run.tolist(), timestep.tolist())])
+
+
+@batched(time.resolve_time_passed)
+def resolve_time_passed(params, substep, state_history, state):
+    return {"seconds_passed": _call_per_timestep(params["seconds_passed"], state["timestep"])}, None
+
+
+@batched(debt_market.p_resolve_eth_price)
+def p_resolve_eth_price(params, substep, state_history, state):
+    eth_price = _call_per_run(params["eth_price"], state["run"], state["timestep"])
+    return {"delta_eth_price": eth_price - state["eth_price"]}, None
+
+
+@batched(debt_market.s_update_stability_fee)
+def s_update_stability_fee(params, substep, state_history, state, policy_input):
+    return "stability_fee", _call_per_timestep(params["stability_fee"], state["timestep"]), None
+
+
+@batched(governance.p_enable_controller)
+def p_enable_controller(params, substep, state_history, state):
+    controller_enabled = np.where(state["cumulative_time"] >= params["enable_controller_time"], params["controller_enabled"], False)
+    return {"controller_enabled": controller_enabled}, None
+
+
+@batched(init.initialize_target_price)
+def initialize_target_price(params, substep, state_history, state, policy_input):
+    rescale = (state["timestep"] == 0) & params["rescale_target_price"].astype(bool)
+    return "target_price", np.where(rescale, state["target_price"] / params["liquidation_ratio"], state["target_price"]), None
+
+
+@batched(controllers.observe_errors)
+def observe_errors(params, substep, state_history, state):
+    target_price = np.where(
+        params["rescale_target_price"].astype(bool), state["target_price"] * params["liquidation_ratio"], state["target_price"]
+    )
+    # The error term is any function of two prices, so it is called per lane
+    error = [
+        error_term(target, measured)
+        for error_term, target, measured in zip(params["error_term"], target_price.tolist(), state["market_price_twap"].tolist())
+    ]
+    return {"error_star": np.asarray(error, dtype=np.float64)}, None
+
+
+@batched(apt_model.p_resolve_expected_market_price)
+def p_resolve_expected_market_price(params, substep, state_history, state):
+    p = state["market_price"]
+    interest_rate = params["interest_rate"]
+    expected_market_price = p * (interest_rate +
+                                 params["beta_1"] * (state["eth_price_mean"] -
+                                                     state["eth_price"] * interest_rate)
+                                 + params["beta_2"] * (state["liquidity_demand_mean"] -
+                                                       state["liquidity_demand"] * interest_rate))
+    return {"expected_market_price": np.where(params["liquidity_demand_enabled"].astype(bool), expected_market_price, p)}, None
+
+
+store(time.store_timedelta, "timedelta", "seconds_passed")
+store(markets.s_market_price, "market_price")
+store(markets.s_market_price_twap, "market_price_twap")
+store(markets.s_liquidity_demand, "liquidity_demand", "RAI_delta")
+store(apt_model.s_store_expected_market_price, "expected_market_price")
+store(controllers.store_error_star, "error_star")
+store(debt_market.s_store_w_1, "w_1")
+store(ledger.s_ledger_w_3, "w_3")
+accumulate(time.update_cumulative_time, "cumulative_time", "seconds_passed")
+accumulate(debt_market.s_update_accrued_interest, "accrued_interest", "w_1")
+accumulate(ledger.s_ledger_interest_bitten, "interest_bitten", "w_3")
+for aggregate, (_, delta) in ledger.ledger_entries.items():
+    accumulate(ledger.ledger_variables[aggregate], aggregate, delta)
+
+
+def _update_balance(key, delta):
+    def kernel(params, substep, state_history, state, policy_input):
+        updated_balance = state[key] + policy_input[delta]
+        return key, updated_balance, ~(updated_balance > 0)
+    return kernel
+
+
+batched(uniswap.update_RAI_balance, failure.NegativeBalanceException)(_update_balance("RAI_balance", "RAI_delta"))
+batched(uniswap.update_ETH_balance, failure.NegativeBalanceException)(_update_balance("ETH_balance", "ETH_delta"))
+batched(uniswap.update_UNI_supply, failure.NegativeBalanceException)(_update_balance("UNI_supply", "UNI_delta"))
+
+
+@batched(markets.s_liquidity_demand_mean)
+def s_liquidity_demand_mean(params, substep, state_history, state, policy_input):
+    return "liquidity_demand_mean", (state["liquidity_demand_mean"] + policy_input["RAI_delta"]) / 2, None
+
+
+@batched(markets.s_slippage, ZeroDivisionError)
+def s_slippage(params, substep, state_history, state, policy_input):
+    swap = policy_input["UNI_delta"] == 0
+    RAI_balance = state["RAI_balance"] + policy_input["RAI_delta"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        realized_market_price = ((state["ETH_balance"] + policy_input["ETH_delta"]) / RAI_balance) * state["eth_price"]
+        market_slippage = 1 - realized_market_price / state["market_price"]
+    return "market_slippage", np.where(swap, market_slippage, np.nan), swap & ((RAI_balance == 0) | (state["market_price"] == 0))
+
+
+def _approx_greater_equal_zero(value):
+    # `utils.approx_greater_equal_zero(value, 1e-2)`: the relative tolerance is irrelevant at zero
+    return (value >= 0) | (np.abs(value) <= 1e-10)
+
+
+@batched(debt_market.s_update_eth_collateral, failure.NegativeBalanceException)
+def s_update_eth_collateral(params, substep, state_history, state, policy_input):
+    eth_collateral = state["eth_locked"] - state["eth_freed"] - state["eth_bitten"]
+    return "eth_collateral", eth_collateral, ~_approx_greater_equal_zero(eth_collateral)
+
+
+@batched(debt_market.s_update_principal_debt, failure.NegativeBalanceException)
+def s_update_principal_debt(params, substep, state_history, state, policy_input):
+    principal_debt = state["rai_drawn"] - state["rai_wiped"] - state["rai_bitten"]
+    return "principal_debt", principal_debt, ~_approx_greater_equal_zero(principal_debt)
+
+
+@batched(debt_market.s_update_system_revenue)
+def s_update_system_revenue(params, substep, state_history, state, policy_input):
+    return "system_revenue", state["system_revenue"] + state["w_2"], None
+
+
+@batched(debt_market.s_update_interest_bitten)
+def s_update_interest_bitten(params, substep, state_history, state, policy_input):
+    return "accrued_interest", state["accrued_interest"] - state["w_3"], None
+
+
+@batched(debt_market.s_update_eth_price)
+def s_update_eth_price(params, substep, state_history, state, policy_input):
+    return "eth_price", state["eth_price"] + policy_input["delta_eth_price"], None
+
+
+@batched(debt_market.s_update_eth_return, ZeroDivisionError)
+def s_update_eth_return(params, substep, state_history, state, policy_input):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eth_return = policy_input["delta_eth_price"] / state["eth_price"]
+    return "eth_return", eth_return, state["eth_price"] == 0
+
+
+@batched(debt_market.s_update_eth_gross_return, ZeroDivisionError)
+def s_update_eth_gross_return(params, substep, state_history, state, policy_input):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eth_gross_return = (state["eth_price"] + policy_input["delta_eth_price"]) / state["eth_price"]
+    return "eth_gross_return", eth_gross_return, state["eth_price"] == 0
+
+
+@batched(controllers.update_target_rate)
+def update_target_rate(params, substep, state_history, state, policy_input):
+    target_rate = pi_controller.update_target_rate(
+        state["cumulative_time"], params["control_period"], params["kp"], params["ki"],
+        state["error_star"], state["error_star_integral"], state["target_rate"], policy_input["controller_enabled"],
+    )
+    return "target_rate", target_rate, None
+
+
+@batched(controllers.update_target_price, failure.ControllerTargetOverflowException)
+def update_target_price(params, substep, state_history, state, policy_input):
+    target_price, failed = pi_controller.update_target_price(state["target_price"], state["target_rate"], state["timedelta"])
+    return "target_price", target_price, failed
+
+
+@batched(controllers.update_error_star_integral)
+def update_error_star_integral(params, substep, state_history, state, policy_input):
+    error_star_integral = pi_controller.update_error_star_integral(
+        state["error_star_integral"], state["error_star"], policy_input["error_star"], state["timedelta"],
+        params["alpha"], params[options.IntegralType.__name__] == options.IntegralType.LEAKY.value,
+    )
+    return "error_star_integral", error_star_integral, None
@@ -0,0 +1,414 @@
+import json
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, List
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from .liquidation_index import LiquidationIndex
+
+"""
+Columnar (structure-of-arrays) store for the CDP book.
+
+Every CDP attribute is a contiguous NumPy column, so the debt market and APT policies
+can read and update the book with array expressions instead of pandas `query`, `.at[]` and `iterrows`.
+The pandas representation is only used at the edges, i.e. the initial state and result export.
+
+Stability fee accrual follows the on-chain `rate` accumulator: each CDP stores its normalized debt,
+a single `accumulated_rate` compounds the stability fee for the whole book in O(1),
+and the interest accrued by a CDP (`dripped`) is computed lazily when it is read.
+"""
+
+
+class CDPBook:
+    """
+    A book of CDPs (both open and closed), stored as contiguous columns with an explicit capacity.
+
+    Only the first `size` rows of each column are valid; columns are grown geometrically when
+    the capacity is exhausted. Column accessors return views, so in-place updates such as
+    `book["freed"][index] += free` mutate the book directly.
+
+    Principal debt must be drawn and wiped through `draw()` and `wipe()`, so that the normalized debt
+    (principal debt plus outstanding interest, divided by the accumulated rate) stays consistent.
+    Other in-place updates through column views must be followed by `mark_dirty()`, so that the liquidation index
+    is updated for the collateral, debt or open columns, and a memory-mapped book is no longer pickled by reference.
+    """
+
+    # ETH/RAI accounting columns, float64
+    float_columns = (
+        "locked",  # ETH collateral locked
+        "freed",  # ETH collateral freed
+        "drawn",  # Principal debt drawn
+        "wiped",  # Principal debt wiped
+        "w_wiped",  # Accrued interest wiped
+        "normalized_debt",  # Total debt (principal and interest) divided by the accumulated rate
+        "v_bitten",  # ETH collateral bitten (liquidated)
+        "u_bitten",  # Principal debt bitten
+        "w_bitten",  # Accrued interest bitten
+        "liquidation_buffer",  # Per-CDP liquidation buffer, or zero to use the liquidation_buffer parameter
+    )
+    # Boolean masks
+    bool_columns = (
+        "open",  # Is the CDP open or closed?
+        "arbitrage",  # Is the CDP the aggregate arbitrageur CDP?
+    )
+    # Integer columns
+    int_columns = (
+        "time",  # How long the CDP has been open for
+    )
+    stored_columns = ("open", "arbitrage", "time") + float_columns
+    # Columns that determine whether a CDP can be liquidated
+    indexed_columns = ("open", "arbitrage", "locked", "freed", "v_bitten", "drawn", "wiped", "u_bitten")
+    # Columns of the legacy DataFrame format, with the interest accrued (`dripped`) derived from the normalized debt
+    columns = (
+        "open",
+        "arbitrage",
+        "time",
+        "locked",
+        "freed",
+        "drawn",
+        "wiped",
+        "w_wiped",
+        "dripped",
+        "v_bitten",
+        "u_bitten",
+        "w_bitten",
+    )
+
+    def __init__(self, capacity: int = 16):
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        # Compounded stability fee since the book was created, unitless
+        self.accumulated_rate = 1.0
+        # Sum of the normalized debt column
+        self.total_normalized_debt = 0.0
+        # Liquidation index, built lazily, and the CDPs changed since it was last updated
+        self._liquidation_index: LiquidationIndex = None
+        self._dirty: List[np.ndarray] = []
+        # Directory of the memory-mapped columns the book was loaded from, while it is unmodified
+        self._source: str = None
+        self._data: Dict[str, np.ndarray] = {}
+        for key in self.float_columns:
+            self._data[key] = np.zeros(self.capacity, dtype=np.float64)
+        for key in self.bool_columns:
+            self._data[key] = np.zeros(self.capacity, dtype=bool)
+        for key in self.int_columns:
+            self._data[key] = np.zeros(self.capacity, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """
+        Return a view of the valid rows of a column
+        """
+        return self._data[key][: self.size]
+
+    def __setitem__(self, key: str, values) -> None:
+        self._data[key][: self.size] = values
+        self._source = None
+        if key in self.indexed_columns:
+            self._liquidation_index = None
+
+    def __repr__(self) -> str:
+        return f"CDPBook(size={self.size}, capacity={self.capacity}, open={self.open_count})"
+
+    def reserve(self, capacity: int) -> None:
+        """
+        Grow the column capacity to at least `capacity` rows
+        """
+        if capacity <= self.capacity:
+            return
+        for key, column in self._data.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[: self.size] = column[: self.size]
+            self._data[key] = grown
+        self.capacity = capacity
+
+    def append(self, cdp: dict) -> int:
+        """
+        Append a CDP (e.g. from `open_cdp_lock()`) and return its index in the book
+        """
+        if self.size == self.capacity:
+            self.reserve(2 * self.capacity)
+        index = self.size
+        self.size += 1
+        for key in self.stored_columns:
+            self._data[key][index] = cdp.get(key, 0)
+        normalized_debt = (
+            cdp.get("drawn", 0) - cdp.get("wiped", 0) - cdp.get("u_bitten", 0)
+            + cdp.get("dripped", 0) - cdp.get("w_wiped", 0) - cdp.get("w_bitten", 0)
+        ) / self.accumulated_rate
+        self._data["normalized_debt"][index] = normalized_debt
+        self.total_normalized_debt += normalized_debt
+        self.mark_dirty(index)
+        return index
+
+    def extend(self, cdps: Iterable[dict]) -> None:
+        for cdp in cdps:
+            self.append(cdp)
+
+    def at(self, index: int, key: str):
+        return self._data[key][index]
+
+    def set(self, index: int, key: str, value) -> None:
+        self._data[key][index] = value
+        if key in self.indexed_columns:
+            self.mark_dirty(index)
+        else:
+            self._source = None
+
+    def mark_dirty(self, indices) -> None:
+        """
+        Record CDPs changed through column views, for the liquidation index
+        """
+        self._source = None
+        if self._liquidation_index is not None:
+            self._dirty.append(np.atleast_1d(indices))
+
+    def _changed(self, amount, index):
+        # Indices changed by a draw or wipe: only the nonzero amounts when applied to the whole book
+        if index is ...:
+            return np.flatnonzero(amount) if np.ndim(amount) else np.arange(self.size)
+        return index
+
+    def row(self, index: int) -> dict:
+        """
+        Snapshot of a single CDP as a dictionary of Python scalars,
+        compatible with the scalar CDP functions in `debt_market.py`
+        """
+        cdp = {key: self._data[key][index].item() for key in self.stored_columns}
+        principal_debt = cdp["drawn"] - cdp["wiped"] - cdp["u_bitten"]
+        accrued_interest = max(cdp["normalized_debt"] * self.accumulated_rate - principal_debt, 0.0)
+        cdp["dripped"] = accrued_interest + cdp["w_wiped"] + cdp["w_bitten"]
+        return cdp
+
+    def draw(self, amount, index=...) -> None:
+        """
+        Draw principal debt, for a single CDP index or (by default) elementwise for the whole book
+        """
+        normalized_debt = amount / self.accumulated_rate
+        self["drawn"][index] += amount
+        self["normalized_debt"][index] += normalized_debt
+        self.total_normalized_debt += float(np.sum(normalized_debt))
+        self.mark_dirty(self._changed(amount, index))
+
+    def wipe(self, amount, index=...) -> None:
+        """
+        Wipe principal debt, for a single CDP index or (by default) elementwise for the whole book
+        """
+        normalized_debt = amount / self.accumulated_rate
+        self["wiped"][index] += amount
+        self["normalized_debt"][index] -= normalized_debt
+        self.total_normalized_debt -= float(np.sum(normalized_debt))
+        self.mark_dirty(self._changed(amount, index))
+
+    def close(self, indices) -> None:
+        """
+        Close CDPs, e.g. after liquidation, once their debt has been bitten
+        """
+        self.total_normalized_debt -= float(self["normalized_debt"][indices].sum())
+        self["normalized_debt"][indices] = 0.0
+        self["open"][indices] = False
+        self.mark_dirty(indices)
+
+    def liquidatable(self, eth_price: float, target_price: float, liquidation_ratio: float) -> np.ndarray:
+        """
+        Indices of the open, non-arbitrage CDPs below the liquidation ratio, in book order.
+
+        Candidates are found in O(log n + k) from the liquidation index, and then checked against the exact condition.
+        The CDPs changed since the last query are first merged into the index, in O(n + m log m) for m changed CDPs.
+        """
+        if self._liquidation_index is None:
+            self._liquidation_index = LiquidationIndex(self)
+        elif self._dirty:
+            self._liquidation_index.update(self, np.concatenate(self._dirty))
+        self._dirty = []
+
+        threshold = eth_price / (target_price * liquidation_ratio)
+        # Widen the threshold by a rounding margin, so the exact check below decides boundary cases
+        candidates = self._liquidation_index.above(threshold * (1 - 1e-9))
+        collateral = self["locked"][candidates] - self["freed"][candidates] - self["v_bitten"][candidates]
+        principal_debt = self["drawn"][candidates] - self["wiped"][candidates] - self["u_bitten"][candidates]
+        # ETH * USD/ETH < RAI * USD/RAI * unitless
+        below = collateral * eth_price < principal_debt * target_price * liquidation_ratio
+        return np.sort(candidates[below])
+
+    def accrue(self, factor: float) -> float:
+        """
+        Compound the stability fee into the accumulated rate, and return the interest dripped in RAI
+        """
+        dripped = self.total_normalized_debt * self.accumulated_rate * (factor - 1)
+        self.accumulated_rate *= factor
+        return dripped
+
+    @property
+    def open_mask(self) -> np.ndarray:
+        return self["open"]
+
+    @property
+    def arbitrage_mask(self) -> np.ndarray:
+        return self["arbitrage"]
+
+    @property
+    def open_count(self) -> int:
+        return int(np.count_nonzero(self.open_mask))
+
+    def open_indices(self) -> np.ndarray:
+        return np.flatnonzero(self.open_mask)
+
+    def arbitrage_index(self) -> int:
+        """
+        Index of the (first) aggregate arbitrageur CDP
+        """
+        indices = np.flatnonzero(self.arbitrage_mask)
+        if len(indices) == 0:
+            raise KeyError("No arbitrage CDP in book")
+        return int(indices[0])
+
+    def sum(self, key: str) -> float:
+        return float(self[key].sum())
+
+    def collateral(self) -> np.ndarray:
+        """
+        ETH collateral per CDP: locked - freed - v_bitten
+        """
+        return self["locked"] - self["freed"] - self["v_bitten"]
+
+    def principal_debt(self) -> np.ndarray:
+        """
+        RAI principal debt per CDP: drawn - wiped - u_bitten
+        """
+        return self["drawn"] - self["wiped"] - self["u_bitten"]
+
+    def accrued_interest(self) -> np.ndarray:
+        """
+        Outstanding interest per CDP: total debt at the accumulated rate, less principal debt
+        """
+        return np.maximum(self["normalized_debt"] * self.accumulated_rate - self.principal_debt(), 0.0)
+
+    def dripped(self) -> np.ndarray:
+        """
+        Total interest accrued per CDP, including interest that has since been wiped or bitten
+        """
+        return self.accrued_interest() + self["w_wiped"] + self["w_bitten"]
+
+    def copy(self) -> "CDPBook":
+        """
+        Copy the book; an unmodified memory-mapped book is mapped again, so the copy is still pickled by reference
+        """
+        book = CDPBook.__new__(CDPBook)
+        book.capacity = self.capacity
+        book.size = self.size
+        book.accumulated_rate = self.accumulated_rate
+        book.total_normalized_debt = self.total_normalized_debt
+        book._liquidation_index = None
+        book._dirty = []
+        book._source = None
+        if self._source is not None:
+            book._load_columns(self._source)
+        else:
+            book._data = {key: column.copy() for key, column in self._data.items()}
+        return book
+
+    def __getstate__(self):
+        state = {
+            "capacity": self.capacity,
+            "size": self.size,
+            "accumulated_rate": self.accumulated_rate,
+            "total_normalized_debt": self.total_normalized_debt,
+        }
+        if self._source is not None:
+            # An unmodified memory-mapped book is pickled by reference, e.g. when sent to pathos workers
+            return {**state, "_source": self._source}
+        # Only pickle the valid rows, not the spare capacity
+        return {**state, "_data": {key: self[key].copy() for key in self._data}}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self.size = state["size"]
+        self.accumulated_rate = state["accumulated_rate"]
+        self.total_normalized_debt = state["total_normalized_debt"]
+        # The liquidation index is not pickled, and rebuilt on the next query
+        self._liquidation_index = None
+        self._dirty = []
+        self._source = None
+        if "_source" in state:
+            self._load_columns(state["_source"])
+            return
+        self._data = {}
+        for key, column in state["_data"].items():
+            grown = np.zeros(self.capacity, dtype=column.dtype)
+            grown[: self.size] = column
+            self._data[key] = grown
+
+    def save(self, path: str) -> None:
+        """
+        Save the valid rows of each column to `<path>/<column>.npy`, for memory-mapped loading,
+        and the book's scalars to `<path>/book.json`
+        """
+        os.makedirs(path, exist_ok=True)
+        for key in self._data:
+            np.save(os.path.join(path, f"{key}.npy"), self[key])
+        with open(os.path.join(path, "book.json"), "w") as f:
+            json.dump({"accumulated_rate": self.accumulated_rate, "total_normalized_debt": self.total_normalized_debt}, f)
+
+    def _load_columns(self, path: str) -> None:
+        # Copy-on-write memory maps: pages are shared between processes until a column is written to
+        self._data = {
+            key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode="c")
+            for key in self.stored_columns
+        }
+        self._source = path
+
+    @classmethod
+    def load(cls, path: str) -> "CDPBook":
+        """
+        Load a book saved with `save()` as copy-on-write memory-mapped columns
+        """
+        book = cls(capacity=1)
+        book._load_columns(path)
+        book.size = book.capacity = len(book._data["open"])
+        scalars_path = os.path.join(path, "book.json")
+        if os.path.exists(scalars_path):
+            with open(scalars_path) as f:
+                scalars = json.load(f)
+            book.accumulated_rate = scalars["accumulated_rate"]
+            book.total_normalized_debt = scalars["total_normalized_debt"]
+        else:
+            # Books saved without their scalars
+            book.total_normalized_debt = book.sum("normalized_debt")
+        return book
+
+    @classmethod
+    def from_records(cls, cdps: List[dict], capacity: int = None) -> "CDPBook":
+        book = cls(capacity=max(capacity or 0, len(cdps)))
+        book.extend(cdps)
+        return book
+
+    @classmethod
+    def from_dataframe(cls, df: "pd.DataFrame", capacity: int = None) -> "CDPBook":
+        size = len(df)
+        book = cls(capacity=max(capacity or 0, size))
+        book.size = size
+        for key in cls.stored_columns:
+            if key in df:
+                book[key] = df[key].to_numpy()
+        dripped = df["dripped"].to_numpy() if "dripped" in df else 0.0
+        book["normalized_debt"] = book.principal_debt() + dripped - book["w_wiped"] - book["w_bitten"]
+        book.total_normalized_debt = book.sum("normalized_debt")
+        return book
+
+    def to_dataframe(self) -> "pd.DataFrame":
+        """
+        Convert the book to the legacy `cdps` DataFrame format, with integer open/arbitrage flags
+        """
+        import pandas as pd
+
+        data = {}
+        for key in self.columns:
+            column = self.dripped() if key == "dripped" else self[key].copy()
+            data[key] = column.astype(np.int64) if key in self.bool_columns else column
+        return pd.DataFrame(data)
@@ -1,6 +1,6 @@
 import models.options as options
-import models.constants as constants
 import models.system_model_v3.model.parts.failure_modes as failure
+from models.system_model_v3.model.parts.pi_controller import leak_factor
 
 
 def update_target_rate(params, substep, state_history, state, policy_input):
@@ -89,8 +89,8 @@ def update_error_star_integral(params, substep, state_history, state, policy_inp
     # Select whether to implement a leaky integral or not
     if params[options.IntegralType.__name__] == options.IntegralType.LEAKY.value:
         alpha = params["alpha"]
-        remaing_frac = float(alpha / constants.RAY) ** timedelta  # unitless
-        remaining = int(remaing_frac * error_star_integral)  # unit: USD * seconds
+        remaing_frac = leak_factor(alpha, timedelta)  # unitless
+        remaining = remaing_frac * error_star_integral  # unit: USD * seconds
         error_integral = remaining + area  # unit: USD * seconds
     else:
         error_integral = error_star_integral + area  # unit: USD * seconds
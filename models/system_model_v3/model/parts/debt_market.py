@@ -1,8 +1,8 @@
-import scipy.stats as sts
-import pandas as pd
+import numpy as np
 import math
 from .utils import approx_greater_equal_zero, assert_log
 from .uniswap import get_output_price, get_input_price
+from .ledger import ledger_deltas
 import models.system_model_v3.model.parts.failure_modes as failure
 
 import logging
@@ -12,7 +12,8 @@ import logging
 
 def p_resolve_eth_price(params, substep, state_history, state):
     eth_price = params["eth_price"](state["run"], state["timestep"])
-    delta_eth_price = eth_price - state_history[-1][-1]["eth_price"]
+    # The ETH price state is only updated in this block, so it still holds the previous timestep's price
+    delta_eth_price = eth_price - state["eth_price"]
 
     return {"delta_eth_price": delta_eth_price}
 
@@ -33,7 +34,8 @@ def s_update_eth_return(params, substep, state_history, state, policy_input):
 
 def s_update_eth_gross_return(params, substep, state_history, state, policy_input):
     eth_price = state["eth_price"]
-    eth_gross_return = eth_price / state_history[-1][-1]["eth_price"]
+    delta_eth_price = policy_input["delta_eth_price"]
+    eth_gross_return = (eth_price + delta_eth_price) / eth_price
 
     return "eth_gross_return", eth_gross_return
 
@@ -199,6 +201,52 @@ def open_cdp_draw(draw, eth_price, target_price, liquidation_ratio):
     }
 
 
+def rebalance_amounts(cdps, eth_price, target_price, liquidation_ratio, liquidation_buffer):
+    """
+    Vectorized rebalancing kernel: compute the wipe and draw amounts that bring every open CDP
+    in the book back to its liquidation ratio times buffer, in one array operation.
+
+    CDPs with their own `liquidation_buffer` use it instead of the parameter, and the aggregate
+    arbitrage CDP rebalances to the liquidation ratio itself (i.e. a buffer of 1.0).
+
+    Returns a tuple of (wipe, draw) arrays over the full book, zero for closed CDPs.
+    """
+    open_mask = cdps.open_mask
+    cdp_liquidation_buffer = cdps["liquidation_buffer"]
+    ratio = liquidation_ratio * np.where(
+        cdps.arbitrage_mask,
+        1.0,
+        np.where(cdp_liquidation_buffer > 0, cdp_liquidation_buffer, liquidation_buffer),
+    )
+
+    collateral = cdps.collateral()
+    principal_debt = cdps.principal_debt()
+
+    # ETH * USD/ETH >= RAI * USD/RAI * unitless
+    above_buffer = collateral * eth_price >= principal_debt * target_price * ratio
+    wipe_mask = open_mask & ~above_buffer
+    draw_mask = open_mask & above_buffer
+
+    # RAI - (USD/ETH) * ETH / (unitless * USD/RAI) -> RAI
+    wipe = np.where(wipe_mask, principal_debt - collateral * eth_price / (ratio * target_price), 0.0)
+    # (USD/ETH) * ETH / (USD/RAI * unitless) - RAI
+    draw = np.where(draw_mask, collateral * eth_price / (target_price * ratio) - principal_debt, 0.0)
+
+    invalid = (wipe < -1e-3) | (draw < -1e-3)
+    if invalid.any():
+        index = np.flatnonzero(invalid)[0]
+        raise failure.InvalidCDPTransactionException(
+            f"rebalance: {cdps.row(index)=} {wipe[index]=} {draw[index]=}"
+        )
+
+    wipe = np.maximum(wipe, 0.0)
+    draw = np.maximum(draw, 0.0)
+    # Never wipe more than the outstanding principal debt
+    wipe[cdps["drawn"] <= cdps["wiped"] + wipe + cdps["u_bitten"]] = 0.0
+
+    return wipe, draw
+
+
 def p_rebalance_cdps(params, substep, state_history, state):
     cdps = state["cdps"]
 
@@ -211,66 +259,77 @@ def p_rebalance_cdps(params, substep, state_history, state):
     ETH_balance = state['ETH_balance']
     uniswap_fee = params['uniswap_fee']
 
-    RAI_delta = 0
-    ETH_delta = 0
     UNI_delta = 0
 
-    for index, cdp in cdps.query("open == 1").iterrows():
-        if cdp['arbitrage'] == 1:
-            liquidation_buffer = 1.0
-        
-        cdp_above_liquidation_buffer = is_cdp_above_liquidation_ratio(
-            cdp, eth_price, target_price, liquidation_ratio * liquidation_buffer
-        )
-
-        if not cdp_above_liquidation_buffer:
-            # Wipe debt, using RAI from Uniswap
-            wiped = cdps.at[index, "wiped"]
-            wipe = wipe_to_liquidation_ratio(
-                cdp,
-                eth_price,
-                target_price,
-                liquidation_ratio * liquidation_buffer,
-                params["raise_on_assert"],
-            )
-            # Exchange ETH for RAI
-            ETH_delta, _ = get_output_price(wipe, ETH_balance, RAI_balance, uniswap_fee)
-            if not ETH_delta >= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{ETH_delta=}')
-            if not ETH_delta <= ETH_balance: raise failure.InvalidSecondaryMarketDeltaException(f'{ETH_delta=}')
-            RAI_delta = -wipe
-            if not RAI_delta <= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{RAI_delta=}')
-            cdps.at[index, "wiped"] = wiped + wipe
-        else:
-            # Draw debt, exchanging RAI for ETH in Uniswap
-            drawn = cdps.at[index, "drawn"]
-            draw = draw_to_liquidation_ratio(
-                cdp,
-                eth_price,
-                target_price,
-                liquidation_ratio * liquidation_buffer,
-                params["raise_on_assert"],
-            )
-            # Exchange RAI for ETH
-            _, ETH_delta = get_input_price(draw, RAI_balance, ETH_balance, uniswap_fee)
-            if not ETH_delta <= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{ETH_delta=}')
-            RAI_delta = draw
-            if not RAI_delta >= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{RAI_delta=}')
-            cdps.at[index, "drawn"] = drawn + draw
+    wipe, draw = rebalance_amounts(
+        cdps, eth_price, target_price, liquidation_ratio, liquidation_buffer
+    )
+    cdps.wipe(wipe)
+    cdps.draw(draw)
+
+    # Net the wipes (RAI bought from Uniswap) and draws (RAI sold to Uniswap) into a single trade
+    RAI_delta = draw.sum() - wipe.sum()
+    if RAI_delta >= 0:
+        # Exchange RAI for ETH
+        _, ETH_delta = get_input_price(RAI_delta, RAI_balance, ETH_balance, uniswap_fee)
+        if not ETH_delta <= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{ETH_delta=}')
+    else:
+        # Exchange ETH for RAI
+        ETH_delta, _ = get_output_price(-RAI_delta, ETH_balance, RAI_balance, uniswap_fee)
+        if not ETH_delta >= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{ETH_delta=}')
+        if not ETH_delta <= ETH_balance: raise failure.InvalidSecondaryMarketDeltaException(f'{ETH_delta=}')
 
     if params['debug']:
-        open_cdps = len(cdps.query("open == 1"))
-        closed_cdps = len(cdps.query("open == 0"))
+        open_cdps = cdps.open_count
+        closed_cdps = len(cdps) - open_cdps
         logging.debug(
             f"p_rebalance_cdps() ~ Number of open CDPs: {open_cdps}; Number of closed CDPs: {closed_cdps}"
         )
 
     uniswap_state_delta = {
-        'RAI_delta': RAI_delta,
-        'ETH_delta': ETH_delta,
+        'RAI_delta': float(RAI_delta),
+        'ETH_delta': float(ETH_delta),
         'UNI_delta': UNI_delta,
     }
 
-    return {"cdps": cdps, **uniswap_state_delta}
+    return {
+        "cdps": cdps,
+        **uniswap_state_delta,
+        **ledger_deltas(u_1=draw.sum(), u_2=wipe.sum()),
+    }
+
+
+def liquidate_cdps(cdps, liquidated_cdps, eth_price, target_price, liquidation_penalty):
+    """
+    Vectorized liquidation kernel: bite the given undercollateralized CDPs in the book in place.
+
+    Each liquidated CDP has its full principal debt and accrued interest bitten, and collateral
+    worth the debt plus the liquidation penalty seized; any remaining collateral is freed.
+    If the CDP is short of collateral, all of its collateral is bitten instead.
+
+    Returns the aggregate (v_2, v_3, u_3, w_3) deltas.
+    """
+    collateral = cdps["locked"][liquidated_cdps] - cdps["freed"][liquidated_cdps] - cdps["v_bitten"][liquidated_cdps]
+    u_bite = cdps["drawn"][liquidated_cdps] - cdps["wiped"][liquidated_cdps] - cdps["u_bitten"][liquidated_cdps]
+    w_bite = np.maximum(cdps["normalized_debt"][liquidated_cdps] * cdps.accumulated_rate - u_bite, 0.0)
+    v_bite = (u_bite * target_price * (1 + liquidation_penalty)) / eth_price
+
+    # Liquidation short of collateral: bite all remaining collateral, and free none
+    short_of_collateral = ~((v_bite >= 0) & (v_bite <= collateral) & (u_bite >= 0) & (w_bite >= 0))
+    if short_of_collateral.any():
+        logging.warning(
+            f"Liquidation short of collateral for CDPs {liquidated_cdps[short_of_collateral]}: {v_bite[short_of_collateral]} !<= {collateral[short_of_collateral]}"
+        )
+    v_bite = np.where(short_of_collateral, collateral, v_bite)
+    free = np.where(short_of_collateral, 0.0, collateral - v_bite)
+
+    cdps["v_bitten"][liquidated_cdps] += v_bite
+    cdps["freed"][liquidated_cdps] += free
+    cdps["u_bitten"][liquidated_cdps] += u_bite
+    cdps["w_bitten"][liquidated_cdps] += w_bite
+    cdps.close(liquidated_cdps)
+
+    return free.sum(), v_bite.sum(), u_bite.sum(), w_bite.sum()
 
 
 def p_liquidate_cdps(params, substep, state_history, state):
@@ -280,91 +339,27 @@ def p_liquidate_cdps(params, substep, state_history, state):
     liquidation_ratio = params["liquidation_ratio"]
 
     cdps = state["cdps"]
-    cdps_copy = cdps.copy()
-    liquidated_cdps = pd.DataFrame()
-    if len(cdps) > 0:
-        try:
-            # The aggregate arbitrage CDP is assumed to never be liquidated
-            liquidated_cdps = cdps.query("open == 1 and arbitrage == 0").query(
-                f"(locked - freed - v_bitten) * {eth_price} < (drawn - wiped - u_bitten) * {target_price} * {liquidation_ratio}"
-            )
-        except:
-            print(state)
-            raise
-
-    for index, cdp in liquidated_cdps.iterrows():
-        locked = cdps.at[index, "locked"]
-        freed = cdps.at[index, "freed"]
-        drawn = cdps.at[index, "drawn"]
-        wiped = cdps.at[index, "wiped"]
-        dripped = cdps.at[index, "dripped"]
-        v_bitten = cdps.at[index, "v_bitten"]
-        u_bitten = cdps.at[index, "u_bitten"]
-        w_bitten = cdps.at[index, "w_bitten"]
-
-        assert_log(locked >= 0, locked, params["raise_on_assert"])
-        assert_log(freed >= 0, freed, params["raise_on_assert"])
-        assert_log(drawn >= 0, drawn, params["raise_on_assert"])
-        assert_log(wiped >= 0, wiped, params["raise_on_assert"])
-        assert_log(dripped >= 0, dripped, params["raise_on_assert"])
-        assert_log(v_bitten >= 0, v_bitten, params["raise_on_assert"])
-        assert_log(u_bitten >= 0, u_bitten, params["raise_on_assert"])
-        assert_log(w_bitten >= 0, w_bitten, params["raise_on_assert"])
-
-        try:
-            v_bite = (
-                (drawn - wiped - u_bitten) * target_price * (1 + liquidation_penalty)
-            ) / eth_price
-            assert v_bite >= 0, f"{v_bite} !>= 0 ~ {state}"
-            assert v_bite <= (
-                locked - freed - v_bitten
-            ), f"Liquidation short of collateral: {v_bite} !<= {locked - freed - v_bitten}"
-            free = locked - freed - v_bitten - v_bite
-            assert free >= 0, f"{free} !>= {0}"
-            assert (
-                locked >= freed + free + v_bitten + v_bite
-            ), f"locked eq check: {(locked, freed, free, v_bitten, v_bite)}"
-            w_bite = dripped
-            assert w_bite >= 0, f"w_bite: {w_bite}"
-            u_bite = drawn - wiped - u_bitten
-            assert u_bite >= 0, f"u_bite: {u_bite}"
-            assert (
-                u_bite <= drawn - wiped - u_bitten
-            ), f"Liquidation invalid u_bite: {u_bite} !<= {drawn - wiped - u_bitten}"
-        except AssertionError as err:
-            logging.warning(err)
-            v_bite = locked - freed - v_bitten
-            u_bite = drawn - wiped - u_bitten
-            free = 0
-            w_bite = dripped
-
-        cdps.at[index, "v_bitten"] = v_bitten + v_bite
-        cdps.at[index, "freed"] = freed + free
-        cdps.at[index, "u_bitten"] = u_bitten + u_bite
-        cdps.at[index, "w_bitten"] = w_bitten + w_bite
-        cdps.at[index, "open"] = 0
-
-    v_2 = cdps["freed"].sum() - cdps_copy["freed"].sum()
-    v_3 = cdps["v_bitten"].sum() - cdps_copy["v_bitten"].sum()
-    u_3 = cdps["u_bitten"].sum() - cdps_copy["u_bitten"].sum()
-    w_3 = cdps["w_bitten"].sum() - cdps_copy["w_bitten"].sum()
+
+    # The aggregate arbitrage CDP is assumed to never be liquidated
+    liquidated_cdps = cdps.liquidatable(eth_price, target_price, liquidation_ratio)
+
+    for key in ["locked", "freed", "drawn", "wiped", "normalized_debt", "v_bitten", "u_bitten", "w_bitten"]:
+        assert_log((cdps[key][liquidated_cdps] >= 0).all(), key, params["raise_on_assert"])
+
+    v_2, v_3, u_3, w_3 = liquidate_cdps(
+        cdps, liquidated_cdps, eth_price, target_price, liquidation_penalty
+    )
 
     assert_log(v_2 >= 0, v_2, params["raise_on_assert"])
     assert_log(v_3 >= 0, v_3, params["raise_on_assert"])
     assert_log(u_3 >= 0, u_3, params["raise_on_assert"])
     assert_log(w_3 >= 0, w_3, params["raise_on_assert"])
 
-    # try:
-    #     cdps = cdps.drop(liquidated_cdps.index)
-    # except KeyError:
-    #     print('Failed to drop CDPs')
-    #     raise
-
-    if debug: logging.debug(
+    if params["debug"]: logging.debug(
         f"{len(liquidated_cdps)} CDPs liquidated with v_2 {v_2} v_3 {v_3} u_3 {u_3} w_3 {w_3}"
     )
 
-    return {"cdps": cdps}
+    return {"cdps": cdps, **ledger_deltas(v_2=v_2, v_3=v_3, u_3=u_3, w_3=w_3)}
 
 
 ############################################################################################################################################
@@ -376,30 +371,10 @@ def s_store_cdps(params, substep, state_history, state, policy_input):
 
 ############################################################################################################################################
 """
-Aggregate the state values from CDP state
+Aggregate the state values from CDP state, see the running-total ledger in `ledger.py`
 """
 
 
-def get_cdps_state_change(state, state_history, key):
-    cdps = state["cdps"]
-    previous_cdps = state_history[-1][-1]["cdps"]
-    return cdps[key].sum() - previous_cdps[key].sum()
-
-
-def s_aggregate_w_1(params, substep, state_history, state, policy_input):
-    return "w_1", get_cdps_state_change(state, state_history, "dripped")
-
-
-def s_aggregate_w_2(params, substep, state_history, state, policy_input):
-    return "w_2", get_cdps_state_change(state, state_history, "w_wiped")
-
-
-def s_aggregate_w_3(params, substep, state_history, state, policy_input):
-    return "w_3", get_cdps_state_change(state, state_history, "w_bitten")
-
-
-############################################################################################################################################
-
 def s_update_eth_collateral(params, substep, state_history, state, policy_input):
     eth_locked = state["eth_locked"]
     eth_freed = state["eth_freed"]
@@ -431,30 +406,6 @@ def s_update_principal_debt(params, substep, state_history, state, policy_input)
     return "principal_debt", principal_debt
 
 
-def s_update_eth_locked(params, substep, state_history, state, policy_input):
-    return "eth_locked", state['cdps']["locked"].sum()
-
-
-def s_update_eth_freed(params, substep, state_history, state, policy_input):
-    return "eth_freed", state['cdps']["freed"].sum()
-
-
-def s_update_eth_bitten(params, substep, state_history, state, policy_input):
-    return "eth_bitten", state['cdps']["v_bitten"].sum()
-
-
-def s_update_rai_drawn(params, substep, state_history, state, policy_input):
-    return "rai_drawn", state['cdps']["drawn"].sum()
-
-
-def s_update_rai_wiped(params, substep, state_history, state, policy_input):
-    return "rai_wiped", state['cdps']["wiped"].sum()
-
-
-def s_update_rai_bitten(params, substep, state_history, state, policy_input):
-    return "rai_bitten", state['cdps']["u_bitten"].sum()
-
-
 def s_update_system_revenue(params, substep, state_history, state, policy_input):
     system_revenue = state["system_revenue"]
     w_2 = state["w_2"]
@@ -467,61 +418,60 @@ def calculate_accrued_interest(
     return (((1 + stability_fee)) ** timedelta - 1) * (debt + accrued_interest)
 
 
-def s_update_accrued_interest(params, substep, state_history, state, policy_input):
-    previous_accrued_interest = state["accrued_interest"]
-    principal_debt = state["principal_debt"]
-
+def p_accrue_interest(params, substep, state_history, state):
+    """
+    Accrue the stability fee on the CDP book's accumulated rate, in O(1) regardless of the number of CDPs.
+    The interest dripped (w_1) is the compounded fee on the total debt, i.e. principal debt and accrued interest.
+    """
+    cdps = state["cdps"]
     stability_fee = state["stability_fee"]
-    target_rate = state["target_rate"]
     timedelta = state["timedelta"]
 
-    accrued_interest = calculate_accrued_interest(
-        stability_fee, target_rate, timedelta, principal_debt, previous_accrued_interest
-    )
-    return "accrued_interest", previous_accrued_interest + accrued_interest
+    w_1 = cdps.accrue((1 + stability_fee) ** timedelta)
 
+    return {"cdps": cdps, "w_1": w_1}
 
-def s_update_interest_bitten(params, substep, state_history, state, policy_input):
+
+def s_update_accrued_interest(params, substep, state_history, state, policy_input):
     previous_accrued_interest = state["accrued_interest"]
-    w_3 = state["w_3"]
-    return "accrued_interest", previous_accrued_interest - w_3
+    return "accrued_interest", previous_accrued_interest + policy_input["w_1"]
 
 
-def s_update_cdp_interest(params, substep, state_history, state, policy_input):
-    cdps = state["cdps"]
-    stability_fee = state["stability_fee"]
-    target_rate = state["target_rate"]
-    timedelta = state["timedelta"]
-
-    def resolve_cdp_interest(cdp):
-        if cdp["open"]:
-            principal_debt = cdp['drawn'] - cdp['wiped'] - cdp['u_bitten']
-            previous_accrued_interest = cdp["dripped"]
-            cdp["dripped"] = calculate_accrued_interest(
-                stability_fee,
-                target_rate,
-                timedelta,
-                principal_debt,
-                previous_accrued_interest,
-            )
-        return cdp
+def s_store_w_1(params, substep, state_history, state, policy_input):
+    return "w_1", policy_input["w_1"]
 
-    cdps = cdps.apply(resolve_cdp_interest, axis=1)
 
-    return "cdps", cdps
+def s_update_interest_bitten(params, substep, state_history, state, policy_input):
+    previous_accrued_interest = state["accrued_interest"]
+    w_3 = state["w_3"]
+    return "accrued_interest", previous_accrued_interest - w_3
 
 
 def s_update_cdp_metrics(params, substep, state_history, state, policy_input):
+    """
+    Compute the CDP metrics every `cdp_metrics_period` timesteps, or at control period boundaries
+    if the period is None, carrying the last value forward in between.
+
+    The mean collateral is taken from the aggregate ETH collateral ledger state,
+    so only the median requires a pass over the CDP book.
+    """
+    period = params["cdp_metrics_period"]
+    sample = (
+        state["cumulative_time"] % params["control_period"] == 0
+        if period is None
+        else state["timestep"] % period == 0
+    )
+    if state["cdp_metrics"] and not sample:
+        return "cdp_metrics", state["cdp_metrics"]
+
     cdps = state["cdps"]
+    cdp_count = len(cdps)
+    open_cdp_count = cdps.open_count
     cdp_metrics = {
-        "cdp_count": len(cdps),
-        "open_cdp_count": len(cdps.query("open == 1")),
-        "closed_cdp_count": len(cdps.query("open == 0")),
-        "mean_cdp_collateral": pd.eval(
-            "cdp_collateral = cdps.locked - cdps.freed - cdps.v_bitten", target=cdps
-        )["cdp_collateral"].mean(),
-        "median_cdp_collateral": pd.eval(
-            "cdp_collateral = cdps.locked - cdps.freed - cdps.v_bitten", target=cdps
-        )["cdp_collateral"].median(),
+        "cdp_count": cdp_count,
+        "open_cdp_count": open_cdp_count,
+        "closed_cdp_count": cdp_count - open_cdp_count,
+        "mean_cdp_collateral": state["eth_collateral"] / cdp_count if cdp_count else math.nan,
+        "median_cdp_collateral": float(np.median(cdps.collateral())) if cdp_count else math.nan,
     }
     return "cdp_metrics", cdp_metrics
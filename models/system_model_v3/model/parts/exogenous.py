@@ -0,0 +1,85 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+"""
+Exogenous drivers: time series parameters, such as the ETH price, with one series per Monte Carlo run.
+
+The drivers are called as `params[key](run, timestep)`. An `ExogenousDriver` stores the series as a
+contiguous float64 array of shape (runs, timesteps), and indexes it directly; any other callable,
+e.g. a lambda over a DataFrame, is still accepted in its place.
+"""
+
+
+class ExogenousDriver:
+    def __init__(self, values):
+        """
+        `values` is an array of shape (runs, timesteps), or of shape (timesteps,) for a single series
+        shared by every run
+        """
+        values = np.asarray(values, dtype=np.float64)
+        assert values.ndim in (1, 2), values.shape
+        self.values: np.ndarray = np.ascontiguousarray(values)
+        self._source: str = None
+
+    def __call__(self, run, timestep, df=None) -> float:
+        if self.values.ndim == 1:
+            return self.values.item(timestep)
+        return self.values.item(run - 1, timestep)
+
+    def __repr__(self) -> str:
+        return f"ExogenousDriver(shape={self.values.shape})"
+
+    def toDict(self) -> dict:
+        # Used by `DataFrame.to_json()`, e.g. for the parameters of the saved exceptions, instead of the values
+        return {"shape": list(self.values.shape), "source": self._source}
+
+    @classmethod
+    def from_dataframe(cls, df: "pd.DataFrame") -> "ExogenousDriver":
+        """
+        From a DataFrame with one column per run, named "0", "1", ... as the Monte Carlo data CSVs
+        """
+        return cls(df[[str(run) for run in range(len(df.columns))]].to_numpy(dtype=np.float64).T)
+
+    @classmethod
+    def from_callable(cls, function, runs: int, timesteps: int) -> "ExogenousDriver":
+        """
+        Materialize a `function(run, timestep)` driver, for timesteps 0 to `timesteps` inclusive
+        """
+        return cls([[function(run, timestep) for timestep in range(timesteps + 1)] for run in range(1, runs + 1)])
+
+    def __getstate__(self):
+        if self._source is not None:
+            # A memory-mapped driver is pickled by reference, e.g. when sent to pathos workers
+            return {"_source": self._source}
+        return {"values": self.values}
+
+    def __setstate__(self, state):
+        self._source = None
+        if "_source" in state:
+            self._load_values(state["_source"])
+            return
+        self.values = state["values"]
+
+    def save(self, path: str) -> None:
+        """
+        Save the values to a `.npy` file, for memory-mapped loading
+        """
+        np.save(path, self.values)
+
+    def _load_values(self, path: str) -> None:
+        # Read-only memory map: pages are shared between processes
+        self.values = np.load(path, mmap_mode="r")
+        self._source = path
+
+    @classmethod
+    def load(cls, path: str) -> "ExogenousDriver":
+        """
+        Load a driver saved with `save()` as a memory-mapped array
+        """
+        driver = cls.__new__(cls)
+        driver._load_values(path)
+        return driver
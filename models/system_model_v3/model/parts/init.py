@@ -1,14 +1,19 @@
-import random
 import numpy as np
 
+from .random_streams import EventDraws
+
 
 # Ensure all numpy RuntimeWarnings raise
 np.seterr(divide='raise', over='raise', under='ignore')
 
 def initialize_seed(params, substep, state_history, state):
-    if state['timestep'] == 0:
-        random.seed(a=f'{state["run"]}')
-    return {}
+    if state['timestep'] == 0 or state['event_draws'] is None:
+        # Created at the start of each run, as the initial state is shared by the runs
+        return {'event_draws': EventDraws(params['random_seed'], state['subset'], state['run'])}
+    return {'event_draws': state['event_draws']}
+
+def s_event_draws(params, substep, state_history, state, policy_input):
+    return 'event_draws', policy_input['event_draws']
 
 def initialize_cdps(params, substep, state_history, state):
     if not state['cdps']:
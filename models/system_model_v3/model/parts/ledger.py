@@ -0,0 +1,97 @@
+import math
+
+import models.system_model_v3.model.parts.failure_modes as failure
+
+"""
+Running-total ledger for the aggregate CDP states.
+
+Every policy that mutates the CDP book emits the aggregate u/v/w deltas of its transactions:
+* v_1: ETH locked, v_2: ETH freed, v_3: ETH bitten
+* u_1: RAI drawn, u_2: RAI wiped, u_3: RAI bitten
+* w_3: accrued interest bitten
+
+The ledger state update functions apply these deltas to the aggregate states in O(1),
+instead of re-summing the CDP book columns, and `p_reconcile_ledger` periodically checks the
+running totals against a full reduction of the book.
+"""
+
+# Aggregate state, CDP book column, and policy delta key
+ledger_entries = {
+    "eth_locked": ("locked", "v_1"),
+    "eth_freed": ("freed", "v_2"),
+    "eth_bitten": ("v_bitten", "v_3"),
+    "rai_drawn": ("drawn", "u_1"),
+    "rai_wiped": ("wiped", "u_2"),
+    "rai_bitten": ("u_bitten", "u_3"),
+}
+
+
+def ledger_deltas(**deltas):
+    """
+    Policy signal with the ledger deltas of a CDP transaction, defaulting to zero
+    """
+    return {
+        **{key: 0.0 for _, key in ledger_entries.values()},
+        **{key: float(value) for key, value in deltas.items()},
+    }
+
+
+def s_ledger_eth_locked(params, substep, state_history, state, policy_input):
+    return "eth_locked", state["eth_locked"] + policy_input["v_1"]
+
+
+def s_ledger_eth_freed(params, substep, state_history, state, policy_input):
+    return "eth_freed", state["eth_freed"] + policy_input["v_2"]
+
+
+def s_ledger_eth_bitten(params, substep, state_history, state, policy_input):
+    return "eth_bitten", state["eth_bitten"] + policy_input["v_3"]
+
+
+def s_ledger_rai_drawn(params, substep, state_history, state, policy_input):
+    return "rai_drawn", state["rai_drawn"] + policy_input["u_1"]
+
+
+def s_ledger_rai_wiped(params, substep, state_history, state, policy_input):
+    return "rai_wiped", state["rai_wiped"] + policy_input["u_2"]
+
+
+def s_ledger_rai_bitten(params, substep, state_history, state, policy_input):
+    return "rai_bitten", state["rai_bitten"] + policy_input["u_3"]
+
+
+def s_ledger_w_3(params, substep, state_history, state, policy_input):
+    return "w_3", policy_input["w_3"]
+
+
+def s_ledger_interest_bitten(params, substep, state_history, state, policy_input):
+    return "interest_bitten", state["interest_bitten"] + policy_input["w_3"]
+
+
+# State update functions to add to every partial state update block with a CDP-mutating policy
+ledger_variables = {
+    "eth_locked": s_ledger_eth_locked,
+    "eth_freed": s_ledger_eth_freed,
+    "eth_bitten": s_ledger_eth_bitten,
+    "rai_drawn": s_ledger_rai_drawn,
+    "rai_wiped": s_ledger_rai_wiped,
+    "rai_bitten": s_ledger_rai_bitten,
+}
+
+
+def p_reconcile_ledger(params, substep, state_history, state):
+    """
+    Every `ledger_reconciliation_period` timesteps, check the ledger running totals against
+    a full reduction of the CDP book. Disabled when the period is zero.
+    """
+    period = params["ledger_reconciliation_period"]
+    if period and state["timestep"] % period == 0:
+        cdps = state["cdps"]
+        for aggregate, (column, _) in ledger_entries.items():
+            running_total = state[aggregate]
+            book_total = cdps.sum(column)
+            if not math.isclose(running_total, book_total, rel_tol=1e-9, abs_tol=1e-6):
+                raise failure.InvalidCDPStateException(
+                    f"Ledger {aggregate} {running_total=} != {book_total=}"
+                )
+    return {}
@@ -0,0 +1,82 @@
+import numpy as np
+
+"""
+Sorted liquidation index over the CDP book.
+
+A CDP is below the liquidation ratio when
+    (locked - freed - v_bitten) * eth_price < (drawn - wiped - u_bitten) * target_price * liquidation_ratio
+i.e. when its debt-to-collateral ratio (RAI / ETH) exceeds eth_price / (target_price * liquidation_ratio).
+
+The index keeps the open, non-arbitrage CDPs sorted by their debt-to-collateral ratio, which does not
+depend on the ETH price or the redemption price. A move in either price only rescales the query threshold,
+so detecting the k CDPs that crossed their liquidation price costs O(log n + k) without rebuilding the index.
+
+Re-indexing m changed CDPs merges them into the sorted arrays, in O(n + m log m): a linear pass
+instead of the O(n log n) sort of a rebuild, which is only used when a large fraction of the index changed.
+"""
+
+
+def debt_to_collateral_ratio(cdps, indices) -> np.ndarray:
+    """
+    Debt-to-collateral ratio in RAI / ETH; infinite for indebted CDPs without collateral
+    """
+    collateral = cdps["locked"][indices] - cdps["freed"][indices] - cdps["v_bitten"][indices]
+    principal_debt = cdps["drawn"][indices] - cdps["wiped"][indices] - cdps["u_bitten"][indices]
+    ratio = np.where(principal_debt > 0, np.inf, 0.0)
+    np.divide(principal_debt, collateral, out=ratio, where=collateral > 0)
+    return ratio
+
+
+class LiquidationIndex:
+    """
+    Sorted array of debt-to-collateral ratios, with the CDP book index of each entry
+    """
+
+    # Rebuild instead of updating incrementally when more than this fraction of the index changed
+    rebuild_fraction = 0.1
+
+    def __init__(self, cdps):
+        self.rebuild(cdps)
+
+    def __len__(self) -> int:
+        return len(self.cdps)
+
+    def rebuild(self, cdps) -> None:
+        indices = np.flatnonzero(cdps.open_mask & ~cdps.arbitrage_mask)
+        ratios = debt_to_collateral_ratio(cdps, indices)
+        order = np.argsort(ratios, kind="stable")
+        self.ratios = ratios[order]
+        self.cdps = indices[order]
+
+    def update(self, cdps, indices) -> None:
+        """
+        Re-index the CDPs whose position changed, e.g. after rebalancing or liquidation, in O(n + m log m) for m CDPs
+        """
+        indices = np.unique(indices)
+        if len(indices) == 0:
+            return
+        if len(indices) > self.rebuild_fraction * max(len(self.cdps), 1):
+            self.rebuild(cdps)
+            return
+
+        # Remove the stale entries, with a mask over the book rather than `np.isin`, which sorts
+        stale = np.zeros(len(cdps), dtype=bool)
+        stale[indices] = True
+        keep = ~stale[self.cdps]
+        self.ratios = self.ratios[keep]
+        self.cdps = self.cdps[keep]
+
+        # Insert the CDPs that are still open
+        indices = indices[cdps.open_mask[indices] & ~cdps.arbitrage_mask[indices]]
+        ratios = debt_to_collateral_ratio(cdps, indices)
+        order = np.argsort(ratios, kind="stable")
+        positions = np.searchsorted(self.ratios, ratios[order])
+        self.ratios = np.insert(self.ratios, positions, ratios[order])
+        self.cdps = np.insert(self.cdps, positions, indices[order])
+
+    def above(self, threshold: float) -> np.ndarray:
+        """
+        Book indices of the CDPs with a debt-to-collateral ratio above the threshold
+        """
+        position = np.searchsorted(self.ratios, threshold, side="right")
+        return self.cdps[position:]
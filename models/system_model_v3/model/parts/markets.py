@@ -1,11 +1,9 @@
-import scipy.stats as sts
 import numpy as np
-import copy
-import random
 import logging
 import math
 
 import models.system_model_v3.model.parts.uniswap as uniswap
+from .shadow_oracles import ShadowOracleBank
 from .utils import print_time
 
 
@@ -20,9 +18,8 @@ def p_liquidity_demand(params, substep, state_history, state):
 
         uniswap_fee = params["uniswap_fee"]
 
-        swap = random.randint(0, 1)
         # Positive == swap in, or add liquidity event; negative == swap out or remove liquidity event
-        direction = 1 if random.randint(0, 1) else -1
+        swap, direction = state["event_draws"].draw(state["timestep"])
 
         UNI_delta = 0
         if swap:
@@ -142,10 +139,8 @@ def p_market_price(params, substep, state_history, state):
     market_price *= state["eth_price"]
 
     # Retrieve RAI
-    # @danlessa note:
-    # this is possibly slow
-    # mostly because of appends and deepcopying
-    uniswap_oracle = copy.deepcopy(state["uniswap_oracle"])
+    # The oracle keeps fixed-size ring buffers, so snapshotting it is cheap
+    uniswap_oracle = state["uniswap_oracle"].copy()
     uniswap_oracle.update_result(state)
     median_price = uniswap_oracle.median_price
 
@@ -166,3 +161,39 @@ def s_market_price_twap(params, substep, state_history, state, policy_input):
 
 def s_uniswap_oracle(params, substep, state_history, state, policy_input):
     return "uniswap_oracle", policy_input["uniswap_oracle"]
+
+
+def p_shadow_oracles(params, substep, state_history, state):
+    """
+    Update the shadow oracles with the same state as the Uniswap Oracle.
+
+    Output:
+        shadow_oracles: Mutated shadow oracle bank, or None without shadow oracles
+        shadow_market_price_twap: Median RAI price according to each shadow oracle
+    """
+    shadow_oracles = state["shadow_oracles"]
+    if shadow_oracles is None:
+        if not params["shadow_oracle_configs"]:
+            return {"shadow_oracles": None, "shadow_market_price_twap": None}
+        # Created on the first update, as the initial state is shared by the runs
+        shadow_oracles = ShadowOracleBank(params["shadow_oracle_configs"])
+
+    return {
+        "shadow_oracles": shadow_oracles,
+        "shadow_market_price_twap": shadow_oracles.update_result(state).copy(),
+    }
+
+
+def s_shadow_oracles(params, substep, state_history, state, policy_input):
+    return "shadow_oracles", policy_input["shadow_oracles"]
+
+
+def s_shadow_market_price_twap(params, substep, state_history, state, policy_input):
+    return "shadow_market_price_twap", policy_input["shadow_market_price_twap"]
+
+
+def s_shadow_market_price_twap_error(params, substep, state_history, state, policy_input):
+    shadow_market_price_twap = policy_input["shadow_market_price_twap"]
+    if shadow_market_price_twap is None:
+        return "shadow_market_price_twap_error", None
+    return "shadow_market_price_twap_error", shadow_market_price_twap - policy_input["market_price_twap"]
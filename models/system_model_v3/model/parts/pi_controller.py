@@ -0,0 +1,82 @@
+from functools import lru_cache
+
+import numpy as np
+
+import models.constants as constants
+
+"""
+Array version of the PI controller in `controllers.py`, stepping many controller configurations at once,
+e.g. the subsets of a controller sweep in the lockstep engine.
+
+Every argument may be a scalar or an array with one entry per controller, and is broadcast against
+the others. The results match the scalar functions exactly.
+"""
+
+
+@lru_cache(maxsize=None)
+def leak_factor(alpha: float, timedelta: int) -> float:
+    """
+    Fraction of the error integral that remains after `timedelta` seconds, for a leak `alpha` in 1/RAY
+    """
+    return float(alpha / constants.RAY) ** timedelta
+
+
+def leak_factors(alpha, timedelta) -> np.ndarray:
+    """
+    Array version of `leak_factor()`, computing the power once per distinct (alpha, timedelta)
+    """
+    alpha, timedelta = np.broadcast_arrays(np.asarray(alpha, dtype=np.float64), np.asarray(timedelta))
+    pairs, inverse = np.unique(np.stack([alpha.ravel(), timedelta.ravel()]), axis=1, return_inverse=True)
+    factors = np.array([leak_factor(float(a), float(t)) for a, t in pairs.T])
+    return factors[inverse.ravel()].reshape(alpha.shape)
+
+
+def update_error_star_integral(error_star_integral, old_error, new_error, timedelta, alpha, leaky):
+    """
+    Leaky, or plain, trapezoid rule integral of the error, as `controllers.update_error_star_integral()`
+    """
+    error_star_integral, old_error, new_error = (
+        np.asarray(value, dtype=np.float64) for value in (error_star_integral, old_error, new_error)
+    )
+    mean_error = (old_error + new_error) / 2
+    area = mean_error * timedelta
+    remaining = np.where(leaky, leak_factors(alpha, timedelta) * error_star_integral, error_star_integral)
+    return remaining + area
+
+
+def update_target_rate(cumulative_time, control_period, kp, ki, error_star, error_star_integral, target_rate, controller_enabled):
+    """
+    PI controller target rate, updated at every control period, as `controllers.update_target_rate()`
+    """
+    kp, ki, error_star, error_star_integral, target_rate = (
+        np.asarray(value, dtype=np.float64) for value in (kp, ki, error_star, error_star_integral, target_rate)
+    )
+    # Only the lanes at a control period need the new rate, but computing it for every lane is cheaper than selecting them
+    control = np.asarray(cumulative_time) % np.asarray(control_period) == 0
+    updated_rate = kp * error_star + (ki / control_period) * error_star_integral
+    return np.where(controller_enabled, np.where(control, updated_rate, target_rate), 0.0)
+
+
+def _growth(target_rate: float, timedelta: int) -> float:
+    try:
+        return (1 + target_rate) ** timedelta
+    except OverflowError:
+        return np.inf
+
+
+def update_target_price(target_price, target_rate, timedelta):
+    """
+    Target price compounded by the target rate, as `controllers.update_target_price()`,
+    returning (target_price, failed) where failed entries overflowed
+    """
+    target_price, target_rate, timedelta = np.broadcast_arrays(
+        np.asarray(target_price, dtype=np.float64), np.asarray(target_rate, dtype=np.float64), np.asarray(timedelta)
+    )
+    # The power is evaluated with the libm `pow()` of the scalar function: NumPy's vectorized power
+    # differs from it in the last bit on some CPUs
+    growth = np.array(list(map(_growth, target_rate.ravel().tolist(), timedelta.ravel().tolist())), dtype=np.float64)
+    growth = growth.reshape(target_price.shape)
+    failed = np.isinf(growth) & np.isfinite(target_rate)
+    with np.errstate(over="ignore", invalid="ignore"):
+        compounded = target_price * growth
+    return np.where(compounded < 0, 0.0, compounded), failed
@@ -0,0 +1,55 @@
+import numpy as np
+
+"""
+Random streams of the stochastic policies.
+
+Each (subset, run) has an independent NumPy `Generator`, derived from the `random_seed` parameter, so the
+draws of a run don't depend on the other runs, or on the order or process they are executed in.
+The generators use the counter-based Philox bit generator.
+
+The liquidity demand event draws are generated in blocks of `block_size` timesteps ahead of the policies,
+and read by timestep. A run only moves forward, so only the block of the current timestep is kept.
+"""
+
+block_size = 24 * 365
+
+
+def generator(random_seed: int, subset: int, run: int) -> np.random.Generator:
+    """
+    The independent random stream of a (subset, run)
+    """
+    return np.random.Generator(np.random.Philox(np.random.SeedSequence(random_seed, spawn_key=(subset, run))))
+
+
+class EventDraws:
+    """
+    Liquidity demand event draws of a (subset, run), indexed by timestep:
+    * swap: a swap event if true, otherwise a liquidity event
+    * direction: 1 to swap in or add liquidity, -1 to swap out or remove liquidity
+    """
+
+    def __init__(self, random_seed: int, subset: int, run: int):
+        self.generator = generator(random_seed, subset, run)
+        # The draws of the current block, from timestep `block_start`
+        self.block_start = -block_size
+        self.swap = np.zeros(0, dtype=bool)
+        self.direction = np.zeros(0, dtype=np.int64)
+
+    def _generate(self, timestep: int) -> None:
+        # Skipped blocks are drawn too, so the draws of a timestep don't depend on the timesteps read before it
+        while timestep >= self.block_start + block_size:
+            draws = self.generator.integers(0, 2, size=(2, block_size), dtype=np.int64)
+            self.block_start += block_size
+        self.swap = draws[0] == 1
+        self.direction = np.where(draws[1] == 1, 1, -1)
+
+    def draw(self, timestep: int):
+        """
+        The (swap, direction) draw of a timestep, at or after the block of the latest timestep drawn
+        """
+        if timestep < self.block_start:
+            raise ValueError(f"Timestep {timestep} is before the current block of event draws, from timestep {self.block_start}")
+        if timestep >= self.block_start + block_size:
+            self._generate(timestep)
+        index = timestep - self.block_start
+        return bool(self.swap[index]), int(self.direction[index])
@@ -0,0 +1,53 @@
+import math
+
+import numpy as np
+
+import models.options as options
+
+
+class RunningMean:
+    """
+    Running mean of a price series, updated in O(1) per observation (see `options.PriceMeanType`):
+    * CUMULATIVE: mean of every observation
+    * WINDOW: mean of the last `window` observations, kept in a ring buffer
+    * EWMA: exponentially weighted moving average with a span of `window` observations,
+      i.e. a smoothing factor of 2 / (window + 1)
+    """
+
+    def __init__(self, mean_type: int = options.PriceMeanType.CUMULATIVE.value, window: int = None):
+        if mean_type != options.PriceMeanType.CUMULATIVE.value and not (window and window > 0):
+            raise ValueError(f"Price mean type {mean_type} requires a positive window, not {window}")
+        self.mean_type = mean_type
+        self.window = window
+        self.count = 0
+        self.total = 0.0
+        self.mean = math.nan
+        self._buffer = np.zeros(window) if mean_type == options.PriceMeanType.WINDOW.value else None
+
+    def update(self, value: float) -> float:
+        """
+        Add an observation, and return the updated mean
+        """
+        if self.mean_type == options.PriceMeanType.CUMULATIVE.value:
+            self.total += value
+            self.count += 1
+            self.mean = self.total / self.count
+        elif self.mean_type == options.PriceMeanType.WINDOW.value:
+            slot = self.count % self.window
+            if self.count >= self.window:
+                self.total -= float(self._buffer[slot])
+            self._buffer[slot] = value
+            self.count += 1
+            if slot == self.window - 1:
+                # Re-sum the window once per cycle, so rounding errors do not accumulate
+                self.total = math.fsum(self._buffer)
+            else:
+                self.total += value
+            self.mean = self.total / min(self.count, self.window)
+        elif self.mean_type == options.PriceMeanType.EWMA.value:
+            alpha = 2 / (self.window + 1)
+            self.mean = value if self.count == 0 else self.mean + alpha * (value - self.mean)
+            self.count += 1
+        else:
+            raise ValueError(f"Invalid price mean type {self.mean_type}")
+        return self.mean
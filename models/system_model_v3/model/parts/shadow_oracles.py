@@ -0,0 +1,87 @@
+from typing import List
+
+import numpy as np
+
+from .uniswap_oracle import UniswapOracle
+
+"""
+Shadow oracle bank: several `UniswapOracle` configurations observing the same pool as the controller's
+oracle, for oracle lag diagnostics, without affecting the simulation.
+
+Each shadow oracle accumulates the prices as `UniswapOracle` does: only when it updates, over the time elapsed
+since its latest observation, and stores its observations in its own `granularity + 1` slot ring buffer.
+The oracles are stored as rows of arrays, so an update of the whole bank is a few array operations,
+and a shadow oracle with the same configuration as the controller's oracle reproduces `market_price_twap` exactly.
+"""
+
+
+class ShadowOracleBank:
+    def __init__(self, oracle_configs: List[dict]):
+        """
+        `oracle_configs` are the `UniswapOracle` keyword arguments of each shadow oracle
+        """
+        # Validate the configurations
+        oracles = [UniswapOracle(**config) for config in oracle_configs]
+        self.oracle_configs = oracle_configs
+        self.granularity = np.array([oracle.granularity for oracle in oracles], dtype=np.int64)
+        self.period_size = np.array([oracle.period_size for oracle in oracles], dtype=np.float64)
+        self.slots = self.granularity + 1
+
+        # Cumulative prices of each shadow oracle
+        self.price_0_cumulative = np.zeros(len(oracles))
+        self.converter_price_cumulative = np.zeros(len(oracles))
+
+        # Ring buffers of the observations of each shadow oracle
+        shape = (len(oracles), int(self.slots.max(initial=1)))
+        self.updates = np.zeros(len(oracles), dtype=np.int64)
+        self.timestamps = np.zeros(shape)
+        self.price_0_cumulatives = np.zeros(shape)
+        self.time_adjusted_prices = np.zeros(shape)
+        self.median_price = np.zeros(len(oracles))
+
+    def _observation(self, name, rows, index):
+        return getattr(self, name)[rows, index % self.slots[rows]]
+
+    def update_result(self, state: dict) -> np.ndarray:
+        """
+        Observe the pool state, and return the median price of each shadow oracle
+        """
+        now = state["cumulative_time"]
+
+        # Update the oracles whose period has elapsed since their latest observation
+        rows = np.arange(len(self.updates))
+        time_elapsed_since_latest = now - np.where(self.updates > 0, self._observation("timestamps", rows, self.updates - 1), 0)
+        due = (self.updates == 0) | (time_elapsed_since_latest >= self.period_size)
+        rows = rows[due]
+        if len(rows) == 0:
+            return self.median_price
+        time_elapsed_since_latest = time_elapsed_since_latest[due]
+        updates = self.updates[rows]
+        granularity = self.granularity[rows]
+
+        # As `UniswapOracle.update_result()`, in the same order of operations
+        self.price_0_cumulative[rows] += time_elapsed_since_latest * state["ETH_balance"] / state["RAI_balance"]
+        time_adjusted_price = state["eth_price"] * time_elapsed_since_latest
+        slot = updates % self.slots[rows]
+        self.timestamps[rows, slot] = now
+        self.price_0_cumulatives[rows, slot] = self.price_0_cumulative[rows]
+        self.time_adjusted_prices[rows, slot] = time_adjusted_price
+
+        # The converter feed cumulative price drops the observations older than `granularity` updates
+        self.converter_price_cumulative[rows] += time_adjusted_price
+        self.converter_price_cumulative[rows] -= np.where(
+            updates >= granularity,
+            self._observation("time_adjusted_prices", rows, np.maximum(updates - granularity, 0)),
+            0.0,
+        )
+
+        first = np.where(updates <= granularity, 0, updates - granularity)
+        time_since_first = now - self._observation("timestamps", rows, first)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            uniswap_amount_out = (self.price_0_cumulative[rows] - self._observation("price_0_cumulatives", rows, first)) / time_since_first
+            median_price = uniswap_amount_out * (self.converter_price_cumulative[rows] / time_since_first)
+        # The median price is only computed from the third update
+        self.median_price[rows] = np.where(updates > 1, median_price, self.median_price[rows])
+        self.updates[rows] += 1
+
+        return self.median_price
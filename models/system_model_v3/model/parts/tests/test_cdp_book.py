@@ -0,0 +1,125 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+from models.system_model_v3.model.parts.debt_market import open_cdp_lock, is_cdp_above_liquidation_ratio
+
+eth_price = 300
+target_price = 2.0
+liquidation_ratio = 1.5
+
+
+def make_cdps():
+    return [
+        {**open_cdp_lock(100, eth_price, target_price, liquidation_ratio * 2), 'arbitrage': 0},
+        {**open_cdp_lock(50, eth_price, target_price, liquidation_ratio), 'arbitrage': 0},
+        {**open_cdp_lock(10, eth_price, target_price, liquidation_ratio), 'arbitrage': 1},
+    ]
+
+
+def test_dataframe_round_trip():
+    df = pd.DataFrame(make_cdps())
+    book = CDPBook.from_dataframe(df)
+
+    assert len(book) == 3
+    assert book.sum("locked") == df["locked"].sum()
+    assert book.arbitrage_index() == 2
+
+    result = book.to_dataframe()
+    for key in CDPBook.columns:
+        assert np.allclose(result[key].to_numpy(), df[key].to_numpy())
+
+
+def test_append_grows_capacity():
+    book = CDPBook(capacity=1)
+    for cdp in make_cdps():
+        book.append(cdp)
+
+    assert len(book) == 3
+    assert book.capacity >= 3
+    assert book.open_count == 3
+    assert book.row(1)["locked"] == 50
+
+
+def test_column_views_mutate_book():
+    book = CDPBook.from_records(make_cdps())
+    copy = book.copy()
+
+    book["wiped"][0] += 1.0
+    book.set(1, "open", False)
+
+    assert book.at(0, "wiped") == 1.0
+    assert copy.at(0, "wiped") == 0.0
+    assert book.open_count == 2
+    assert list(book.open_indices()) == [0, 2]
+
+
+def test_vectorized_liquidation_ratio():
+    book = CDPBook.from_records(make_cdps())
+    above = is_cdp_above_liquidation_ratio(book, eth_price * 0.9, target_price, liquidation_ratio)
+
+    for index in range(len(book)):
+        assert above[index] == is_cdp_above_liquidation_ratio(book.row(index), eth_price * 0.9, target_price, liquidation_ratio)
+
+
+def test_pickle_valid_rows_only():
+    book = CDPBook.from_records(make_cdps(), capacity=1000)
+    restored = pickle.loads(pickle.dumps(book))
+
+    assert len(restored) == len(book)
+    assert restored.capacity == book.capacity
+    assert np.array_equal(restored["drawn"], book["drawn"])
+
+
+def test_accumulated_rate():
+    book = CDPBook.from_records(make_cdps())
+    principal_debt = book.principal_debt().copy()
+
+    dripped = book.accrue(1.01)
+    assert np.isclose(dripped, 0.01 * principal_debt.sum())
+    assert np.allclose(book.accrued_interest(), 0.01 * principal_debt)
+
+    # Drawing and wiping principal debt leaves the accrued interest unchanged
+    book.draw(10.0, 0)
+    book.wipe(5.0, 1)
+    assert np.allclose(book.accrued_interest(), 0.01 * principal_debt)
+
+    dripped += book.accrue(1.02)
+    # Aggregate and per-CDP accrued interest agree
+    assert np.isclose(dripped, book.dripped().sum())
+    assert np.isclose(book.total_normalized_debt, book.sum("normalized_debt"))
+    assert np.isclose(book.row(0)["dripped"], book.dripped()[0])
+
+
+def test_saved_book_round_trip(tmp_path):
+    book = CDPBook.from_records(make_cdps())
+    book.accrue(1.05)
+    book.save(str(tmp_path))
+    loaded = CDPBook.load(str(tmp_path))
+
+    assert loaded.accumulated_rate == book.accumulated_rate
+    assert loaded.total_normalized_debt == book.total_normalized_debt
+    assert np.array_equal(loaded.accrued_interest(), book.accrued_interest())
+
+    # An unmodified book is pickled by reference, and any write pickles its columns
+    assert pickle.loads(pickle.dumps(loaded))._source == str(tmp_path)
+    loaded.set(1, "w_wiped", 1.0)
+    restored = pickle.loads(pickle.dumps(loaded))
+    assert restored._source is None
+    assert restored.at(1, "w_wiped") == 1.0
+
+
+def test_copy_of_saved_book(tmp_path):
+    book = CDPBook.from_records(make_cdps())
+    book.save(str(tmp_path))
+    loaded = CDPBook.load(str(tmp_path))
+
+    # The copy of an unmodified book maps the saved columns again, and is independent of the original
+    copy = loaded.copy()
+    assert copy._source == str(tmp_path)
+    copy.set(0, "w_wiped", 1.0)
+    assert loaded.at(0, "w_wiped") == 0.0
+    assert np.array_equal(pickle.loads(pickle.dumps(loaded))["w_wiped"], book["w_wiped"])
+    assert pickle.loads(pickle.dumps(copy)).at(0, "w_wiped") == 1.0
@@ -0,0 +1,60 @@
+import pickle
+
+import numpy as np
+
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+from models.system_model_v3.model.parts.debt_market import open_cdp_lock, rebalance_amounts
+from models.system_model_v3.model.state_variables.cdp_population import generate_cdp_population
+
+eth_price = 300.0
+target_price = 3.14
+liquidation_ratio = 1.45
+total_debt = 5e6
+
+
+def generate(**kwargs):
+    return generate_cdp_population(10_000, total_debt, eth_price, target_price, liquidation_ratio, **kwargs)
+
+
+def test_population_is_seeded_and_heterogeneous():
+    book = generate(seed=1, cache_dir=None)
+
+    assert np.array_equal(book["drawn"], generate(seed=1, cache_dir=None)["drawn"])
+    assert not np.array_equal(book["drawn"], generate(seed=2, cache_dir=None)["drawn"])
+    assert np.isclose(book.sum("drawn"), total_debt)
+    assert np.unique(book["liquidation_buffer"]).size == len(book)
+    # Every CDP starts above the liquidation ratio
+    assert len(book.liquidatable(eth_price, target_price, liquidation_ratio)) == 0
+
+
+def test_rebalance_uses_per_cdp_liquidation_buffer():
+    book = generate(seed=1, cache_dir=None, extra_cdps=[
+        {**open_cdp_lock(1000, eth_price, target_price, liquidation_ratio), 'arbitrage': 1},
+    ])
+    wipe, draw = rebalance_amounts(book, eth_price, target_price, liquidation_ratio, 2.0)
+    book.wipe(wipe)
+    book.draw(draw)
+
+    ratio = book.collateral() * eth_price / (book.principal_debt() * target_price)
+    assert np.allclose(ratio[:-1], liquidation_ratio * book["liquidation_buffer"][:-1])
+    assert np.isclose(ratio[-1], liquidation_ratio)
+
+
+def test_cached_population_is_memory_mapped(tmp_path):
+    book = generate(seed=3, cache_dir=str(tmp_path))
+    cached = generate(seed=3, cache_dir=str(tmp_path))
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert isinstance(cached._data["drawn"], np.memmap)
+    assert np.array_equal(book["locked"], cached["locked"])
+
+    # Unmodified books are pickled by reference, modified books by value
+    assert len(pickle.dumps(cached)) < 1000
+    restored = pickle.loads(pickle.dumps(cached))
+    assert np.array_equal(restored["drawn"], cached["drawn"])
+
+    cached.draw(10.0, 0)
+    restored = pickle.loads(pickle.dumps(cached))
+    assert restored.at(0, "drawn") == book.at(0, "drawn") + 10.0
+    # Copy-on-write: the cache itself is unchanged
+    assert CDPBook.load(str(next(tmp_path.iterdir()))).at(0, "drawn") == book.at(0, "drawn")
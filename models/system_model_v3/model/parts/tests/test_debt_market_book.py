@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+import models.system_model_v3.model.parts.debt_market as debt_market
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+from models.system_model_v3.model.parts.uniswap import get_input_price, get_output_price
+
+eth_price = 300
+target_price = 2.0
+liquidation_ratio = 1.5
+liquidation_buffer = 2.0
+
+params = {
+    'liquidation_ratio': liquidation_ratio,
+    'liquidation_buffer': liquidation_buffer,
+    'uniswap_fee': 0.003,
+    'raise_on_assert': True,
+    'debug': False,
+}
+
+
+def make_cdps():
+    return [
+        {**debt_market.open_cdp_lock(100, eth_price, target_price, liquidation_ratio * liquidation_buffer * 1.2), 'arbitrage': 0},
+        {**debt_market.open_cdp_lock(100, eth_price, target_price, liquidation_ratio * liquidation_buffer * 0.8), 'arbitrage': 0},
+        {**debt_market.open_cdp_lock(50, eth_price, target_price, liquidation_ratio * 0.9), 'arbitrage': 0},
+        {**debt_market.open_cdp_lock(1000, eth_price, target_price, liquidation_ratio * 1.1), 'arbitrage': 1},
+    ]
+
+
+def make_book(cdps=None):
+    book = CDPBook.from_records(cdps or make_cdps())
+    book.set(2, "open", False)
+    return book
+
+
+def make_state(book):
+    return {
+        'cdps': book,
+        'eth_price': eth_price,
+        'target_price': target_price,
+        'RAI_balance': 1e6,
+        'ETH_balance': 1e6 * target_price / eth_price,
+    }
+
+
+def test_rebalance_amounts_match_scalar_functions():
+    book = make_book()
+    wipe, draw = debt_market.rebalance_amounts(book, eth_price, target_price, liquidation_ratio, liquidation_buffer)
+
+    for index in range(len(book)):
+        cdp = book.row(index)
+        if not cdp['open']:
+            assert wipe[index] == 0 and draw[index] == 0
+            continue
+        ratio = liquidation_ratio * (1.0 if cdp['arbitrage'] else liquidation_buffer)
+        if debt_market.is_cdp_above_liquidation_ratio(cdp, eth_price, target_price, ratio):
+            assert wipe[index] == 0
+            assert math.isclose(draw[index], debt_market.draw_to_liquidation_ratio(cdp, eth_price, target_price, ratio))
+        else:
+            assert draw[index] == 0
+            assert math.isclose(wipe[index], debt_market.wipe_to_liquidation_ratio(cdp, eth_price, target_price, ratio))
+
+
+def test_rebalance_cdps_nets_pool_trade():
+    book = make_book()
+    state = make_state(book)
+    wipe, draw = debt_market.rebalance_amounts(book.copy(), eth_price, target_price, liquidation_ratio, liquidation_buffer)
+
+    result = debt_market.p_rebalance_cdps(params, 0, [], state)
+
+    net = draw.sum() - wipe.sum()
+    assert math.isclose(result['RAI_delta'], net)
+    if net >= 0:
+        _, ETH_delta = get_input_price(net, state['RAI_balance'], state['ETH_balance'], params['uniswap_fee'])
+    else:
+        ETH_delta, _ = get_output_price(-net, state['ETH_balance'], state['RAI_balance'], params['uniswap_fee'])
+    assert math.isclose(result['ETH_delta'], ETH_delta)
+
+    # Every open CDP is back at its liquidation ratio times buffer
+    rebalanced = result['cdps']
+    ratio = liquidation_ratio * np.where(rebalanced.arbitrage_mask, 1.0, liquidation_buffer)
+    open_mask = rebalanced.open_mask
+    assert np.allclose(
+        (rebalanced.collateral() * eth_price)[open_mask],
+        (rebalanced.principal_debt() * target_price * ratio)[open_mask],
+    )
+
+
+def test_liquidate_cdps():
+    cdps = make_cdps()
+    # Undercollateralized, but with enough collateral to cover the debt
+    cdps[0]["drawn"] = cdps[0]["locked"] * eth_price / (target_price * liquidation_ratio * 0.9)
+    # Short of collateral
+    cdps[1]["drawn"] = cdps[1]["locked"] * eth_price / (target_price * 0.5)
+    cdps[1]["dripped"] = 5.0
+    # Undercollateralized arbitrage CDP is never liquidated
+    cdps[3]["drawn"] = cdps[3]["locked"] * eth_price / (target_price * liquidation_ratio * 0.5)
+    book = make_book(cdps)
+    previous = book.copy()
+
+    liquidated = book.liquidatable(eth_price, target_price, liquidation_ratio)
+    v_2, v_3, u_3, w_3 = debt_market.liquidate_cdps(book, liquidated, eth_price, target_price, 0.1)
+
+    assert list(liquidated) == [0, 1]
+    assert list(book.open_mask) == [False, False, False, True]
+    # Liquidated CDPs have no remaining collateral or debt
+    assert np.allclose(book.collateral()[liquidated], 0)
+    assert np.allclose(book.principal_debt()[liquidated], 0)
+
+    v_bite = previous.principal_debt()[0] * target_price * 1.1 / eth_price
+    assert math.isclose(book.at(0, "v_bitten"), v_bite)
+    assert math.isclose(book.at(0, "freed"), previous.collateral()[0] - v_bite)
+    assert book.at(1, "v_bitten") == previous.collateral()[1]
+    assert book.at(1, "freed") == 0
+    assert math.isclose(book.at(1, "w_bitten"), 5.0)
+    assert np.allclose(book.accrued_interest(), 0)
+    assert book.total_normalized_debt == book.sum("normalized_debt")
+
+    assert math.isclose(v_2, book.sum("freed") - previous.sum("freed"))
+    assert math.isclose(v_3, book.sum("v_bitten") - previous.sum("v_bitten"))
+    assert math.isclose(u_3, book.sum("u_bitten") - previous.sum("u_bitten"))
+    assert math.isclose(w_3, book.sum("w_bitten") - previous.sum("w_bitten"))
+
+
+def test_cdp_metrics_sampling():
+    book = make_book()
+    state = {
+        'cdps': book,
+        'cdp_metrics': {},
+        'eth_collateral': book.collateral().sum(),
+        'timestep': 1,
+        'cumulative_time': 3600,
+    }
+    metrics_params = {'cdp_metrics_period': 4, 'control_period': 3600 * 4}
+
+    _, metrics = debt_market.s_update_cdp_metrics(metrics_params, 0, [], state, {})
+    assert metrics['cdp_count'] == 4
+    assert metrics['open_cdp_count'] == 3
+    assert metrics['closed_cdp_count'] == 1
+    assert math.isclose(metrics['mean_cdp_collateral'], book.collateral().mean())
+    assert metrics['median_cdp_collateral'] == np.median(book.collateral())
+
+    # Carried forward between samples
+    sentinel = {'cdp_count': -1}
+    _, carried = debt_market.s_update_cdp_metrics(metrics_params, 0, [], {**state, 'cdp_metrics': sentinel}, {})
+    assert carried is sentinel
+    _, sampled = debt_market.s_update_cdp_metrics(metrics_params, 0, [], {**state, 'cdp_metrics': sentinel, 'timestep': 4}, {})
+    assert sampled == metrics
+
+    # Sampled at control period boundaries
+    control_params = {**metrics_params, 'cdp_metrics_period': None}
+    _, carried = debt_market.s_update_cdp_metrics(control_params, 0, [], {**state, 'cdp_metrics': sentinel}, {})
+    assert carried is sentinel
+    _, sampled = debt_market.s_update_cdp_metrics(control_params, 0, [], {**state, 'cdp_metrics': sentinel, 'cumulative_time': 3600 * 8}, {})
+    assert sampled == metrics
@@ -0,0 +1,50 @@
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from models.system_model_v3.model.parts.exogenous import ExogenousDriver
+from models.system_model_v3.model.state_variables.historical_state import eth_price_df
+
+
+def test_from_dataframe_matches_lookup():
+    driver = ExogenousDriver.from_dataframe(eth_price_df)
+    lookup = lambda run, timestep, df=eth_price_df: df[str(run-1)].iloc[timestep]
+
+    assert driver.values.shape == (len(eth_price_df.columns), len(eth_price_df))
+    assert driver.values.flags.c_contiguous
+    for run in (1, 2, 10):
+        for timestep in (0, 1, 100, len(eth_price_df) - 1):
+            assert driver(run, timestep) == lookup(run, timestep)
+
+
+def test_from_callable():
+    driver = ExogenousDriver.from_callable(lambda run, timestep: run * 1000 + timestep, runs=3, timesteps=10)
+    assert driver.values.shape == (3, 11)
+    assert driver(2, 10) == 2010.0
+    assert isinstance(driver(1, 0), float)
+
+    # A single series is shared by every run
+    shared = ExogenousDriver(np.arange(5))
+    assert shared(1, 3) == shared(4, 3) == 3.0
+
+
+def test_memory_mapped_driver_is_pickled_by_reference(tmp_path):
+    driver = ExogenousDriver(np.random.default_rng(1).uniform(size=(4, 1000)))
+    path = str(tmp_path / "driver.npy")
+    driver.save(path)
+
+    loaded = ExogenousDriver.load(path)
+    assert isinstance(loaded.values, np.memmap)
+    assert np.array_equal(loaded.values, driver.values)
+
+    pickled = pickle.dumps(loaded)
+    assert len(pickled) < 1000
+    unpickled = pickle.loads(pickled)
+    assert isinstance(unpickled.values, np.memmap) and unpickled(3, 999) == driver(3, 999)
+    # An in-memory driver is pickled by value
+    assert pickle.loads(pickle.dumps(driver))(3, 999) == driver(3, 999)
+
+    # Parameters are saved to JSON without the values
+    assert json.loads(pd.Series([{'eth_price': loaded}]).to_json()) == {'0': {'eth_price': {'shape': [4, 1000], 'source': path}}}
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from models.system_model_v3.model.state_variables.historical_state import cache_mc_data, load_mc_data
+
+
+def write_csv(path, seed):
+    df = pd.DataFrame(np.random.default_rng(seed).uniform(size=(100, 3)), columns=['0', '1', '2'])
+    df.to_csv(path)
+    return pd.read_csv(path, index_col=0)
+
+
+def test_cache_matches_csv(tmp_path):
+    csv_path = str(tmp_path / 'data.csv')
+    expected = write_csv(csv_path, 1)
+
+    df = load_mc_data(csv_path)
+    assert os.path.exists(tmp_path / 'data.npy')
+    assert np.array_equal(df.to_numpy(), expected.to_numpy())
+    assert list(df.columns) == list(expected.columns) and list(df.index) == list(expected.index)
+
+    # The cache holds one row per run, so a run's series is contiguous
+    values = np.load(cache_mc_data(csv_path), mmap_mode='r')
+    assert values.shape == (3, 100) and np.array_equal(values[1], expected['1'])
+
+
+def test_cache_invalidation(tmp_path):
+    csv_path = str(tmp_path / 'data.csv')
+    write_csv(csv_path, 1)
+    cache_path = cache_mc_data(csv_path)
+    cached = os.stat(cache_path).st_mtime_ns
+
+    # Touching the CSV keeps the cache, as the content is unchanged
+    os.utime(csv_path, ns=(cached + 10**9, cached + 10**9))
+    assert cache_mc_data(csv_path) == cache_path
+    assert os.stat(cache_path).st_mtime_ns == cached
+
+    # Changing the CSV rebuilds the cache
+    expected = write_csv(csv_path, 2)
+    assert np.array_equal(load_mc_data(csv_path).to_numpy(), expected.to_numpy())
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+
+def imported_modules(statement):
+    code = f"import sys; {statement}; print(' '.join(sys.modules))"
+    return set(subprocess.check_output([sys.executable, "-c", code], text=True).split())
+
+
+def test_model_import_is_lazy():
+    modules = imported_modules(
+        "import models.system_model_v3.model.params.init, models.system_model_v3.model.state_variables.init"
+    )
+    assert not {"numpy", "pandas", "scipy"} & modules
+
+    modules = imported_modules("import models.system_model_v3.model.partial_state_update_blocks")
+    assert not {"pandas", "scipy"} & modules
+
+
+def test_attributes_are_loaded_on_access():
+    modules = imported_modules(
+        "from models.system_model_v3.model.params.init import params, load_params; "
+        "from models.system_model_v3.model.state_variables.init import state_variables; "
+        "assert params['eth_price'][0](1, 0) == state_variables['eth_price']; "
+        "assert load_params() is not params"
+    )
+    assert "models.system_model_v3.model.state_variables.liquidity" in modules
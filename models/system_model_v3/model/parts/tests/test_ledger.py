@@ -0,0 +1,42 @@
+import pytest
+
+import models.system_model_v3.model.parts.failure_modes as failure
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+from models.system_model_v3.model.parts.debt_market import open_cdp_lock
+from models.system_model_v3.model.parts.ledger import ledger_deltas, ledger_entries, ledger_variables, p_reconcile_ledger
+
+
+def make_state():
+    book = CDPBook.from_records([
+        {**open_cdp_lock(100, 300, 2.0, 1.5), 'arbitrage': 0},
+        {**open_cdp_lock(50, 300, 2.0, 1.5), 'arbitrage': 1},
+    ])
+    state = {aggregate: book.sum(column) for aggregate, (column, _) in ledger_entries.items()}
+    return {**state, 'cdps': book, 'timestep': 24}
+
+
+def test_ledger_deltas_default_to_zero():
+    deltas = ledger_deltas(u_1=1, v_1=2)
+    assert deltas == {'v_1': 2.0, 'v_2': 0.0, 'v_3': 0.0, 'u_1': 1.0, 'u_2': 0.0, 'u_3': 0.0}
+
+
+def test_ledger_tracks_book():
+    params = {'ledger_reconciliation_period': 24}
+    state = make_state()
+    book = state['cdps']
+
+    book.draw(10.0, 0)
+    book.wipe(4.0, 1)
+    book['locked'][1] += 3.0
+    policy_input = ledger_deltas(u_1=10.0, u_2=4.0, v_1=3.0)
+    for function in ledger_variables.values():
+        key, value = function(params, 0, [], state, policy_input)
+        state[key] = value
+
+    assert p_reconcile_ledger(params, 0, [], state) == {}
+
+    state['rai_wiped'] += 1.0
+    with pytest.raises(failure.InvalidCDPStateException):
+        p_reconcile_ledger(params, 0, [], state)
+    # Only reconciled every period
+    assert p_reconcile_ledger(params, 0, [], {**state, 'timestep': 25}) == {}
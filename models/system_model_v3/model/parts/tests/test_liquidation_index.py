@@ -0,0 +1,58 @@
+import numpy as np
+
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+
+liquidation_ratio = 1.45
+
+
+def make_book(n, rng):
+    book = CDPBook(capacity=n)
+    locked = rng.uniform(1, 100, n)
+    ratios = rng.uniform(1.2, 3.0, n)
+    for index in range(n):
+        book.append({
+            'open': 1,
+            'arbitrage': int(index == 0),
+            'locked': locked[index],
+            'drawn': locked[index] * 300 / (2.0 * ratios[index]),
+        })
+    return book
+
+
+def brute_force(book, eth_price, target_price):
+    return np.flatnonzero(
+        book.open_mask
+        & ~book.arbitrage_mask
+        & (book.collateral() * eth_price < book.principal_debt() * target_price * liquidation_ratio)
+    )
+
+
+def test_liquidatable_matches_brute_force():
+    rng = np.random.default_rng(1)
+    book = make_book(2000, rng)
+
+    eth_price = 300.0
+    target_price = 2.0
+    for step in range(50):
+        eth_price *= rng.uniform(0.97, 1.03)
+        # Redemption price drift rescales the query, without rebuilding the index
+        target_price *= rng.uniform(0.999, 1.001)
+
+        liquidatable = book.liquidatable(eth_price, target_price, liquidation_ratio)
+        assert np.array_equal(liquidatable, brute_force(book, eth_price, target_price))
+
+        # Incremental updates: a few positions change, and the liquidatable CDPs are closed
+        changed = rng.choice(len(book), 5, replace=False)
+        book.draw(rng.uniform(0, 10, 5), changed)
+        book.set(int(changed[0]), "locked", book.at(int(changed[0]), "locked") * 1.1)
+        book.close(liquidatable)
+        book.append({'open': 1, 'arbitrage': 0, 'locked': 10.0, 'drawn': 10.0 * eth_price / (target_price * 2.0)})
+
+
+def test_index_rebuilt_after_copy_and_pickle():
+    rng = np.random.default_rng(2)
+    book = make_book(100, rng)
+    expected = brute_force(book, 200.0, 2.0)
+
+    assert np.array_equal(book.liquidatable(200.0, 2.0, liquidation_ratio), expected)
+    assert np.array_equal(book.copy().liquidatable(200.0, 2.0, liquidation_ratio), expected)
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Engine, Backend
+
+import models.system_model_v3.model.parts.failure_modes as failure
+import models.system_model_v3.model.parts.markets as markets
+import models.system_model_v3.model.parts.uniswap as uniswap
+from models.system_model_v3.model.lockstep import LockstepEngine, LockstepExperiment
+from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
+from models.system_model_v3.model.params.init import params
+from models.system_model_v3.model.state_variables.init import state_variables
+
+
+def run_both(model, timesteps, runs):
+    experiment = Experiment([Simulation(model=model, timesteps=timesteps, runs=runs)])
+    experiment.engine = Engine(backend=Backend.SINGLE_PROCESS, raise_exceptions=False, deepcopy=False, drop_substeps=True)
+    experiment.run()
+
+    lockstep = LockstepExperiment(model, timesteps=timesteps, runs=runs)
+    lockstep.run()
+    return experiment, lockstep
+
+
+def assert_same_results(expected, result):
+    expected = pd.DataFrame(expected)
+    result = pd.DataFrame(result)
+    assert list(result.columns) == list(expected.columns)
+    assert len(result) == len(expected)
+    for column in expected.columns:
+        if column in ("cdps", "uniswap_oracle", "eth_price_running_mean", "event_draws"):
+            continue
+        if expected[column].dtype.kind == "f":
+            assert np.array_equal(result[column].to_numpy(float), expected[column].to_numpy(float), equal_nan=True), column
+        else:
+            assert list(result[column]) == list(expected[column]), column
+
+
+def test_lockstep_matches_radcad():
+    sweep = {**params, 'kp': [2e-7, 1e-6]}
+    model = Model(initial_state=state_variables, state_update_blocks=partial_state_update_blocks, params=sweep)
+    experiment, lockstep = run_both(model, timesteps=50, runs=2)
+
+    assert_same_results(experiment.results, lockstep.results)
+    assert [(e['run'], e['subset'], e['exception']) for e in lockstep.exceptions] == \
+        [(e['run'], e['subset'], e['exception']) for e in experiment.exceptions]
+
+
+def p_drain(params, substep, state_history, state):
+    return {'RAI_delta': params['delta']}
+
+
+def s_count(params, substep, state_history, state, policy_input):
+    if state['count'] >= params['limit']:
+        raise failure.AssertionError(state['count'])
+    return 'count', state['count'] + 1
+
+
+def p_swap(params, substep, state_history, state):
+    return {'RAI_delta': params['delta'], 'ETH_delta': 0.0, 'UNI_delta': params['UNI_delta']}
+
+
+def s_market_price(params, substep, state_history, state, policy_input):
+    return 'market_price', params['market_price']
+
+
+def test_failed_lanes_are_masked():
+    # Subset 1 drains the pool in an array kernel, and subset 2 raises in a per-lane function
+    model = Model(
+        initial_state={'RAI_balance': 10.0, 'count': 0},
+        state_update_blocks=[{
+            'policies': {'drain': p_drain},
+            'variables': {'RAI_balance': uniswap.update_RAI_balance, 'count': s_count},
+        }],
+        params={'delta': [-1.0, -3.0, -1.0], 'limit': [100, 100, 5]},
+    )
+    experiment, lockstep = run_both(model, timesteps=8, runs=2)
+
+    assert_same_results(experiment.results, lockstep.results)
+    assert [type(e['exception']) for e in lockstep.exceptions] == [
+        type(None), failure.NegativeBalanceException, failure.AssertionError,
+    ] * 2
+
+    # Subset 1 empties the pool, and subset 3 has a zero market price, in the slippage kernel
+    model = Model(
+        initial_state={'RAI_balance': 10.0, 'ETH_balance': 5.0, 'eth_price': 100.0, 'market_price': 50.0, 'market_slippage': 0.0},
+        state_update_blocks=[
+            {'policies': {}, 'variables': {'market_price': s_market_price}},
+            {'policies': {'swap': p_swap}, 'variables': {'market_slippage': markets.s_slippage}},
+        ],
+        params={'delta': [-1.0, -10.0, -10.0, -1.0], 'UNI_delta': [0.0, 0.0, 1.0, 0.0], 'market_price': [50.0, 50.0, 50.0, 0.0]},
+    )
+    experiment, lockstep = run_both(model, timesteps=3, runs=2)
+
+    assert_same_results(experiment.results, lockstep.results)
+    assert [type(e['exception']) for e in lockstep.exceptions] == [type(None), ZeroDivisionError, type(None), ZeroDivisionError] * 2
+
+
+def test_sharded_lanes():
+    model = Model(
+        initial_state={'RAI_balance': 10.0, 'count': 0},
+        state_update_blocks=[{
+            'policies': {'drain': p_drain},
+            'variables': {'RAI_balance': uniswap.update_RAI_balance, 'count': s_count},
+        }],
+        params={'delta': [-1.0, -3.0, -1.0], 'limit': [100, 100, 5]},
+    )
+    experiment, _ = run_both(model, timesteps=8, runs=2)
+    # 6 lanes in 4 uneven shards
+    sharded = LockstepExperiment(model, timesteps=8, runs=2, retain_history=False, processes=4)
+    sharded.run()
+
+    assert_same_results(experiment.results, sharded.results)
+    assert [(e['run'], e['subset'], type(e['exception'])) for e in sharded.exceptions] == \
+        [(e['run'], e['subset'], type(e['exception'])) for e in experiment.exceptions]
+
+
+def test_history_free_execution():
+    model = Model(initial_state=state_variables, state_update_blocks=partial_state_update_blocks, params=params)
+    experiment, lockstep = run_both(model, timesteps=30, runs=1)
+    history_free = LockstepExperiment(model, timesteps=30, runs=1, retain_history=False)
+    history_free.run()
+
+    assert_same_results(experiment.results, history_free.results)
+
+
+def test_history_free_execution_spills_the_history():
+    model = Model(
+        initial_state={'RAI_balance': 10.0, 'count': 0},
+        state_update_blocks=[{
+            'policies': {'drain': p_drain},
+            'variables': {'RAI_balance': uniswap.update_RAI_balance, 'count': s_count},
+        }],
+        params={'delta': [-1.0, -3.0, -1.0], 'limit': [100, 100, 5]},
+    )
+    experiment, _ = run_both(model, timesteps=8, runs=2)
+
+    engine = LockstepEngine(model.initial_state, model.state_update_blocks, model.params, timesteps=8, runs=2, retain_history=False)
+    results, _ = engine.run()
+    assert_same_results(experiment.results, results)
+    # Every timestep was spilled, the failed lanes' included
+    assert all(history == [] for history in engine.histories)
+    assert [len(offsets) for offsets in engine._spilled] == [9, 4, 6] * 2
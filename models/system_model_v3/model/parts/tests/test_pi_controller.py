@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import models.constants as constants
+import models.options as options
+import models.system_model_v3.model.parts.controllers as controllers
+import models.system_model_v3.model.parts.failure_modes as failure
+from models.system_model_v3.model.parts import pi_controller
+
+rng = np.random.default_rng(0)
+n = 200
+
+configs = {
+    "kp": rng.uniform(0, 5e-7, n),
+    "ki": rng.uniform(-5e-9, 0, n),
+    "alpha": rng.choice([0.999 * constants.RAY, 0.9999 * constants.RAY, 1.0 * constants.RAY], n),
+    "control_period": rng.choice([3600, 3600 * 4, 3600 * 24], n),
+    "IntegralType": rng.choice([options.IntegralType.LEAKY.value, options.IntegralType.DEFAULT.value], n),
+}
+states = {
+    "cumulative_time": rng.choice([3600, 3600 * 4, 3600 * 7, 3600 * 24], n),
+    "timedelta": rng.choice([3600, 7200], n),
+    "error_star": rng.normal(0, 0.1, n),
+    "error_star_integral": rng.normal(0, 1e4, n),
+    "target_rate": rng.normal(0, 1e-8, n),
+    "target_price": rng.uniform(2, 4, n),
+}
+policy_inputs = {
+    "error_star": rng.normal(0, 0.1, n),
+    "controller_enabled": rng.choice([True, False], n),
+}
+
+
+def lane(values, i):
+    return {key: value[i].item() for key, value in values.items()}
+
+
+def test_target_rate_parity():
+    target_rate = pi_controller.update_target_rate(
+        states["cumulative_time"], configs["control_period"], configs["kp"], configs["ki"],
+        states["error_star"], states["error_star_integral"], states["target_rate"], policy_inputs["controller_enabled"],
+    )
+    for i in range(n):
+        _, expected = controllers.update_target_rate(lane(configs, i), 0, None, lane(states, i), lane(policy_inputs, i))
+        assert target_rate[i] == expected
+
+
+def test_error_star_integral_parity():
+    error_star_integral = pi_controller.update_error_star_integral(
+        states["error_star_integral"], states["error_star"], policy_inputs["error_star"], states["timedelta"],
+        configs["alpha"], configs["IntegralType"] == options.IntegralType.LEAKY.value,
+    )
+    for i in range(n):
+        _, expected = controllers.update_error_star_integral(lane(configs, i), 0, None, lane(states, i), lane(policy_inputs, i))
+        assert error_star_integral[i] == expected
+
+
+def test_error_star_integral_keeps_fraction():
+    # A leaky integral smaller than 1 USD * second is not truncated to 0
+    error_star_integral = pi_controller.update_error_star_integral(0.5, 0, 0, 3600, 0.999 * constants.RAY, True)
+    assert error_star_integral == pytest.approx(0.5 * 0.999 ** 3600)
+    assert error_star_integral > 0
+
+
+def test_leak_factors():
+    alpha = np.array([0.999, 0.999, 0.9999, 0.999]) * constants.RAY
+    timedelta = np.array([3600, 7200, 3600, 3600])
+    expected = [pi_controller.leak_factor(a, t) for a, t in zip(alpha.tolist(), timedelta.tolist())]
+    assert pi_controller.leak_factors(alpha, timedelta).tolist() == expected
+    assert pi_controller.leak_factors(alpha[0], 3600).shape == ()
+
+
+def test_target_price_parity():
+    target_price, failed = pi_controller.update_target_price(states["target_price"], states["target_rate"], states["timedelta"])
+    assert not failed.any()
+    for i in range(n):
+        _, expected = controllers.update_target_price(lane(configs, i), 0, None, lane(states, i), {})
+        assert target_price[i] == expected
+
+
+def test_target_price_overflow():
+    target_price, failed = pi_controller.update_target_price([3.0, 3.0, 3.0], [1.0, 1e-8, -2.0], [3600, 3600, 3601])
+    assert failed.tolist() == [True, False, False]
+    assert target_price[2] == 0
+    with pytest.raises(failure.ControllerTargetOverflowException):
+        controllers.update_target_price({}, 0, None, {"target_price": 3.0, "target_rate": 1.0, "timedelta": 3600}, {})
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from models.system_model_v3.model.parts import random_streams
+from models.system_model_v3.model.parts.random_streams import EventDraws
+
+
+def test_draws_are_reproducible():
+    draws = EventDraws(0, subset=1, run=2)
+    every_timestep = [draws.draw(timestep) for timestep in range(4 * random_streams.block_size)]
+    assert {direction for _, direction in every_timestep} == {-1, 1}
+
+    # Skipping timesteps, and whole blocks, generates the same draws
+    skipping = EventDraws(0, subset=1, run=2)
+    for timestep in [0, 5, 2, random_streams.block_size + 3, 3 * random_streams.block_size + 1]:
+        assert skipping.draw(timestep) == every_timestep[timestep]
+
+    # Only the current block is kept
+    assert len(skipping.swap) == random_streams.block_size
+    with pytest.raises(ValueError):
+        skipping.draw(random_streams.block_size)
+
+
+def test_streams_are_independent():
+    def swaps(random_seed, subset, run):
+        draws = EventDraws(random_seed, subset, run)
+        draws.draw(0)
+        return draws.swap
+
+    assert not np.array_equal(swaps(0, 0, 1), swaps(0, 1, 1))
+    assert not np.array_equal(swaps(0, 0, 1), swaps(0, 0, 2))
+    assert not np.array_equal(swaps(0, 0, 1), swaps(1, 0, 1))
+    assert np.array_equal(swaps(0, 0, 1), swaps(0, 0, 1))
+    assert abs(swaps(0, 0, 1).mean() - 0.5) < 0.05
@@ -0,0 +1,33 @@
+import statistics
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import models.options as options
+from models.system_model_v3.model.parts.running_mean import RunningMean
+
+prices = list(np.random.default_rng(1).uniform(100, 1000, 500))
+
+
+def test_cumulative_mean():
+    running_mean = RunningMean()
+    for index, price in enumerate(prices):
+        assert running_mean.update(price) == pytest.approx(statistics.mean(prices[:index + 1]), rel=1e-12)
+
+
+def test_window_mean():
+    running_mean = RunningMean(options.PriceMeanType.WINDOW.value, window=24)
+    for index, price in enumerate(prices):
+        assert running_mean.update(price) == pytest.approx(np.mean(prices[max(index - 23, 0):index + 1]), rel=1e-12)
+
+
+def test_ewma():
+    running_mean = RunningMean(options.PriceMeanType.EWMA.value, window=24)
+    expected = pd.Series(prices).ewm(span=24, adjust=False).mean()
+    assert [running_mean.update(price) for price in prices] == pytest.approx(list(expected), rel=1e-12)
+
+
+def test_window_required():
+    with pytest.raises(ValueError):
+        RunningMean(options.PriceMeanType.WINDOW.value)
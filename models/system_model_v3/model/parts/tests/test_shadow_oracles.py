@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Engine, Backend
+
+from models.system_model_v3.model.parts.shadow_oracles import ShadowOracleBank
+from models.system_model_v3.model.parts.uniswap_oracle import UniswapOracle
+from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
+from models.system_model_v3.model.params.init import params
+from models.system_model_v3.model.state_variables.init import state_variables
+
+configs = [
+    dict(granularity=4, window_size=4*3600, max_window_size=8*3600),
+    dict(granularity=2, window_size=2*3600, max_window_size=3*3600),
+    dict(granularity=6, window_size=12*3600, max_window_size=24*3600),
+]
+
+
+def states(n=500):
+    # Hourly states
+    rng = np.random.default_rng(1)
+    prices = rng.uniform([200, 1e3, 1e5], [400, 2e3, 2e5], (n, 3))
+    return [
+        dict(zip(['cumulative_time', 'eth_price', 'ETH_balance', 'RAI_balance'], [3600 * (i + 1), *prices[i]]))
+        for i in range(n)
+    ]
+
+
+def test_matches_oracles():
+    bank = ShadowOracleBank(configs)
+    oracles = [UniswapOracle(**config) for config in configs]
+    for state in states():
+        median_prices = bank.update_result(state)
+        for oracle in oracles:
+            oracle.update_result(state)
+        assert list(median_prices) == [oracle.median_price for oracle in oracles]
+    assert list(bank.updates) == [oracle.updates for oracle in oracles]
+    assert list(bank.price_0_cumulative) == [oracle.price_0_cumulative for oracle in oracles]
+    assert list(bank.converter_price_cumulative) == [oracle.converter_price_cumulative for oracle in oracles]
+
+
+def test_model_records_shadow_twap():
+    controller_config = dict(granularity=4, window_size=16*3600, max_window_size=24*3600)
+    model = Model(
+        initial_state=state_variables,
+        state_update_blocks=partial_state_update_blocks,
+        params={**params, 'shadow_oracle_configs': [[controller_config, configs[0]], []]},
+    )
+    experiment = Experiment([Simulation(model=model, timesteps=100, runs=1)])
+    experiment.engine = Engine(backend=Backend.SINGLE_PROCESS, deepcopy=False, drop_substeps=True)
+    experiment.run()
+    df = pd.DataFrame(experiment.results)
+
+    shadow = df[(df.subset == 0) & (df.timestep > 0)]
+    twap = np.stack(shadow.shadow_market_price_twap)
+    error = np.stack(shadow.shadow_market_price_twap_error)
+    assert twap.shape == (100, 2)
+    assert np.array_equal(error, twap - shadow.market_price_twap.to_numpy()[:, None])
+    # The shadow oracle with the controller's configuration reproduces its TWAP
+    assert (shadow.market_price_twap > 0).any()
+    assert np.array_equal(twap[:, 0], shadow.market_price_twap)
+    assert df[df.subset == 1].shadow_market_price_twap.isna().all()
@@ -0,0 +1,54 @@
+import numpy as np
+
+from models.system_model_v3.model.parts import uniswap, uniswap_batch
+
+rng = np.random.default_rng(1)
+n = 1000
+x_balance = rng.uniform(1e3, 1e6, n)
+y_balance = rng.uniform(1e3, 1e6, n)
+voucher_balance = rng.uniform(1e3, 1e6, n)
+fee = rng.uniform(0, 0.01, n)
+
+
+def test_prices_match_scalar_functions():
+    dx = rng.uniform(-0.5, 2, n) * x_balance
+    dy = rng.uniform(0, 0.99, n) * y_balance
+
+    input_dx, input_dy, input_failed = uniswap_batch.get_input_price(dx, x_balance, y_balance, fee)
+    output_dx, output_dy, output_failed = uniswap_batch.get_output_price(dy, x_balance, y_balance, fee)
+
+    assert not input_failed.any() and not output_failed.any()
+    for i in range(n):
+        assert np.allclose((input_dx[i], input_dy[i]), uniswap.get_input_price(dx[i], x_balance[i], y_balance[i], fee[i]))
+        assert np.allclose((output_dx[i], output_dy[i]), uniswap.get_output_price(dy[i], x_balance[i], y_balance[i], fee[i]))
+        assert np.isclose(
+            uniswap_batch.collateral_to_token(dx[i], x_balance[i], y_balance[i], fee[i])[0],
+            uniswap.collateral_to_token(dx[i], x_balance[i], y_balance[i], fee[i]),
+        )
+
+
+def test_liquidity_matches_scalar_functions():
+    tokens = rng.uniform(0, 0.99, n) * voucher_balance
+    value = rng.uniform(0, 1e4, n)
+
+    added = uniswap_batch.add_liquidity(x_balance, y_balance, voucher_balance, tokens, value)
+    removed = uniswap_batch.remove_liquidity(x_balance, y_balance, voucher_balance, tokens)
+
+    assert not added[-1].any() and not removed[-1].any()
+    for i in range(n):
+        assert np.allclose([d[i] for d in added[:-1]], uniswap.add_liquidity(x_balance[i], y_balance[i], voucher_balance[i], tokens[i], value[i]))
+        assert np.allclose([d[i] for d in removed[:-1]], uniswap.remove_liquidity(x_balance[i], y_balance[i], voucher_balance[i], tokens[i]))
+
+
+def test_failures_are_masked():
+    # Buying more than the reserves, from an empty pool, and with a 100% fee
+    dx, dy, failed = uniswap_batch.get_output_price([1.0, 2.0, 1.0, 1.0], [1.0, 1.0, 0.0, 1.0], 2.0, [0.0, 0.0, 0.0, 1.0])
+    assert list(failed) == [False, True, True, True]
+    assert np.all(dx[failed] == 0) and np.all(dy[failed] == 0)
+
+    _, _, failed = uniswap_batch.get_input_price([-1.0, 1.0], 1.0, 1.0, 0.0)
+    assert list(failed) == [True, False]
+
+    # Trading into an empty reserve returns zero, like the scalar functions
+    tokens, failed = uniswap_batch.token_to_collateral([1.0, 1.0], 1.0, [0.0, 1.0], 0.0)
+    assert list(tokens) == [0.0, 0.5] and not failed.any()
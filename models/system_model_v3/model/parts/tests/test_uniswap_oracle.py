@@ -1,3 +1,5 @@
+import random
+
 from models.system_model_v3.model.parts.uniswap_oracle import UniswapOracle
 
 def test_oracle_init():
@@ -23,4 +25,67 @@ def test_oracle_update_obs():
     assert oracle.updates - 1 == (N - 1) / (window_size / granularity)
     assert oracle.last_update_time == N
 
-    oracle.update_result(state, update=False)
\ No newline at end of file
+    oracle.update_result(state, update=False)
+
+def reference_median_prices(states, granularity, window_size):
+    """
+    List-based consecutive slots medianizer, keeping every observation
+    """
+    period_size = window_size / granularity
+    observations = []  # (timestamp, price_0_cumulative, time_adjusted_price)
+    price_0_cumulative = converter_price_cumulative = 0.0
+    median_price = 0
+    median_prices = []
+    for state in states:
+        now = state['cumulative_time']
+        time_elapsed = now - (observations[-1][0] if observations else 0)
+        if not observations or time_elapsed >= period_size:
+            updates = len(observations)
+            first = 0 if updates <= granularity else updates - granularity
+            price_0_cumulative += time_elapsed * state['ETH_balance'] / state['RAI_balance']
+            time_adjusted_price = state['eth_price'] * time_elapsed
+            observations.append((now, price_0_cumulative, time_adjusted_price))
+            converter_price_cumulative += time_adjusted_price
+            if updates >= granularity:
+                converter_price_cumulative -= observations[first][2]
+            if updates > 1:
+                time_since_first = now - observations[first][0]
+                amount_out = (price_0_cumulative - observations[first][1]) / time_since_first
+                median_price = amount_out * (converter_price_cumulative / time_since_first)
+        median_prices.append(median_price)
+    return median_prices
+
+
+def test_ring_buffer_matches_reference():
+    rng = random.Random(1)
+    states = []
+    cumulative_time = 0
+    for _ in range(2000):
+        cumulative_time += rng.choice([1800, 3600, 3600, 7200])
+        states.append({'cumulative_time': cumulative_time,
+                       'eth_price': rng.uniform(200, 400),
+                       'ETH_balance': rng.uniform(1e3, 2e3),
+                       'RAI_balance': rng.uniform(1e5, 2e5)})
+
+    oracle = UniswapOracle(granularity=4, window_size=16*3600, max_window_size=24*3600)
+    median_prices = []
+    for state in states:
+        # Snapshot and update, as in `p_market_price`
+        oracle = oracle.copy()
+        oracle.update_result(state)
+        median_prices.append(oracle.median_price)
+
+    assert median_prices == reference_median_prices(states, granularity=4, window_size=16*3600)
+    assert len(oracle.uniswap_observations) == oracle.granularity + 1
+    assert [o.timestamp for o in oracle.converter_feed_observations] == sorted(o.timestamp for o in oracle.uniswap_observations)
+
+
+def test_copy_is_independent():
+    oracle = UniswapOracle(granularity=4, window_size=16*3600, max_window_size=24*3600)
+    state = {'cumulative_time': 4*3600, 'eth_price': 300.0, 'ETH_balance': 1.0, 'RAI_balance': 100.0}
+    oracle.update_result(state)
+    snapshot = oracle.copy()
+    oracle.update_result({**state, 'cumulative_time': 8*3600})
+
+    assert snapshot.updates == 1 and oracle.updates == 2
+    assert snapshot.uniswap_observations == oracle.uniswap_observations[:1]
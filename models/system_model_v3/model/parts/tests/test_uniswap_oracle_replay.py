@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from models.system_model_v3.model.parts.uniswap_oracle import UniswapOracle
+from models.system_model_v3.model.parts.uniswap_oracle_replay import replay_results, replay_twap
+
+configs = [
+    dict(granularity=4, window_size=16*3600, max_window_size=24*3600),
+    dict(granularity=3, window_size=3*3600, max_window_size=4*3600),
+    dict(granularity=6, window_size=36*3600, max_window_size=48*3600),
+]
+
+
+def trajectory(seed, n=1000):
+    rng = np.random.default_rng(seed)
+    return {
+        'cumulative_time': np.cumsum(rng.choice([1800, 3600, 3600, 7200], n)),
+        'ETH_balance': rng.uniform(1e3, 2e3, n),
+        'RAI_balance': rng.uniform(1e5, 2e5, n),
+        'eth_price': rng.uniform(200, 400, n),
+    }
+
+
+def oracle_twap(states, config):
+    oracle = UniswapOracle(**config)
+    median_prices = []
+    for state in pd.DataFrame(states).to_dict('records'):
+        oracle.update_result(state)
+        median_prices.append(oracle.median_price)
+    return np.array(median_prices)
+
+
+def test_replay_matches_oracle():
+    states = trajectory(1)
+    for config in configs:
+        expected = oracle_twap(states, config)
+        result = replay_twap(**states, **config)
+        assert np.allclose(result, expected, rtol=1e-9, atol=0)
+
+
+def test_replay_results():
+    runs = []
+    for run in (1, 2):
+        states = pd.DataFrame(trajectory(run, 200))
+        initial_state = pd.DataFrame([{**states.iloc[0], 'cumulative_time': 0}])
+        runs.append(pd.concat([initial_state, states]).assign(subset=0, run=run, timestep=range(201)))
+    df = pd.concat(runs, ignore_index=True)
+
+    twap = replay_results(df, configs)
+
+    assert list(twap.columns) == [0, 1, 2]
+    assert twap[df.timestep == 0].isna().all().all()
+    for run in (1, 2):
+        states = df[(df.run == run) & (df.timestep > 0)]
+        for column, config in enumerate(configs):
+            assert np.allclose(twap.loc[states.index, column], oracle_twap(states[list(trajectory(0, 1))], config), rtol=1e-9, atol=0)
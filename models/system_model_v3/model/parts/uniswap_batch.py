@@ -0,0 +1,116 @@
+import numpy as np
+
+"""
+Array versions of the Uniswap pricing functions in `uniswap.py`.
+
+Every argument may be a scalar or an array (e.g. one entry per pool or per Monte Carlo run),
+and is broadcast against the others. Instead of raising, each function returns a boolean `failed`
+mask as its last element; the deltas of failed entries are zero, so they can be applied
+unconditionally and the failed entries masked out afterwards:
+* non-positive pool balances
+* trades that would leave a non-positive balance, e.g. buying more than the reserves
+* fees outside [0, 1)
+"""
+
+
+def _arrays(*args):
+    return (np.asarray(arg, dtype=np.float64) for arg in args)
+
+
+def _result(failed, *deltas):
+    return tuple(np.where(failed, 0.0, delta) for delta in deltas) + (failed,)
+
+
+def add_liquidity(reserve_balance, supply_balance, voucher_balance, tokens, value):
+    """
+    Array version of `uniswap.add_liquidity()`, returning (dr, ds, dv, failed)
+    """
+    reserve_balance, supply_balance, voucher_balance, tokens, value = np.broadcast_arrays(
+        *_arrays(reserve_balance, supply_balance, voucher_balance, tokens, value)
+    )
+    initial = voucher_balance <= 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = value / reserve_balance
+    failed = (~initial & ~(reserve_balance > 0)) | ~(value >= 0) | ~(tokens >= 0)
+
+    dr = np.where(initial, value, alpha * reserve_balance)
+    ds = np.where(initial, tokens, alpha * supply_balance)
+    dv = np.where(initial, tokens, alpha * voucher_balance)
+    return _result(failed, dr, ds, dv)
+
+
+def remove_liquidity(reserve_balance, supply_balance, voucher_balance, tokens):
+    """
+    Array version of `uniswap.remove_liquidity()`, returning (dr, ds, dv, failed)
+    """
+    reserve_balance, supply_balance, voucher_balance, tokens = _arrays(reserve_balance, supply_balance, voucher_balance, tokens)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = tokens / voucher_balance
+    # Removing all of the liquidity would leave empty reserves
+    failed = ~(voucher_balance > 0) | ~(alpha >= 0) | ~(alpha < 1)
+
+    dr = -alpha * reserve_balance
+    ds = -alpha * supply_balance
+    dv = -alpha * voucher_balance
+    return _result(failed, dr, ds, dv)
+
+
+def get_input_price(dx, x_balance, y_balance, trade_fee=0.01):
+    """
+    Array version of `uniswap.get_input_price()`, returning (dx, dy, failed)
+    """
+    dx, x_balance, y_balance, trade_fee = _arrays(dx, x_balance, y_balance, trade_fee)
+    gamma = 1 - trade_fee
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = dx / x_balance
+        dy = (alpha * gamma / (1 + alpha * gamma)) * y_balance
+    _dx = alpha * x_balance
+
+    failed = (
+        ~(x_balance > 0)
+        | ~(y_balance > 0)
+        | ~((gamma > 0) & (gamma <= 1))
+        # Selling a negative amount, i.e. buying x, must leave a positive balance
+        | ~(x_balance + _dx > 0)
+        | ~(y_balance - dy > 0)
+    )
+    return _result(failed, _dx, -dy)
+
+
+def get_output_price(dy, x_balance, y_balance, trade_fee=0.01):
+    """
+    Array version of `uniswap.get_output_price()`, returning (dx, dy, failed)
+    """
+    dy, x_balance, y_balance, trade_fee = _arrays(dy, x_balance, y_balance, trade_fee)
+    gamma = 1 - trade_fee
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = dy / y_balance
+        dx = (beta / (1 - beta)) * (1 / gamma) * x_balance
+
+    failed = (
+        ~(x_balance > 0)
+        | ~(y_balance > 0)
+        | ~((gamma > 0) & (gamma <= 1))
+        # Buying the whole reserve, or more, is impossible
+        | ~(beta < 1)
+        | ~(x_balance + dx > 0)
+    )
+    return _result(failed, dx, -beta * y_balance)
+
+
+def collateral_to_token(value, reserve_balance, supply_balance, trade_fee):
+    """
+    Array version of `uniswap.collateral_to_token()`, returning (tokens, failed)
+    """
+    empty = np.asarray(reserve_balance) == 0
+    _, dy, failed = get_input_price(value, np.where(empty, 1.0, reserve_balance), supply_balance, trade_fee)
+    return np.where(empty, 0.0, np.abs(dy)), failed & ~empty
+
+
+def token_to_collateral(tokens, reserve_balance, supply_balance, trade_fee):
+    """
+    Array version of `uniswap.token_to_collateral()`, returning (collateral, failed)
+    """
+    empty = np.asarray(supply_balance) == 0
+    _, dy, failed = get_input_price(tokens, np.where(empty, 1.0, supply_balance), reserve_balance, trade_fee)
+    return np.where(empty, 0.0, np.abs(dy)), failed & ~empty
@@ -28,7 +28,11 @@ class ConverterFeedObservation(NamedTuple):
 
 class UniswapOracle:
     """
+    Uniswap TWAP oracle, consecutive slots medianizer.
 
+    Only the last `granularity + 1` observations are ever read, so they are kept in preallocated
+    ring buffers instead of growing lists: observation `i` is stored in slot `i % (granularity + 1)`.
+    Use `copy()` to snapshot the oracle, e.g. before updating it in a policy.
     """
 
     def __init__(
@@ -50,8 +54,13 @@ class UniswapOracle:
         self.period_size = window_size / granularity
         self.median_price: float = 0
 
-        self.uniswap_observations: List[UniswapObservation] = []
-        self.converter_feed_observations: List[ConverterFeedObservation] = []
+        # Ring buffers of the observations
+        self.slots: int = granularity + 1
+        self.observation_count: int = 0
+        self.timestamps: List[int] = [0] * self.slots
+        self.price_0_cumulatives: List[float] = [0.0] * self.slots
+        self.price_1_cumulatives: List[float] = [0.0] * self.slots
+        self.time_adjusted_prices: List[float] = [0.0] * self.slots
         self.converter_price_cumulative: float = 0.0
 
         self.price_0_cumulative: float = 0.0
@@ -66,6 +75,52 @@ class UniswapOracle:
             == self.window_size
         )
 
+    def copy(self) -> "UniswapOracle":
+        """
+        Snapshot of the oracle, copying only the ring buffers
+        """
+        oracle = object.__new__(UniswapOracle)
+        oracle.__dict__.update(self.__dict__)
+        oracle.timestamps = self.timestamps.copy()
+        oracle.price_0_cumulatives = self.price_0_cumulatives.copy()
+        oracle.price_1_cumulatives = self.price_1_cumulatives.copy()
+        oracle.time_adjusted_prices = self.time_adjusted_prices.copy()
+        return oracle
+
+    def __deepcopy__(self, memo) -> "UniswapOracle":
+        # The oracle only holds numbers, so a copy of the ring buffers is a deep copy
+        return self.copy()
+
+    def observation(self, index: int) -> Tuple[UniswapObservation, ConverterFeedObservation]:
+        """
+        Get the Uniswap and Converter Feed Observations with the given index,
+        which must be one of the last `granularity + 1` observations
+        """
+        assert self.observation_count - self.slots <= index < self.observation_count, index
+        slot = index % self.slots
+        return (
+            UniswapObservation(
+                self.timestamps[slot], self.price_0_cumulatives[slot], self.price_1_cumulatives[slot]
+            ),
+            ConverterFeedObservation(self.timestamps[slot], self.time_adjusted_prices[slot]),
+        )
+
+    @property
+    def uniswap_observations(self) -> List[UniswapObservation]:
+        """
+        The retained Uniswap Observations, oldest first
+        """
+        first = max(self.observation_count - self.slots, 0)
+        return [self.observation(index)[0] for index in range(first, self.observation_count)]
+
+    @property
+    def converter_feed_observations(self) -> List[ConverterFeedObservation]:
+        """
+        The retained Converter Feed Observations, oldest first
+        """
+        first = max(self.observation_count - self.slots, 0)
+        return [self.observation(index)[1] for index in range(first, self.observation_count)]
+
     def earliest_observation_index(self) -> int:
         if self.updates <= self.granularity:
             return 0
@@ -78,18 +133,7 @@ class UniswapOracle:
         """
         Get the first Uniswap and Converter Feed Observations
         """
-
-        earliest_observation_index = self.earliest_observation_index()
-
-        first_uniswap_observation = self.uniswap_observations[
-            earliest_observation_index
-        ]
-
-        first_converter_feed_observation = self.converter_feed_observations[
-            earliest_observation_index
-        ]
-
-        return first_uniswap_observation, first_converter_feed_observation
+        return self.observation(self.earliest_observation_index())
 
     def update_observations(
         self,
@@ -106,15 +150,13 @@ class UniswapOracle:
         price_feed_value = state["eth_price"]
         new_time_adjusted_price = price_feed_value * time_elapsed_since_latest
 
-        # Update observations
-        self.converter_feed_observations.append(
-            ConverterFeedObservation(now, new_time_adjusted_price)
-        )
-        self.uniswap_observations.append(
-            UniswapObservation(
-                now, uniswap_price_0_cumulative, uniswap_price_1_cumulative
-            )
-        )
+        # Update observations, overwriting the oldest slot
+        slot = self.observation_count % self.slots
+        self.timestamps[slot] = now
+        self.price_0_cumulatives[slot] = uniswap_price_0_cumulative
+        self.price_1_cumulatives[slot] = uniswap_price_1_cumulative
+        self.time_adjusted_prices[slot] = new_time_adjusted_price
+        self.observation_count += 1
 
         # Update cumm converte price
         self.converter_price_cumulative += new_time_adjusted_price
@@ -209,15 +251,15 @@ class UniswapOracle:
 
         last_update_time: int = self.last_update_time
 
-        if len(self.uniswap_observations) == 0:
+        if self.observation_count == 0:
             time_elapsed_since_latest = now - last_update_time
         else:
-            last_timestamp = self.uniswap_observations[-1].timestamp
+            last_timestamp = self.timestamps[(self.observation_count - 1) % self.slots]
             time_elapsed_since_latest = now - last_timestamp
 
         # Do not update if the elapsed time since last update
         # is below the period size.
-        condition = len(self.uniswap_observations) > 0
+        condition = self.observation_count > 0
         condition &= time_elapsed_since_latest < self.period_size
         if condition is True:
             return None
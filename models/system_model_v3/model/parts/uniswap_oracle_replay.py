@@ -0,0 +1,100 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from .uniswap_oracle import UniswapOracle
+
+"""
+Offline replay of the `UniswapOracle` TWAP over a recorded pool trajectory.
+
+Instead of stepping an oracle object through every state, the updates of each oracle configuration
+are located with `np.searchsorted`, and the Uniswap and converter feed cumulative prices are
+computed with cumulative sums, differenced over the observation window, as in
+`UniswapOracle.update_result()` and `UniswapOracle.get_median_price()`.
+
+The replay treats each row as a state observed by the oracle. In system_model_v3 the oracle observes
+the state within the 'Market price' substep, so replaying the end-of-timestep states of a results
+DataFrame approximates the simulated `market_price_twap`, which is enough for open-loop studies of
+the oracle configuration.
+"""
+
+
+def update_indices(cumulative_time: np.ndarray, period_size: float) -> np.ndarray:
+    """
+    Indices of the states at which the oracle updates, i.e. the first state,
+    then every state at least `period_size` after the latest update
+    """
+    indices = []
+    index = 0
+    while index < len(cumulative_time):
+        indices.append(index)
+        index = np.searchsorted(cumulative_time, cumulative_time[index] + period_size, side="left")
+    return np.asarray(indices, dtype=np.int64)
+
+
+def replay_twap(
+    cumulative_time,
+    ETH_balance,
+    RAI_balance,
+    eth_price,
+    granularity: int = 5,
+    window_size: int = 15 * 3600,
+    max_window_size: int = 21 * 3600,
+) -> np.ndarray:
+    """
+    The `median_price` of a `UniswapOracle` with the given configuration after observing each state,
+    where `cumulative_time` is increasing
+    """
+    # Validate the configuration
+    period_size = UniswapOracle(granularity, window_size, max_window_size).period_size
+
+    cumulative_time = np.asarray(cumulative_time)
+    indices = update_indices(cumulative_time, period_size)
+    now = cumulative_time[indices]
+    time_elapsed = np.diff(now, prepend=0)
+
+    ETH_balance, RAI_balance, eth_price = (np.asarray(series, dtype=np.float64)[indices] for series in (ETH_balance, RAI_balance, eth_price))
+    price_0_cumulative = np.cumsum(time_elapsed * ETH_balance / RAI_balance)
+    time_adjusted_price = np.cumsum(eth_price * time_elapsed)
+
+    # Observation `k` removes observation `k - granularity` from the converter cumulative price
+    updates = np.arange(len(indices))
+    converter_price_cumulative = time_adjusted_price - np.where(
+        updates >= granularity, time_adjusted_price[np.maximum(updates - granularity, 0)], 0.0
+    )
+
+    first = np.where(updates <= granularity, 0, updates - granularity)
+    time_since_first = now - now[first]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        uniswap_amount_out = (price_0_cumulative - price_0_cumulative[first]) / time_since_first
+        median_price = uniswap_amount_out * (converter_price_cumulative / time_since_first)
+    # The median price is only computed from the third update
+    median_price[updates <= 1] = 0.0
+
+    # The median price holds between updates
+    return median_price[np.searchsorted(indices, np.arange(len(cumulative_time)), side="right") - 1]
+
+
+def replay_results(df: pd.DataFrame, oracle_configs: List[dict]) -> pd.DataFrame:
+    """
+    Replay the TWAP of each oracle configuration (`UniswapOracle` keyword arguments) over every
+    (subset, run) trajectory of a results DataFrame.
+
+    Returns a DataFrame with the same index as `df` and one TWAP column per configuration;
+    the initial states (timestep 0) are not observed by the oracle, and their TWAP is NaN.
+    """
+    twap = np.full((len(df), len(oracle_configs)), np.nan)
+    observed = np.flatnonzero((df["timestep"] > 0).to_numpy())
+    columns = {key: df[key].to_numpy()[observed] for key in ("cumulative_time", "ETH_balance", "RAI_balance", "eth_price")}
+    for positions in df.iloc[observed].groupby(["subset", "run"], sort=False).indices.values():
+        rows = observed[positions]
+        for column, config in enumerate(oracle_configs):
+            twap[rows, column] = replay_twap(
+                columns["cumulative_time"][positions],
+                columns["ETH_balance"][positions],
+                columns["RAI_balance"][positions],
+                columns["eth_price"][positions],
+                **config,
+            )
+    return pd.DataFrame(twap, index=df.index, columns=range(len(oracle_configs)))
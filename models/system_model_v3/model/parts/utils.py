@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 import math
 import logging
 import time
@@ -30,6 +29,7 @@ def s_update_sim_metrics(params, substep, state_history, state, policy_input):
     return 'sim_metrics', sim_metrics
 
 def save_partial_results(params, substep, state_history, state):
+    import pandas as pd
     partial_results: pd.DataFrame = pd.read_pickle(params['partial_results'])
     partial_results = partial_results.append(state, ignore_index=True)
     partial_results.to_pickle(params['partial_results'])
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+
+"""
+Synthetic CDP population generator.
+
+Draws a heterogeneous book of liquidity CDPs from configurable distributions, instead of splitting
+the initial collateral and debt among N identical CDPs:
+* size: relative principal debt of each CDP, normalized so the population draws the total debt
+* liquidation_buffer: the collateralization each CDP rebalances to, as a multiple of the liquidation ratio
+* collateralization: the initial collateralization of each CDP, relative to its liquidation buffer
+
+Each distribution is the name of a `numpy.random.Generator` method and its keyword arguments,
+so a population is fully described by plain data, and can be cached by a hash of its parameters.
+
+The book is allocated directly as NumPy columns and saved to `<cache_dir>/<key>/<column>.npy`;
+later runs, and pathos workers, load the columns as copy-on-write memory maps instead of regenerating
+the population or pickling it.
+"""
+
+# Name of a `numpy.random.Generator` method, and its keyword arguments
+Distribution = Tuple[str, Dict[str, float]]
+
+default_distributions: Dict[str, Distribution] = {
+    "size": ("lognormal", {"mean": 0.0, "sigma": 1.0}),
+    "liquidation_buffer": ("uniform", {"low": 1.5, "high": 2.5}),
+    "collateralization": ("normal", {"loc": 1.0, "scale": 0.05}),
+}
+
+default_cache_dir = "models/system_model_v3/data/cdp_populations"
+
+# Bump when the generator changes, to invalidate cached populations
+generator_version = 1
+
+
+def draw(rng: np.random.Generator, distribution: Distribution, count: int) -> np.ndarray:
+    name, kwargs = distribution
+    return getattr(rng, name)(size=count, **kwargs)
+
+
+def population_key(**parameters) -> str:
+    """
+    Cache key of a population: a hash of its generator parameters
+    """
+    encoded = json.dumps({**parameters, "version": generator_version}, sort_keys=True, default=float)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def sample_cdp_population(
+    count: int,
+    total_debt: float,
+    eth_price: float,
+    target_price: float,
+    liquidation_ratio: float,
+    seed: int = 0,
+    distributions: Dict[str, Distribution] = None,
+    extra_cdps: List[dict] = (),
+) -> CDPBook:
+    """
+    Draw `count` liquidity CDPs, followed by the `extra_cdps` records (e.g. the aggregate arbitrage CDP)
+    """
+    distributions = {**default_distributions, **(distributions or {})}
+    rng = np.random.default_rng(seed)
+
+    size = draw(rng, distributions["size"], count)
+    liquidation_buffer = draw(rng, distributions["liquidation_buffer"], count)
+    collateralization = draw(rng, distributions["collateralization"], count)
+    if np.any(size <= 0) or np.any(liquidation_buffer < 1):
+        raise ValueError("CDP sizes must be positive, and liquidation buffers at least 1.0")
+
+    drawn = total_debt * size / size.sum()
+    # Start every CDP at or above the liquidation ratio
+    collateral_ratio = liquidation_ratio * np.maximum(liquidation_buffer * collateralization, 1.0)
+
+    book = CDPBook(capacity=count + len(extra_cdps))
+    book.size = count
+    book["open"] = True
+    book["drawn"] = drawn
+    book["normalized_debt"] = drawn
+    book["locked"] = drawn * target_price * collateral_ratio / eth_price
+    book["liquidation_buffer"] = liquidation_buffer
+    book.total_normalized_debt = book.sum("normalized_debt")
+    book.extend(extra_cdps)
+    return book
+
+
+def generate_cdp_population(
+    count: int,
+    total_debt: float,
+    eth_price: float,
+    target_price: float,
+    liquidation_ratio: float,
+    seed: int = 0,
+    distributions: Dict[str, Distribution] = None,
+    extra_cdps: List[dict] = (),
+    cache_dir: str = default_cache_dir,
+) -> CDPBook:
+    """
+    Load a cached CDP population, or sample and cache it; see `sample_cdp_population()`.
+
+    Set `cache_dir` to None to sample the population in memory without caching it.
+    """
+    parameters = dict(
+        count=count,
+        total_debt=total_debt,
+        eth_price=eth_price,
+        target_price=target_price,
+        liquidation_ratio=liquidation_ratio,
+        seed=seed,
+        distributions={**default_distributions, **(distributions or {})},
+        extra_cdps=list(extra_cdps),
+    )
+    if cache_dir is None:
+        return sample_cdp_population(**parameters)
+
+    path = os.path.join(cache_dir, population_key(**parameters))
+    if not os.path.isdir(path):
+        book = sample_cdp_population(**parameters)
+        # Save to a temporary directory and rename it, so concurrent workers never load a partial population
+        os.makedirs(cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=cache_dir)
+        book.save(staging)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Another process cached the same population first
+            shutil.rmtree(staging)
+    return CDPBook.load(path)
@@ -1,11 +1,117 @@
+import hashlib
+import json
+import os
+import tempfile
+
 import pandas as pd
 import numpy as np
 
+"""
+The Monte Carlo data CSVs (see data/README.md) are converted once to a `.npy` file next to the CSV,
+holding the values as a float64 array of shape (runs, timesteps), and a `.npy.json` file with the
+columns, index and the CSV file fingerprint. Later loads memory-map the array instead of parsing the CSV.
+
+The cache is rebuilt when the CSV size or modification time changes and its SHA-256 hash differs.
+The DataFrames and the initial ETH price are module attributes, loaded on first access.
+"""
+
+cache_version = 1
+
+eth_price_file = 'models/system_model_v3/data/eth_values_mc.csv'
+liquidity_demand_file = 'models/system_model_v3/data/liquidity_mc.csv'
+token_swap_file = 'models/system_model_v3/data/buy_sell_mc.csv'
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_metadata(path: str):
+    try:
+        with open(path + '.npy.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path: str, write) -> None:
+    # Write to a temporary file and rename it, so concurrent processes never load a partial file
+    descriptor, staging = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            write(f)
+        os.replace(staging, path)
+    except BaseException:
+        os.remove(staging)
+        raise
+
+
+def cache_mc_data(csv_path: str) -> str:
+    """
+    Convert a Monte Carlo data CSV to its `.npy` cache if it is missing or stale, and return the cache path
+    """
+    path = os.path.splitext(csv_path)[0]
+    stat = os.stat(csv_path)
+    metadata = _read_metadata(path)
+    fingerprint = {'version': cache_version, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    if metadata is not None and os.path.exists(path + '.npy'):
+        if all(metadata.get(key) == value for key, value in fingerprint.items()):
+            return path + '.npy'
+        if metadata.get('version') == cache_version and metadata.get('sha256') == _sha256(csv_path):
+            # e.g. touched by a git checkout: only update the fingerprint
+            _write_atomic(path + '.npy.json', lambda f: f.write(json.dumps({**metadata, **fingerprint}).encode()))
+            return path + '.npy'
+
+    df = pd.read_csv(csv_path, index_col=0)
+    index = df.index.tolist()
+    metadata = {
+        **fingerprint,
+        'sha256': _sha256(csv_path),
+        'columns': df.columns.tolist(),
+        # A default 0..N-1 index is not stored
+        'index': None if index == list(range(len(index))) else index,
+    }
+    _write_atomic(path + '.npy', lambda f: np.save(f, np.ascontiguousarray(df.to_numpy(dtype=np.float64).T)))
+    _write_atomic(path + '.npy.json', lambda f: f.write(json.dumps(metadata).encode()))
+    return path + '.npy'
+
+
+def load_mc_data(csv_path: str) -> pd.DataFrame:
+    """
+    Load a Monte Carlo data CSV as a DataFrame with one column per run, backed by the memory-mapped cache.
+
+    Falls back to reading the CSV if the cache can't be written, e.g. on a read-only file system.
+    """
+    try:
+        path = cache_mc_data(csv_path)
+    except OSError:
+        return pd.read_csv(csv_path, index_col=0)
+    metadata = _read_metadata(os.path.splitext(csv_path)[0])
+    # Copy-on-write memory map: the DataFrame is a view of the cache, and writes stay in memory
+    values = np.load(path, mmap_mode='c')
+    index = metadata['index'] if metadata['index'] is not None else pd.RangeIndex(values.shape[1])
+    return pd.DataFrame(values.T, index=index, columns=metadata['columns'], copy=False)
+
 
-eth_price_df = pd.read_csv('models/system_model_v3/data/eth_values_mc.csv', index_col=0)
+_mc_data_files = {
+    'eth_price_df': eth_price_file,
+    'liquidity_demand_df': liquidity_demand_file,
+    'token_swap_df': token_swap_file,
+}
 
-# Set the initial ETH price state
-eth_price = eth_price_df["0"].iloc[0]
 
-liquidity_demand_df = pd.read_csv('models/system_model_v3/data/liquidity_mc.csv', index_col=0)
-token_swap_df = pd.read_csv('models/system_model_v3/data/buy_sell_mc.csv', index_col=0)
+def __getattr__(name):
+    # The data is loaded on first access
+    if name in _mc_data_files:
+        globals()[name] = df = load_mc_data(_mc_data_files[name])
+        return df
+    if name == 'eth_price':
+        # Set the initial ETH price state
+        globals()[name] = eth_price = __getattr__('eth_price_df')["0"].iloc[0]
+        return eth_price
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,5 +1,7 @@
 # from .debt_market import eth_collateral
 from models.system_model_v3.model.parts.debt_market import open_cdp_lock
+from models.system_model_v3.model.parts.cdp_book import CDPBook
+from models.system_model_v3.model.state_variables.cdp_population import generate_cdp_population
 from models.system_model_v3.model.state_variables.historical_state import eth_price
 from models.system_model_v3.model.state_variables.system import target_price
 
@@ -9,6 +11,10 @@ import pandas as pd
 liquidation_ratio = 1.45
 liquidation_buffer = 2
 liquidity_cdp_count = 0 # Set to zero to disable liquidity CDPs, and only use aggregate arbitrage CDP
+# Set to a dict of distributions (see `cdp_population.py`) to draw a heterogeneous population of liquidity CDPs,
+# with per-CDP liquidation buffers, instead of identical CDPs; e.g. `{}` for the default distributions
+liquidity_cdp_distributions = None
+liquidity_cdp_seed = 0
 
 uniswap_cdp_rai_balance = 5e6
 uniswap_cdp_eth_collateral = uniswap_cdp_rai_balance * liquidation_ratio * liquidation_buffer * target_price / eth_price
@@ -18,7 +24,7 @@ arbitrage_cdp_eth_collateral = arbitrage_cdp_rai_balance * liquidation_ratio * t
 
 # Create a pool of initial CDPs
 cdp_list = []
-for i in range(liquidity_cdp_count):
+for i in range(liquidity_cdp_count if liquidity_cdp_distributions is None else 0):
     cdp_list.append({
         'open': 1, # Is the CDP open or closed? True/False == 1/0 for integer/float series
         'arbitrage': 0,
@@ -38,10 +44,22 @@ for i in range(liquidity_cdp_count):
 
 cdp_list.append({**open_cdp_lock(arbitrage_cdp_eth_collateral, eth_price, target_price, liquidation_ratio), 'arbitrage': 1})
 
-cdps = pd.DataFrame(cdp_list)
+if liquidity_cdp_distributions is None:
+    cdps = CDPBook.from_dataframe(pd.DataFrame(cdp_list))
+else:
+    cdps = generate_cdp_population(
+        liquidity_cdp_count,
+        uniswap_cdp_rai_balance,
+        eth_price,
+        target_price,
+        liquidation_ratio,
+        seed=liquidity_cdp_seed,
+        distributions=liquidity_cdp_distributions,
+        extra_cdps=cdp_list,
+    )
 
-eth_collateral = cdps["locked"].sum()
-principal_debt = cdps["drawn"].sum()
+eth_collateral = cdps.sum("locked")
+principal_debt = cdps.sum("drawn")
 
 uniswap_rai_balance = principal_debt
 uniswap_eth_balance = (uniswap_rai_balance * target_price) / eth_price
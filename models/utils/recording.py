@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from numbers import Number
+from typing import Iterable, Optional
+
+from radcad.core import SimulationExecution
+
+"""
+Recording spec of the simulation results: which state variables, and which timesteps, are kept in the results.
+
+e.g. `RecordingSpec(['market_price', 'target_price', 'sim_metrics'], every=24)` records the market and target price
+and the `sim_metrics` dict entries, as `sim_metrics_timestep_time`, once a day for an hourly model.
+
+The spec is applied while the simulation runs, in the process that runs it, so the dropped states are never
+sent back from the pathos workers. The last two timesteps are kept as they are until the end of a run,
+as the model functions may read or clear them through `state_history`.
+"""
+
+# Always recorded, to identify the result rows
+index_columns = ['simulation', 'subset', 'run', 'substep', 'timestep']
+
+
+class RecordingSpec:
+    def __init__(self, state_variables: Optional[Iterable[str]] = None, every: int = 1, flatten: bool = True):
+        """
+        * state_variables: the state variables to record, or None for all of them
+        * every: record every Nth timestep, and the first and last timesteps of a run
+        * flatten: record each entry of a dict-valued state variable as a `{key}_{entry}` column,
+          instead of the dict; entries that aren't scalars are dropped
+        """
+        assert every >= 1, every
+        self.state_variables = None if state_variables is None else list(state_variables)
+        self.every = every
+        self.flatten = flatten
+
+    def keeps(self, timestep: int) -> bool:
+        return timestep % self.every == 0
+
+    def record(self, state: dict) -> dict:
+        """
+        The recorded columns of a state
+        """
+        if self.state_variables is None:
+            keys = state.keys()
+        else:
+            keys = [key for key in index_columns if key in state] + [key for key in self.state_variables if key not in index_columns]
+        record = {}
+        for key in keys:
+            value = state[key]
+            if self.flatten and isinstance(value, dict):
+                record.update(
+                    (f'{key}_{entry}', entry_value)
+                    for entry, entry_value in value.items() if isinstance(entry_value, (Number, str))
+                )
+            else:
+                record[key] = value
+        return record
+
+    def record_history(self, state_history: list, start: int, stop: int, last: bool = False) -> None:
+        """
+        Record the timesteps `state_history[start:stop]`, in place, dropping the timesteps that aren't kept;
+        with `last`, the final timestep of `state_history` is kept
+        """
+        end = len(state_history)
+        for index in range(start, stop):
+            state_history[index] = self.record_timestep(state_history[index], keep=index == 0 or (last and index == end - 1))
+
+    def record_timestep(self, substates: list, keep: bool = False) -> list:
+        """
+        Record the substates of a timestep, or drop them if the timestep isn't kept; with `keep`, it is kept
+        """
+        if keep or (substates and self.keeps(substates[-1]['timestep'])):
+            return [self.record(state) for state in substates]
+        return []
+
+    def records(self, states: list) -> list:
+        """
+        Record a flat list of result states, e.g. the cadCAD results
+        """
+        last_timesteps = {}
+        for state in states:
+            key = (state['simulation'], state['subset'], state['run'])
+            last_timesteps[key] = max(last_timesteps.get(key, 0), state['timestep'])
+        return [
+            self.record(state) for state in states
+            if self.keeps(state['timestep']) or state['timestep'] == last_timesteps[(state['simulation'], state['subset'], state['run'])]
+        ]
+
+
+@dataclass
+class RecordingSimulationExecution(SimulationExecution):
+    """
+    radCAD simulation execution recording the results with a `RecordingSpec`, set as the engine `simulation_execution`
+    """
+    recording: RecordingSpec = None
+
+    def after_step(self) -> None:
+        super().after_step()
+        # Keep the last two timesteps of the history as they are
+        recorded = len(self.result) - 3
+        if self.recording is not None and recorded >= 0:
+            self.recording.record_history(self.result, recorded, recorded + 1)
+
+    def execute(self):
+        try:
+            return super().execute()
+        finally:
+            if self.recording is not None:
+                # Also record the partial history of a failed run
+                self.recording.record_history(self.result, max(len(self.result) - 2, 0), len(self.result), last=True)
@@ -1,32 +1,51 @@
 # Import shared deps
+#
+# The dependencies are imported on first access, e.g. `from shared import px` only imports plotly,
+# and `from shared import *` imports everything
 
-import matplotlib.pyplot as plt
 from decimal import Decimal
+import importlib
 import itertools
-import plotly.express as px
-import numpy as np
-import pandas as pd
-pd.options.mode.chained_assignment = None
-pd.options.plotting.backend = "plotly"
 
 import sys
 sys.path.append('./models')
 
-# Import cadCAD
 
-from cadCAD.configuration import Experiment
-from cadCAD import configs
-from models.config_wrapper import ConfigWrapper
+def _pandas():
+    import pandas as pd
+    pd.options.mode.chained_assignment = None
+    pd.options.plotting.backend = "plotly"
+    return pd
 
-# Import model utils
 
-import models.options as options
-from models.run import run
-from models.utils.load_data import load_debt_price_data
-from models.utils.process_results import drop_dataframe_midsteps
+_imports = {
+    'plt': lambda: importlib.import_module('matplotlib.pyplot'),
+    'px': lambda: importlib.import_module('plotly.express'),
+    'np': lambda: importlib.import_module('numpy'),
+    'pd': _pandas,
 
-# Import models
+    # Import cadCAD
+    'Experiment': lambda: importlib.import_module('cadCAD.configuration').Experiment,
+    'configs': lambda: importlib.import_module('cadCAD').configs,
+    'ConfigWrapper': lambda: importlib.import_module('models.config_wrapper').ConfigWrapper,
 
-import models.system_model_v1 as system_model_v1
-import models.system_model_v2 as system_model_v2
-import models.system_model_v3 as system_model_v3
+    # Import model utils
+    'options': lambda: importlib.import_module('models.options'),
+    'run': lambda: importlib.import_module('models.run').run,
+    'load_debt_price_data': lambda: importlib.import_module('models.utils.load_data').load_debt_price_data,
+    'drop_dataframe_midsteps': lambda: importlib.import_module('models.utils.process_results').drop_dataframe_midsteps,
+
+    # Import models
+    'system_model_v1': lambda: importlib.import_module('models.system_model_v1'),
+    'system_model_v2': lambda: importlib.import_module('models.system_model_v2'),
+    'system_model_v3': lambda: importlib.import_module('models.system_model_v3'),
+}
+
+__all__ = ['Decimal', 'itertools', 'sys', *_imports]
+
+
+def __getattr__(name):
+    if name in _imports:
+        globals()[name] = value = _imports[name]()
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,202 @@
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Backend
+
+from experiments.checkpoint import Checkpoint, current_git_hash, fingerprint
+from experiments import result_store
+from experiments.result_store import PartitionedResultStore, StreamingEngine
+from models.system_model_v3.model.parts.exogenous import ExogenousDriver
+
+executed = []
+
+
+def p_step(params, substep, state_history, state):
+    if state['timestep'] == 0:
+        executed.append((state['subset'], state['run']))
+    if state['timestep'] >= params['fail_at']:
+        raise ValueError(state['timestep'])
+    return {'delta': params['rate'] * params['driver'](state['run'], state['timestep'])}
+
+
+def s_value(params, substep, state_history, state, policy_input):
+    return 'value', state['value'] + policy_input['delta']
+
+
+def model(**params):
+    return Model(
+        initial_state={'value': 0.0},
+        state_update_blocks=[{'policies': {'step': p_step}, 'variables': {'value': s_value}}],
+        params={'rate': [1.0, 2.0, 3.0], 'fail_at': [100, 4, 100], 'driver': [ExogenousDriver(np.arange(40.0).reshape(2, 20))], **params},
+    )
+
+
+class InterruptedStore(PartitionedResultStore):
+    def __init__(self, directory, writes):
+        super().__init__(directory)
+        self.writes = writes
+
+    def write(self, *args, **kwargs):
+        if self.writes == 0:
+            raise KeyboardInterrupt
+        self.writes -= 1
+        super().write(*args, **kwargs)
+
+
+def run(store, checkpoint, model):
+    experiment = Experiment([Simulation(model=model, timesteps=10, runs=2)])
+    experiment.engine = StreamingEngine(
+        store, checkpoint=checkpoint, backend=Backend.SINGLE_PROCESS, raise_exceptions=False, deepcopy=False, drop_substeps=True
+    )
+    executed.clear()
+    experiment.run()
+    return experiment
+
+
+def assert_same_store(store, expected):
+    assert store.partitions() == expected.partitions()
+    pd.testing.assert_frame_equal(store.results(), expected.results())
+    assert list(store.exceptions()['exception'].map(repr)) == list(expected.exceptions()['exception'].map(repr))
+
+
+def test_resume(tmp_path):
+    expected = PartitionedResultStore(str(tmp_path / 'expected'))
+    run(expected, None, model())
+    assert len(executed) == 6
+
+    checkpoint_directory = str(tmp_path / 'checkpoints')
+    with pytest.raises(KeyboardInterrupt):
+        run(InterruptedStore(str(tmp_path / 'interrupted'), writes=4), Checkpoint(checkpoint_directory, git_hash='a'), model())
+
+    # A new experiment, with another results ID, only runs the remaining units
+    store = PartitionedResultStore(str(tmp_path / 'resumed'))
+    experiment = run(store, Checkpoint(checkpoint_directory, git_hash='a'), model())
+    assert executed == [(1, 2), (2, 2)]
+    assert [(e['subset'], e['run']) for e in experiment.exceptions] == [(1, 2), (2, 2)]
+    assert_same_store(store, expected)
+
+    # Every unit is completed
+    run(store, Checkpoint(checkpoint_directory, git_hash='a'), model())
+    assert executed == []
+    assert_same_store(store, expected)
+
+    # Another commit, or other parameters, don't resume from the checkpoint
+    run(PartitionedResultStore(str(tmp_path / 'commit')), Checkpoint(checkpoint_directory, git_hash='b'), model())
+    assert len(executed) == 6
+    run(PartitionedResultStore(str(tmp_path / 'params')), Checkpoint(checkpoint_directory, git_hash='a'), model(rate=[1.0, 2.0, 4.0]))
+    assert executed == [(2, 1), (2, 2)]
+
+
+def test_reordered_sweep(tmp_path):
+    checkpoint_directory = str(tmp_path / 'checkpoints')
+    run(PartitionedResultStore(str(tmp_path / 'first')), Checkpoint(checkpoint_directory, git_hash='a'), model())
+
+    # The same parameter sets in another order are other units: their subset, and so their random streams, differ
+    swapped = dict(rate=[3.0, 2.0, 1.0], fail_at=[100, 4, 100])
+    store = PartitionedResultStore(str(tmp_path / 'swapped'))
+    run(store, Checkpoint(checkpoint_directory, git_hash='a'), model(**swapped))
+    assert executed == [(0, 1), (2, 1), (0, 2), (2, 2)]
+
+    expected = PartitionedResultStore(str(tmp_path / 'expected'))
+    run(expected, None, model(**swapped))
+    assert_same_store(store, expected)
+
+
+@pytest.mark.parametrize('failure', [
+    # radCAD's fail-safe, for errors outside of the simulation
+    lambda simulation_execution: ([], RuntimeError('worker')),
+    lambda simulation_execution: ([], {
+        'exception': MemoryError(), 'traceback': None, 'simulation': 0, 'run': simulation_execution.run_index,
+        'subset': simulation_execution.subset_index, 'timesteps': 10, 'parameters': {}, 'initial_state': {},
+    }),
+])
+def test_worker_failures_are_not_checkpointed(tmp_path, monkeypatch, failure):
+    multiprocess_wrapper = result_store.core.multiprocess_wrapper
+
+    def wrapper(simulation_execution):
+        if (simulation_execution.subset_index, simulation_execution.run_index) == (0, 1):
+            return failure(simulation_execution)
+        return multiprocess_wrapper(simulation_execution)
+
+    checkpoint_directory = str(tmp_path / 'checkpoints')
+    monkeypatch.setattr(result_store.core, 'multiprocess_wrapper', wrapper)
+    run(PartitionedResultStore(str(tmp_path / 'failed')), Checkpoint(checkpoint_directory, git_hash='a'), model())
+    monkeypatch.undo()
+
+    # The failed unit is run again; the model exception of subset 1 is a completed unit
+    run(PartitionedResultStore(str(tmp_path / 'resumed')), Checkpoint(checkpoint_directory, git_hash='a'), model())
+    assert executed == [(0, 1)]
+
+
+def test_predicted_cost(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), git_hash='a')
+    experiment = run(PartitionedResultStore(str(tmp_path / 'results')), checkpoint, model())
+    [simulation_execution] = [
+        execution for execution in experiment.engine._run_stream(experiment.simulations)
+        if (execution.subset_index, execution.run_index) == (0, 1)
+    ]
+    assert checkpoint.predicted_cost(simulation_execution) > 0
+
+    # The durations are read back, and shared by the runs of a parameter set for any commit
+    later = Checkpoint(str(tmp_path), git_hash='b')
+    assert later.durations == checkpoint.durations
+    assert len(later.durations) == 3 and all(len(durations) == 2 for durations in later.durations.values())
+    assert later.predicted_cost(simulation_execution) == checkpoint.predicted_cost(simulation_execution)
+
+
+def test_cost_prior(tmp_path):
+    def executions(experiment):
+        return {
+            (execution.subset_index, execution.run_index): execution
+            for execution in experiment.engine._run_stream(experiment.simulations)
+        }
+
+    # Without any recorded unit, the prior is the timesteps, or the experiment's own prior
+    empty = Checkpoint(str(tmp_path / 'empty'), git_hash='a')
+    first = executions(run(PartitionedResultStore(str(tmp_path / 'first')), None, model()))
+    assert empty.predicted_cost(first[(0, 1)]) == 10
+    assert empty.predicted_cost(first[(2, 1)], prior=lambda execution: execution.params['rate'] * 10) == 30
+
+    # New parameter sets are predicted from the recorded units' progress, and the recorded timestep duration
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'), git_hash='a')
+    run(PartitionedResultStore(str(tmp_path / 'results')), checkpoint, model(fail_at=[4, 4, 100]))
+    assert sorted(checkpoint.progress) == [0.4, 0.4, 0.4, 0.4, 1.0, 1.0]
+    other = executions(run(PartitionedResultStore(str(tmp_path / 'other')), None, model(rate=[4.0, 5.0, 6.0])))
+    seconds = float(np.median(checkpoint.timestep_durations))
+    assert checkpoint.predicted_cost(other[(0, 1)]) == pytest.approx(4 * seconds)
+
+    # The units of an unrelated experiment with the same subset indices are predicted alike
+    assert checkpoint.predicted_cost(other[(2, 1)]) == checkpoint.predicted_cost(other[(0, 1)])
+
+
+def test_fingerprint():
+    assert fingerprint({'a': 1, 'b': [1.0, None]}) == fingerprint({'b': [1.0, None], 'a': 1})
+    assert fingerprint({'a': 1}) != fingerprint({'a': 1.0})
+    assert fingerprint(lambda x, y: x - y) == fingerprint(lambda x, y: x - y)
+    assert fingerprint(lambda x, y: x - y) != fingerprint(lambda x, y: y - x)
+    assert fingerprint(ExogenousDriver([1.0, 2.0])) != fingerprint(ExogenousDriver([1.0, 3.0]))
+    assert fingerprint(pd.DataFrame({'a': [1.0]})) != fingerprint(pd.DataFrame({'b': [1.0]}))
+
+
+def test_git_hash_ignores_run_logs(tmp_path):
+    def git(*args):
+        subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test', *args], cwd=tmp_path, stdout=subprocess.DEVNULL)
+
+    (tmp_path / 'models').mkdir()
+    (tmp_path / 'models' / 'model.py').write_text('rate = 1\n')
+    (tmp_path / 'experiments').mkdir()
+    (tmp_path / 'experiments' / 'experiment_run_log.md').write_text('# Runs\n')
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'init')
+    committed = current_git_hash(str(tmp_path))
+
+    # A run writes its log entry to the working tree
+    (tmp_path / 'experiments' / 'experiment_run_log.md').write_text('Passed: False\n# Runs\n')
+    assert current_git_hash(str(tmp_path)) == committed
+
+    (tmp_path / 'models' / 'model.py').write_text('rate = 2\n')
+    assert current_git_hash(str(tmp_path)).startswith(committed + '+')
@@ -0,0 +1,81 @@
+import pandas as pd
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Engine, Backend
+
+from models.utils.recording import RecordingSpec, RecordingSimulationExecution
+from models.system_model_v3.model.lockstep import LockstepExperiment
+from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
+from models.system_model_v3.model.params.init import params
+from models.system_model_v3.model.state_variables.init import state_variables
+
+
+def p_step(params, substep, state_history, state):
+    if state['timestep'] >= params['fail_at']:
+        raise ValueError(state['timestep'])
+    return {'delta': params['rate']}
+
+
+def s_value(params, substep, state_history, state, policy_input):
+    return 'value', state['value'] + policy_input['delta']
+
+
+def s_metrics(params, substep, state_history, state, policy_input):
+    return 'metrics', {'count': state['timestep'], 'mean': state['value'] / 2, 'events': []}
+
+
+toy_model = Model(
+    initial_state={'value': 0.0, 'metrics': {}, 'cdps': None},
+    state_update_blocks=[
+        {'policies': {'step': p_step}, 'variables': {'value': s_value}},
+        {'policies': {}, 'variables': {'metrics': s_metrics}},
+    ],
+    params={'rate': [1.0, 2.0], 'fail_at': [100, 7]},
+)
+
+
+def run(model, timesteps, recording=None, drop_substeps=True):
+    experiment = Experiment([Simulation(model=model, timesteps=timesteps, runs=2)])
+    experiment.engine = Engine(
+        backend=Backend.SINGLE_PROCESS,
+        simulation_execution=RecordingSimulationExecution(
+            raise_exceptions=False, enable_deepcopy=False, drop_substeps=drop_substeps, recording=recording
+        ),
+    )
+    experiment.run()
+    return pd.DataFrame(experiment.results)
+
+
+def test_recording_spec():
+    recording = RecordingSpec(['value', 'metrics'], every=4)
+    df = run(toy_model, timesteps=10, recording=recording)
+
+    assert list(df.columns) == ['simulation', 'subset', 'run', 'substep', 'timestep', 'value', 'metrics_count', 'metrics_mean']
+    assert df['metrics_count'].dtype.kind == 'f'  # NaN in the initial state
+    # Every 4th timestep, and the last timestep of each run; subset 1 fails at timestep 7
+    assert df.query('subset == 0')['timestep'].tolist() == [0, 4, 8, 10] * 2
+    assert df.query('subset == 1')['timestep'].tolist() == [0, 4, 7] * 2
+
+    full = run(toy_model, timesteps=10)
+    expected = pd.DataFrame(recording.records(full.to_dict('records')))
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_recording_substeps():
+    df = run(toy_model, timesteps=6, recording=RecordingSpec(['value'], every=3, flatten=False), drop_substeps=False)
+    assert df.query('subset == 0 and run == 1')[['timestep', 'substep']].values.tolist() == \
+        [[0, 0], [3, 1], [3, 2], [6, 1], [6, 2]]
+
+
+def test_lockstep_recording_matches_radcad():
+    recording = RecordingSpec(['market_price', 'target_price', 'cdp_metrics', 'optimal_values'], every=5)
+    model = Model(initial_state=state_variables, state_update_blocks=partial_state_update_blocks, params=params)
+    expected = run(model, timesteps=12, recording=recording)
+
+    for retain_history in (True, False):
+        lockstep = LockstepExperiment(model, timesteps=12, runs=2, recording=recording, retain_history=retain_history)
+        lockstep.run()
+        df = pd.DataFrame(lockstep.results)
+
+        assert df['timestep'].tolist() == [0, 5, 10, 12] * 2
+        assert 'cdp_metrics_open_cdp_count' in df.columns
+        pd.testing.assert_frame_equal(df, expected)
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Engine, Backend
+
+from experiments.result_store import PartitionedResultStore, StreamingEngine
+from models.system_model_v3.model.lockstep import LockstepExperiment
+
+
+def p_step(params, substep, state_history, state):
+    if state['timestep'] >= params['fail_at']:
+        raise ValueError(state['timestep'])
+    return {'delta': params['rate']}
+
+
+def s_value(params, substep, state_history, state, policy_input):
+    return 'value', state['value'] + policy_input['delta']
+
+
+model = Model(
+    initial_state={'value': 0.0},
+    state_update_blocks=[{'policies': {'step': p_step}, 'variables': {'value': s_value}}],
+    params={'rate': [1.0, 2.0, 3.0], 'fail_at': [100, 4, 100]},
+)
+
+
+def run(engine):
+    experiment = Experiment([Simulation(model=model, timesteps=10, runs=2)])
+    experiment.engine = engine
+    experiment.run()
+    return experiment
+
+
+@pytest.mark.parametrize('backend', [Backend.SINGLE_PROCESS, Backend.PATHOS])
+def test_streamed_results_match_radcad(tmp_path, backend):
+    options = dict(raise_exceptions=False, deepcopy=False, drop_substeps=True)
+    expected = run(Engine(backend=Backend.SINGLE_PROCESS, **options))
+
+    store = PartitionedResultStore(str(tmp_path / 'results'))
+    experiment = run(StreamingEngine(store, backend=backend, processes=2, **options))
+
+    assert experiment.results == []
+    assert store.partitions() == [(0, 1), (1, 1), (2, 1), (0, 2), (1, 2), (2, 2)]
+    pd.testing.assert_frame_equal(store.results(), pd.DataFrame(expected.results))
+
+    exceptions = store.exceptions()
+    # The runs are written in the order they complete
+    assert sorted((e['subset'], e['run']) for e in experiment.exceptions if e['exception']) == [(1, 1), (1, 2)]
+    assert list(exceptions['exception'].map(repr)) == [repr(e['exception']) for e in expected.exceptions]
+
+
+def test_write_experiment(tmp_path):
+    store = PartitionedResultStore(str(tmp_path))
+    results = [{'subset': subset, 'run': run, 'timestep': timestep} for run in (1, 2) for subset in (0, 1) for timestep in range(3)]
+    store.write_experiment(results, [{'subset': 1, 'run': 2, 'exception': None, 'parameters': {'rate': 1.0}}])
+
+    assert store.partitions() == [(0, 1), (1, 1), (0, 2), (1, 2)]
+    pd.testing.assert_frame_equal(store.results(), pd.DataFrame(results))
+    assert store.read(1, 2)['exceptions']['parameters'][0] == '{"0":{"rate":1.0}}'
+    assert store.read(0, 1)['exceptions'].empty
+    # No partial or staging files are left
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_runs_are_dispatched_longest_first(tmp_path):
+    store = PartitionedResultStore(str(tmp_path))
+    engine = StreamingEngine(
+        store, cost=lambda simulation_execution: simulation_execution.params['rate'],
+        backend=Backend.SINGLE_PROCESS, raise_exceptions=False, deepcopy=False, drop_substeps=True,
+    )
+    experiment = run(engine)
+    # Runs of equal cost keep the radCAD order
+    assert [(e['subset'], e['run']) for e in experiment.exceptions] == [(2, 1), (2, 2), (1, 1), (1, 2), (0, 1), (0, 2)]
+    assert store.partitions() == [(0, 1), (1, 1), (2, 1), (0, 2), (1, 2), (2, 2)]
+
+
+def test_lockstep_results_are_written_by_lane(tmp_path):
+    expected = run(Engine(backend=Backend.SINGLE_PROCESS, raise_exceptions=False, deepcopy=False, drop_substeps=True))
+
+    store = PartitionedResultStore(str(tmp_path))
+    lockstep = LockstepExperiment(model, timesteps=10, runs=2, retain_history=False, store=store)
+    lockstep.run()
+
+    assert lockstep.results == []
+    pd.testing.assert_frame_equal(store.results(), pd.DataFrame(expected.results))
+    assert list(store.exceptions()['exception'].map(repr)) == [repr(e['exception']) for e in expected.exceptions]
@@ -0,0 +1,124 @@
+import os
+import time
+
+import pandas as pd
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Backend
+
+from experiments.checkpoint import Checkpoint
+from experiments.result_store import PartitionedResultStore, StreamingEngine
+from experiments import sweep_queue
+from experiments.sweep_queue import SweepQueue, run_workers, DONE, FAILED
+
+
+def p_step(params, substep, state_history, state):
+    if state['timestep'] == 0 and params['mode'] != 'none':
+        # Misbehave on the first attempt of the task, or on every attempt with 'crash_always'
+        marker = os.path.join(params['marker_directory'], f"{state['subset']}-{state['run']}")
+        first_attempt = not os.path.exists(marker)
+        open(marker, 'a').close()
+        if params['mode'] == 'crash_always' or (params['mode'] == 'crash' and first_attempt):
+            os._exit(1)
+        if params['mode'] == 'straggle' and first_attempt:
+            time.sleep(3)
+    if state['timestep'] >= params['fail_at']:
+        raise ValueError(state['timestep'])
+    return {'delta': params['rate']}
+
+
+def s_value(params, substep, state_history, state, policy_input):
+    return 'value', state['value'] + policy_input['delta']
+
+
+def model(tmp_path, modes):
+    return Model(
+        initial_state={'value': 0.0},
+        state_update_blocks=[{'policies': {'step': p_step}, 'variables': {'value': s_value}}],
+        params={
+            'rate': [1.0, 2.0, 3.0],
+            'fail_at': [100, 4, 100],
+            'mode': modes,
+            'marker_directory': [str(tmp_path)],
+        },
+    )
+
+
+def expected_store(tmp_path):
+    store = PartitionedResultStore(str(tmp_path / 'expected'))
+    experiment = Experiment([Simulation(model=model(tmp_path, ['none'] * 3), timesteps=10, runs=2)])
+    experiment.engine = StreamingEngine(store, backend=Backend.SINGLE_PROCESS, raise_exceptions=False, deepcopy=False, drop_substeps=True)
+    experiment.run()
+    return store
+
+
+def assert_same_results(store, expected):
+    assert store.partitions() == expected.partitions()
+    columns = ['subset', 'run', 'timestep', 'value']
+    pd.testing.assert_frame_equal(store.results(columns), expected.results(columns))
+
+
+def test_workers(tmp_path):
+    directory = str(tmp_path / 'sweep')
+    queue = SweepQueue.create(directory, model(tmp_path, ['none'] * 3), timesteps=10, runs=2)
+    assert run_workers(directory, processes=3, poll=0.1) == {'pending': 0, 'running': 0, 'done': 6, 'failed': 0}
+    assert_same_results(queue.store, expected_store(tmp_path))
+    # Model exceptions are recorded as results
+    assert queue.store.read(1, 2)['exceptions']['exception'].map(repr).tolist() == ['ValueError(4)']
+
+
+def test_crashed_worker_is_retried(tmp_path):
+    directory = str(tmp_path / 'sweep')
+    queue = SweepQueue.create(directory, model(tmp_path, ['none', 'crash', 'crash_always']), timesteps=10, runs=1, max_attempts=2)
+    status = run_workers(directory, processes=4, lease=0.5, poll=0.1, straggler_factor=None)
+
+    assert status == {'pending': 0, 'running': 0, 'done': 2, 'failed': 1}
+    tasks = {(task['subset'], task['run']): task for task in queue.tasks()}
+    assert tasks[(1, 1)]['status'] == DONE and tasks[(1, 1)]['attempts'] == 2
+    assert tasks[(2, 1)]['status'] == FAILED and tasks[(2, 1)]['attempts'] == 2
+    assert queue.store.partitions() == [(0, 1), (1, 1)]
+
+
+def test_straggler_is_copied(tmp_path):
+    directory = str(tmp_path / 'sweep')
+    queue = SweepQueue.create(directory, model(tmp_path, ['straggle', 'none', 'none']), timesteps=10, runs=2)
+    assert run_workers(directory, processes=3, poll=0.1)['done'] == 6
+
+    straggler = queue.tasks()[0]
+    assert straggler['copies'] == 1
+    # The speculative copy completed before the straggling first attempt
+    assert straggler['finished'] - straggler['started'] < 3
+    assert_same_results(queue.store, expected_store(tmp_path))
+
+
+def test_resume_from_checkpoint(tmp_path):
+    checkpoint_directory = str(tmp_path / 'checkpoints')
+    directory = str(tmp_path / 'sweep')
+    SweepQueue.create(directory, model(tmp_path, ['none'] * 3), timesteps=10, runs=2, checkpoint=Checkpoint(checkpoint_directory, git_hash='a'))
+    run_workers(directory, processes=2, poll=0.1)
+
+    queue = SweepQueue.create(str(tmp_path / 'resumed'), model(tmp_path, ['none'] * 3), timesteps=10, runs=2, checkpoint=Checkpoint(checkpoint_directory, git_hash='a'))
+    assert queue.status()['done'] == 6
+    assert_same_results(queue.store, expected_store(tmp_path))
+
+
+def test_tasks_are_claimed_longest_first(tmp_path):
+    queue = SweepQueue.create(
+        str(tmp_path / 'sweep'), model(tmp_path, ['none'] * 3), timesteps=10, runs=2,
+        cost=lambda simulation_execution: simulation_execution.params['rate'],
+    )
+    assert [(task['subset'], task['run']) for task in queue.tasks()] == [(2, 1), (2, 2), (1, 1), (1, 2), (0, 1), (0, 2)]
+
+
+def test_default_processes(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'sweep')
+    SweepQueue.create(directory, model(tmp_path, ['none'] * 3), timesteps=10, runs=2)
+
+    tasks = []
+    monkeypatch.setattr(sweep_queue, 'pool_size', lambda size: tasks.append(size) or 2)
+    monkeypatch.setattr(sweep_queue, 'threads_per_worker', lambda processes: 8 // processes)
+    monkeypatch.setattr(sweep_queue, 'NUMEXPR_MAX_THREADS', None)
+    monkeypatch.setenv('NUMEXPR_MAX_THREADS', '')
+    assert run_workers(directory, poll=0.1)['done'] == 6
+    # The pool is sized for the pending tasks, and the workers share the cores
+    assert tasks == [6]
+    assert os.environ['NUMEXPR_MAX_THREADS'] == '4'
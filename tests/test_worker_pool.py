@@ -0,0 +1,27 @@
+from experiments import worker_pool
+
+
+def test_pool_size(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'available_cores', lambda: 32)
+    monkeypatch.setattr(worker_pool, 'available_memory', lambda: 16 << 30)
+
+    assert worker_pool.pool_size() == 16
+    assert worker_pool.pool_size(process_memory=256 << 20) == 32
+    assert worker_pool.pool_size(tasks=5) == 5
+    assert worker_pool.pool_size(process_memory=32 << 30) == 1
+
+    monkeypatch.setattr(worker_pool, 'available_memory', lambda: None)
+    assert worker_pool.pool_size() == 32
+
+
+def test_threads_per_worker(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'available_cores', lambda: 32)
+    assert worker_pool.threads_per_worker(32) == 1
+    assert worker_pool.threads_per_worker(6) == 5
+    assert worker_pool.threads_per_worker(64) == 1
+    assert worker_pool.threads_per_worker(1) == 32
+
+
+def test_available_resources():
+    assert worker_pool.available_cores() >= 1
+    assert worker_pool.available_memory() > 0